@@ -0,0 +1,77 @@
+import argparse
+import copy
+import os
+import tempfile
+
+import pyarrow as pa
+from benchmarks.helpers import build_readings, directory_size, timer
+
+from lambda_processing.compaction import chunk_windows, compacted_row_groups
+from lambda_processing.files_processor import MAX_ROWS_PER_GROUP, dump_to_parquet
+from lambda_processing.sparse_tables import chunk_file_paths, chunk_schema, sparse_row_groups, write_sparse_dataset
+
+CHUNK_FORMATS = ("parquet", "arrow", "arrow_lz4")
+# Proxy pools stay referenced until exit, buffers allocated from them can outlive a measurement
+TRACKING_POOLS = []
+
+
+def run(rows, readings_per_asset):
+    # A day of one product, FilesProcessor writes 96 chunks and ParquetFilesProcessor assembles them
+    data_assets = build_readings(rows, products=("mars",), readings_per_asset=readings_per_asset)
+    print(f"{rows} data assets with {readings_per_asset} readings each\n")
+    print(
+        f"{'format':<10} {'write, s':>9} {'chunks, KB':>11} {'read, s':>8} {'assemble, s':>12}"
+        f" {'peak read Arrow memory, MB':>27}"
+    )
+    default_pool = pa.default_memory_pool()
+    for chunk_format in CHUNK_FORMATS:
+        results = {}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = os.path.join(temp_dir, "15min_chunks")
+            with timer(results, "write"):
+                chunk_paths = dump_to_parquet(
+                    copy.deepcopy(data_assets), output_path, "bench", chunk_format=chunk_format
+                )
+            size = directory_size(output_path) / 1024
+            file_paths_by_window = [
+                (window, [file_path for chunk_path in paths for file_path in chunk_file_paths(chunk_path)])
+                for window, paths in chunk_windows(chunk_paths)
+            ]
+            file_paths = [file_path for _window, paths in file_paths_by_window for file_path in paths]
+
+            # Reading is what the daily assembly spends on decoding, Arrow IPC chunks are only memory-mapped
+            pool = pa.proxy_memory_pool(default_pool)
+            TRACKING_POOLS.append(pool)
+            pa.set_memory_pool(pool)
+            try:
+                with timer(results, "read"):
+                    for _row_group in sparse_row_groups(file_paths):
+                        pass
+            finally:
+                pa.set_memory_pool(default_pool)
+            peak = pool.max_memory() / 1024 / 1024
+
+            schema = pa.unify_schemas([chunk_schema(file_path) for file_path in file_paths])
+            with timer(results, "assemble"):
+                write_sparse_dataset(
+                    compacted_row_groups(file_paths_by_window),
+                    schema,
+                    os.path.join(temp_dir, "daily.parquet"),
+                    max_rows_per_group=MAX_ROWS_PER_GROUP,
+                )
+        print(
+            f"{chunk_format:<10} {results['write']:>9.3f} {size:>11.0f} {results['read']:>8.3f}"
+            f" {results['assemble']:>12.3f} {peak:>27.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Parquet and Arrow IPC formats of 15min chunks.")
+    parser.add_argument("--rows", type=int, default=500000, help="Number of data assets (default: 500000)")
+    parser.add_argument("--readings-per-asset", type=int, default=20, help="Reading keys per data asset (default: 20)")
+    args = parser.parse_args()
+    run(args.rows, args.readings_per_asset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from benchmarks.helpers import build_readings, timer
+from tests.fake_s3 import FakeS3Client
+
+from lambda_processing import chunks_compactor, parquet_files_processor
+from lambda_processing.files_processor import dump_to_parquet
+from lambda_processing.s3_transfer import S3Transfer
+
+BUCKET_NAME = "s3silver-bucket"
+CHUNK_PREFIX = "15min_chunks/job_1001/s3bronze-bucket"
+
+
+class LatencyS3Client(FakeS3Client):
+    """Every request waits for the first byte latency of S3, the transfer time of tiny chunks is negligible."""
+
+    def __init__(self, latency_seconds):
+        super().__init__()
+        self.latency_seconds = latency_seconds
+
+    def head_object(self, *args, **kwargs):
+        time.sleep(self.latency_seconds)
+        return super().head_object(*args, **kwargs)
+
+    def download_file(self, *args, **kwargs):
+        time.sleep(self.latency_seconds)
+        super().download_file(*args, **kwargs)
+
+    def upload_file(self, *args, **kwargs):
+        time.sleep(self.latency_seconds)
+        super().upload_file(*args, **kwargs)
+
+
+def run(invocations, rows_per_invocation, latency_ms, concurrency):
+    # Each FilesProcessor invocation gets a few readings of every 15 minutes window of the day
+    s3_client = LatencyS3Client(latency_ms / 1000)
+    chunk_keys = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for index in range(invocations):
+            output_path = os.path.join(temp_dir, f"invocation_{index}")
+            readings = build_readings(rows_per_invocation, products=("mars",), seed=index)
+            for chunk_path in dump_to_parquet(readings, output_path, f"{index:08x}"):
+                key = f"{CHUNK_PREFIX}/{os.path.relpath(chunk_path, output_path)}/part-0.parquet"
+                with open(os.path.join(chunk_path, "part-0.parquet"), "rb") as f:
+                    s3_client.put(BUCKET_NAME, key, f.read())
+                chunk_keys.append(key)
+    print(
+        f"{invocations} FilesProcessor invocations, {rows_per_invocation} readings each -> {len(chunk_keys)} chunks,"
+        f" {latency_ms} ms per S3 request, {concurrency} concurrent requests\n"
+    )
+
+    results = {}
+    with patch.dict("os.environ", {"PARQUET_FILES_BUCKET_NAME": BUCKET_NAME}):
+        with tempfile.TemporaryDirectory() as temp_dir, timer(results, "assemble chunks"):
+            parquet_files_processor.lambda_handler(
+                [chunk_keys], {}, s3_client, temp_dir, s3_transfer=S3Transfer(s3_client, concurrency)
+            )
+        with tempfile.TemporaryDirectory() as temp_dir, timer(results, "compact"):
+            compacted = chunks_compactor.lambda_handler(
+                [chunk_keys], {}, s3_client, temp_dir, S3Transfer(s3_client, concurrency), min_chunk_bytes=1024 * 1024
+            )
+        with tempfile.TemporaryDirectory() as temp_dir, timer(results, "assemble compacted"):
+            parquet_files_processor.lambda_handler(
+                compacted, {}, s3_client, temp_dir, s3_transfer=S3Transfer(s3_client, concurrency)
+            )
+
+    print(f"\n{'step':<20} {'objects':>8} {'time, s':>8}")
+    print(f"{'assemble chunks':<20} {len(chunk_keys):>8} {results['assemble chunks']:>8.2f}")
+    print(f"{'compact':<20} {len(chunk_keys):>8} {results['compact']:>8.2f}")
+    print(f"{'assemble compacted':<20} {len(compacted[0]):>8} {results['assemble compacted']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark daily assembly of tiny 15min chunks and compacted ones.")
+    parser.add_argument("--invocations", type=int, default=20, help="FilesProcessor invocations (default: 20)")
+    parser.add_argument("--rows", type=int, default=400, help="Readings per invocation (default: 400)")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Latency of an S3 request (default: 20)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent S3 requests (default: 8)")
+    args = parser.parse_args()
+    run(args.invocations, args.rows, args.latency_ms, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import argparse
+import copy
+import os
+import tempfile
+
+from benchmarks.helpers import build_readings, directory_size, timer, with_duplicates
+
+from lambda_processing.files_processor import dump_to_parquet
+
+DEDUP_KEY_COLUMNS = ["dataAsset", "timestamp"]
+
+
+def run(rows):
+    readings = build_readings(rows)
+    print(f"{'duplicates':>10} {'plain, s':>9} {'dedup, s':>9} {'plain, KB':>10} {'dedup, KB':>10}")
+    for duplicates_share in (0.0, 0.1, 0.5):
+        data_assets = with_duplicates(readings, duplicates_share)
+        results = {}
+        sizes = {}
+        for name, key_columns in (("plain", None), ("dedup", DEDUP_KEY_COLUMNS)):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                output_path = os.path.join(temp_dir, "generated_files")
+                # dump_to_parquet normalizes data assets in place
+                assets_copy = copy.deepcopy(data_assets)
+                with timer(results, name):
+                    dump_to_parquet(assets_copy, output_path, "bench", key_columns)
+                sizes[name] = directory_size(output_path) / 1024
+        print(
+            f"{duplicates_share:>10.0%} {results['plain']:>9.3f} {results['dedup']:>9.3f}"
+            f" {sizes['plain']:>10.0f} {sizes['dedup']:>10.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark deduplication of readings in 15min Parquet chunks.")
+    parser.add_argument("--rows", type=int, default=200000, help="Number of readings in the input (default: 200000)")
+    args = parser.parse_args()
+    run(args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import argparse
+import json
+import os
+import tempfile
+
+from benchmarks.helpers import build_readings, timer
+
+from lambda_processing.files_processor import normalize_inplace
+from lambda_processing.json_parsers import JSON_PARSERS, load_raw_data_file, resolve_json_parser
+
+
+def run(rows, readings_per_asset, repeats):
+    # The same data assets as a JSON array and as newline-delimited JSON, every parser reads both files
+    data_assets = build_readings(rows, readings_per_asset=readings_per_asset)
+    print(f"{rows} data assets with {readings_per_asset} readings each, best of {repeats} runs\n")
+    print(
+        f"{'input':<8} {'parser':<10} {'used':<10} {'parse, s':>9} {'MB/s':>7} {'+ normalize, s':>15} {'assets/s':>10}"
+    )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_paths = {"array": os.path.join(temp_dir, "raw.json"), "ndjson": os.path.join(temp_dir, "raw.ndjson")}
+        with open(file_paths["array"], "w") as f:
+            json.dump(data_assets, f, indent=4)
+        with open(file_paths["ndjson"], "w") as f:
+            f.writelines(json.dumps(data_asset) + "\n" for data_asset in data_assets)
+
+        for input_name, file_path in file_paths.items():
+            megabytes = os.path.getsize(file_path) / 1024 / 1024
+            for parser in JSON_PARSERS[1:]:
+                used_parser = resolve_json_parser(parser, ndjson=input_name == "ndjson")
+                parse_seconds = []
+                normalize_seconds = []
+                for _ in range(repeats):
+                    results = {}
+                    with timer(results, "parse"):
+                        parsed_assets = load_raw_data_file(file_path, parser)
+                    with timer(results, "normalize"):
+                        for data_asset in parsed_assets:
+                            normalize_inplace(data_asset)
+                    parse_seconds.append(results["parse"])
+                    normalize_seconds.append(results["parse"] + results["normalize"])
+                parse = min(parse_seconds)
+                total = min(normalize_seconds)
+                print(
+                    f"{input_name:<8} {parser:<10} {used_parser:<10} {parse:>9.3f} {megabytes / parse:>7.1f}"
+                    f" {total:>15.3f} {rows / total:>10.0f}"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON parsers of Raw data files on the same inputs.")
+    parser.add_argument("--rows", type=int, default=200000, help="Number of data assets (default: 200000)")
+    parser.add_argument("--readings-per-asset", type=int, default=5, help="Reading keys per data asset (default: 5)")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs of each parser, the best is shown (default: 3)")
+    args = parser.parse_args()
+    run(args.rows, args.readings_per_asset, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
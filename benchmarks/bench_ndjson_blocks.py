@@ -0,0 +1,59 @@
+import argparse
+import json
+import os
+import tempfile
+
+from benchmarks.helpers import build_readings, timer
+
+from lambda_processing.json_parsers import load_raw_data_file
+
+
+def write_ndjson_file(file_path, size_mb, readings_per_asset):
+    # Lines of 10000 distinct data assets are repeated until the file reaches the size
+    lines = "".join(
+        json.dumps(data_asset) + "\n" for data_asset in build_readings(10000, readings_per_asset=readings_per_asset)
+    )
+    block = lines.encode("utf-8")
+    target_size = size_mb * 1024 * 1024
+    with open(file_path, "wb") as f:
+        written = 0
+        while written < target_size:
+            f.write(block)
+            written += len(block)
+    return written
+
+
+def run(size_mb, workers_counts, parser, readings_per_asset):
+    print(f"{os.cpu_count()} cores, {parser} parser\n")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_path = os.path.join(temp_dir, "raw.ndjson")
+        megabytes = write_ndjson_file(file_path, size_mb, readings_per_asset) / 1024 / 1024
+        print(f"{megabytes:.0f} MB newline-delimited JSON file\n")
+        print(f"{'workers':>8} {'data assets':>12} {'parse, s':>9} {'MB/s':>7} {'speedup':>8}")
+        single_worker_seconds = None
+        for workers_count in workers_counts:
+            results = {}
+            with timer(results, "parse"):
+                data_assets_count = len(load_raw_data_file(file_path, parser, parse_workers=workers_count))
+            seconds = results["parse"]
+            single_worker_seconds = single_worker_seconds or seconds
+            print(
+                f"{workers_count:>8} {data_assets_count:>12} {seconds:>9.2f} {megabytes / seconds:>7.1f}"
+                f" {single_worker_seconds / seconds:>7.2f}x"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel block parsing of a newline-delimited JSON file.")
+    parser.add_argument("--size-mb", type=int, default=1024, help="Size of the Raw data file in MB (default: 1024)")
+    parser.add_argument(
+        "--workers", type=str, default="1,2,4,8", help="Comma separated parse workers counts (default: 1,2,4,8)"
+    )
+    parser.add_argument("--parser", type=str, default="orjson", help="JSON parser (default: orjson)")
+    parser.add_argument("--readings-per-asset", type=int, default=5, help="Reading keys per data asset (default: 5)")
+    args = parser.parse_args()
+    run(args.size_mb, [int(count) for count in args.workers.split(",")], args.parser, args.readings_per_asset)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import copy
+import os
+import random
+import tempfile
+
+import pyarrow.compute as pc
+from benchmarks.helpers import build_readings, directory_size, timer
+from pyarrow import dataset as ds
+
+from lambda_processing.files_processor import dump_to_parquet
+
+
+def build_variable_readings(rows, reading_keys):
+    # Like build_data_asset, every data asset sends its own subset of up to ~100 reading keys
+    rng = random.Random(0)
+    readings = build_readings(rows, products=("mars",), readings_per_asset=0)
+    for reading in readings:
+        keys = rng.sample(range(reading_keys), rng.randint(1, min(100, reading_keys)))
+        reading["iotreadings"] = {f"value{key}": rng.randint(0, 100) for key in keys}
+    return readings
+
+
+def run(rows, reading_keys):
+    data_assets = build_variable_readings(rows, reading_keys)
+    print(f"{rows} data assets with up to 100 of {reading_keys} reading keys each\n")
+    print(f"{'shape':<6} {'write, s':>9} {'size, KB':>9} {'full scan, s':>13} {'one reading scan, s':>20}")
+    for output_shape in ("wide", "long"):
+        results = {}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = os.path.join(temp_dir, "generated_files")
+            assets_copy = copy.deepcopy(data_assets)
+            with timer(results, "write"):
+                dump_to_parquet(assets_copy, output_path, "bench", output_shape=output_shape)
+            size = directory_size(output_path) / 1024
+
+            dataset = ds.dataset(output_path, format="parquet")
+            with timer(results, "full_scan"):
+                dataset.to_table()
+            with timer(results, "one_reading_scan"):
+                if output_shape == "wide":
+                    dataset.to_table(columns=["timestamp", "iotreadings_value1"])
+                else:
+                    table = dataset.to_table(columns=["timestamp", "reading_name", "value_int"])
+                    table.filter(pc.equal(table["reading_name"].cast("string"), "value1"))
+        print(
+            f"{output_shape:<6} {results['write']:>9.3f} {size:>9.0f}"
+            f" {results['full_scan']:>13.3f} {results['one_reading_scan']:>20.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark wide and long output shapes of 15min Parquet chunks.")
+    parser.add_argument("--rows", type=int, default=50000, help="Number of data assets (default: 50000)")
+    parser.add_argument("--reading-keys", type=int, default=300, help="Distinct reading keys (default: 300)")
+    args = parser.parse_args()
+    run(args.rows, args.reading_keys)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import argparse
+import copy
+import os
+import tempfile
+
+from benchmarks.helpers import build_readings, directory_size, timer
+
+from lambda_processing.files_processor import dump_to_parquet
+
+
+def run(rows, products, workers_counts):
+    # Readings of a day spread over products x 96 quarters, so dump_to_parquet writes many small chunks
+    data_assets = build_readings(rows, products=tuple(f"product{i}" for i in range(products)))
+    print(f"{rows} data assets of {products} products, {os.cpu_count()} cores\n")
+    print(f"{'workers':>7} {'write, s':>9} {'speedup':>8} {'chunks':>7} {'size, KB':>9}")
+    sequential_seconds = None
+    for workers in workers_counts:
+        results = {}
+        assets_copy = copy.deepcopy(data_assets)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_path = os.path.join(temp_dir, "generated_files")
+            with timer(results, "write"):
+                chunk_paths = dump_to_parquet(assets_copy, output_path, "bench", write_workers=workers)
+            size = directory_size(output_path) / 1024
+        sequential_seconds = sequential_seconds or results["write"]
+        speedup = sequential_seconds / results["write"]
+        print(f"{workers:>7} {results['write']:>9.3f} {speedup:>8.2f} {len(chunk_paths):>7} {size:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel writes of 15min Parquet chunks.")
+    parser.add_argument("--rows", type=int, default=200000, help="Number of data assets (default: 200000)")
+    parser.add_argument("--products", type=int, default=20, help="Number of products (default: 20)")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, 6], help="Write workers to compare (default: 1 2 4 6)"
+    )
+    args = parser.parse_args()
+    run(args.rows, args.products, args.workers)
+
+
+if __name__ == "__main__":
+    main()
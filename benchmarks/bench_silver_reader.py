@@ -0,0 +1,63 @@
+import argparse
+import io
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+from pyarrow import parquet as pq
+from tests.fake_s3 import FakeS3Client
+
+from lambda_processing.silver_reader import SilverReader
+
+BUCKET = "s3silver"
+SOURCE_BUCKET = "medallion-lakehouse-s3bronze"
+JOB_ID = "bench"
+DAILY_KEY = f"job_{JOB_ID}/{SOURCE_BUCKET}/mars/2024/09/30/2024-09-30.{JOB_ID}.snappy.parquet/part-0.parquet"
+QUERIES = [
+    ("1 column, 1 hour", "2024-09-30T13:00:00Z", "2024-09-30T14:00:00Z", ["iotreadings_value1"]),
+    ("1 column, whole day", "2024-09-30T00:00:00Z", "2024-10-01T00:00:00Z", ["iotreadings_value1"]),
+    ("all columns, 1 hour", "2024-09-30T13:00:00Z", "2024-09-30T14:00:00Z", None),
+]
+
+
+def build_daily_parquet_bytes(rows, columns):
+    seconds = np.sort(np.random.default_rng(0).integers(0, 24 * 60 * 60, rows))
+    timestamps = [f"2024-09-30T{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}.000Z" for s in seconds]
+    values = {f"iotreadings_value{i}": np.random.default_rng(i).integers(0, 100, rows) for i in range(1, columns + 1)}
+    table = pa.table({"timestamp": timestamps, "dataAsset": ["mars"] * rows, **values})
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="snappy", row_group_size=10000)
+    return buffer.getvalue()
+
+
+def run(rows, columns):
+    s3_client = FakeS3Client()
+    data = build_daily_parquet_bytes(rows, columns)
+    s3_client.put(BUCKET, DAILY_KEY, data)
+    print(f"Daily file: {rows} rows, {columns} iotreadings columns, {len(data) / 1024:.0f} KB\n")
+    print(f"{'query':<22} {'rows':>8} {'fetched, KB':>12} {'of file':>8} {'requests':>8} {'cached GETs':>12}")
+
+    for name, start, end, query_columns in QUERIES:
+        with tempfile.TemporaryDirectory() as cache_directory:
+            reader = SilverReader(s3_client, BUCKET, SOURCE_BUCKET, cache_directory=cache_directory)
+            table = reader.read(JOB_ID, "mars", start, end, query_columns)
+            fetched = reader.stats["bytes_fetched"]
+            requests_before = s3_client.requests["get_object"]
+            reader.read(JOB_ID, "mars", start, end, query_columns)
+            cached_requests = s3_client.requests["get_object"] - requests_before
+        print(
+            f"{name:<22} {table.num_rows:>8} {fetched / 1024:>12.0f} {fetched / len(data):>8.1%}"
+            f" {reader.stats['requests']:>8} {cached_requests:>12}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bytes fetched by SilverReader against full downloads.")
+    parser.add_argument("--rows", type=int, default=500000, help="Rows in the daily Parquet file (default: 500000)")
+    parser.add_argument("--columns", type=int, default=50, help="Number of iotreadings columns (default: 50)")
+    args = parser.parse_args()
+    run(args.rows, args.columns)
+
+
+if __name__ == "__main__":
+    main()
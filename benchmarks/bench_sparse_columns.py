@@ -0,0 +1,82 @@
+import argparse
+import copy
+import os
+import random
+import tempfile
+import time
+
+import pyarrow as pa
+from benchmarks.helpers import build_readings, directory_size, timer
+
+from lambda_processing.files_processor import dump_to_parquet
+
+
+def build_sparse_readings(rows, reading_keys, keys_per_asset, key_sets):
+    # Every data asset sends a few of many reading keys, like a fleet of heterogeneous devices.
+    # key_sets=0 gives every data asset its own key set, the worst case for grouping by key set
+    rng = random.Random(0)
+    readings = build_readings(rows, products=("mars",), day="2024-09-30", readings_per_asset=0)
+    fleet_key_sets = [rng.sample(range(reading_keys), keys_per_asset) for _ in range(key_sets)]
+    for reading in readings:
+        reading["timestamp"] = "2024-09-30T13:" + reading["timestamp"][14:]
+        keys = rng.choice(fleet_key_sets) if key_sets else rng.sample(range(reading_keys), keys_per_asset)
+        reading["iotreadings"] = {f"value{key}": rng.randint(0, 100) for key in keys}
+    return readings
+
+
+def dump_dense(data_assets, output_directory_path):
+    # Previous writer, one table per chunk with the union of keys, nulls are materialized for all missing readings
+    dump_to_parquet(data_assets, output_directory_path, "bench", max_column_sets=1)
+
+
+def dump_sparse(data_assets, output_directory_path):
+    dump_to_parquet(data_assets, output_directory_path, "bench")
+
+
+def run(rows, reading_keys, keys_per_asset, key_sets_cases):
+    print(f"{rows} data assets with {keys_per_asset} of {reading_keys} reading keys each\n")
+    print(f"{'key sets':>9} {'writer':<7} {'write, s':>9} {'CPU, s':>7} {'peak Arrow memory, MB':>22} {'size, KB':>9}")
+    default_pool = pa.default_memory_pool()
+    for key_sets in key_sets_cases:
+        data_assets = build_sparse_readings(rows, reading_keys, keys_per_asset, key_sets)
+        for name, dump in (("dense", dump_dense), ("sparse", dump_sparse)):
+            results = {}
+            assets_copy = copy.deepcopy(data_assets)
+            # Proxy pool tracks the peak of Arrow allocations of this writer only
+            pool = pa.proxy_memory_pool(default_pool)
+            pa.set_memory_pool(pool)
+            try:
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    output_path = os.path.join(temp_dir, "generated_files")
+                    cpu_started_at = time.process_time()
+                    with timer(results, "write"):
+                        dump(assets_copy, output_path)
+                    cpu_seconds = time.process_time() - cpu_started_at
+                    size = directory_size(output_path) / 1024
+            finally:
+                pa.set_memory_pool(default_pool)
+            peak = pool.max_memory() / 1024 / 1024
+            key_sets_label = key_sets or "per asset"
+            print(
+                f"{key_sets_label:>9} {name:<7} {results['write']:>9.3f} {cpu_seconds:>7.3f} {peak:>22.1f} {size:>9.0f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dense and sparse writers of 15min Parquet chunks.")
+    parser.add_argument("--rows", type=int, default=100000, help="Number of data assets (default: 100000)")
+    parser.add_argument("--reading-keys", type=int, default=500, help="Distinct reading keys (default: 500)")
+    parser.add_argument("--keys-per-asset", type=int, default=10, help="Reading keys per data asset (default: 10)")
+    parser.add_argument(
+        "--key-sets",
+        type=int,
+        nargs="+",
+        default=[4, 16, 64, 200, 0],
+        help="Distinct key sets of the fleet to run, 0 gives every data asset its own (default: 4 16 64 200 0)",
+    )
+    args = parser.parse_args()
+    run(args.rows, args.reading_keys, args.keys_per_asset, args.key_sets)
+
+
+if __name__ == "__main__":
+    main()
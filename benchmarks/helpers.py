@@ -0,0 +1,51 @@
+import os
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+
+def build_readings(count, products=("mars", "pluto"), day="2024-09-30", readings_per_asset=5, seed=0):
+    # Faker based factories are too slow for hundreds of thousands of readings
+    rng = random.Random(seed)
+    start = datetime.fromisoformat(day)
+    readings = []
+    for i in range(count):
+        timestamp = start + timedelta(seconds=rng.randrange(24 * 60 * 60), milliseconds=i % 1000)
+        readings.append(
+            {
+                "timestamp": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+                "dataAsset": rng.choice(products),
+                "iotreadings": {f"value{k}": rng.randint(0, 100) for k in range(1, readings_per_asset + 1)},
+            }
+        )
+    return readings
+
+
+def with_duplicates(readings, duplicates_share, seed=0):
+    # Replaces the given share of readings with copies of other readings, keeping the total count
+    rng = random.Random(seed)
+    duplicates_count = int(len(readings) * duplicates_share)
+    originals = readings[: len(readings) - duplicates_count]
+    duplicates = [
+        dict(rng.choice(originals), iotreadings=dict(rng.choice(originals)["iotreadings"]))
+        for _ in range(duplicates_count)
+    ]
+    result = originals + duplicates
+    rng.shuffle(result)
+    return result
+
+
+def directory_size(path):
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for file_name in files:
+            total += os.path.getsize(os.path.join(root, file_name))
+    return total
+
+
+@contextmanager
+def timer(results, name):
+    start = time.perf_counter()
+    yield
+    results[name] = time.perf_counter() - start
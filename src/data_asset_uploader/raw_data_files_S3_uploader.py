@@ -1,11 +1,21 @@
 import argparse
-import boto3
-import uuid
+import json
 import os
-
+import sys
+import tempfile
+import uuid
 from datetime import datetime
 
+import boto3
+
+# S3 transfer module is shared with the lambdas
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lambda_processing"))
+
+from json_parsers import NDJSON_EXTENSIONS, load_raw_data_file
+from s3_transfer import S3Transfer
+
 RAW_DATA_DIRECTORY_PATH = "data/"
+UPLOAD_CONCURRENCY = 8
 
 
 def aws_config():
@@ -19,7 +29,13 @@ def aws_config():
         raise KeyError(f"Missing environment variable: {e}")
 
 
-def upload_raw_data(raw_data_directory_path, job_uuid, s3_client=None):
+def upload_raw_data(raw_data_directory_path, job_uuid, s3_client=None, concurrency=UPLOAD_CONCURRENCY, ndjson=False):
+    if ndjson:
+        # Converted files are uploaded from a temporary directory, the original ones stay as they are
+        with tempfile.TemporaryDirectory() as ndjson_directory_path:
+            convert_to_ndjson(raw_data_directory_path, ndjson_directory_path)
+            return upload_raw_data(ndjson_directory_path, job_uuid, s3_client, concurrency)
+
     print("Uploading raw data files.")
     print(f"job:        {job_uuid}")
     print(f"directory:  {raw_data_directory_path}\n")
@@ -33,11 +49,31 @@ def upload_raw_data(raw_data_directory_path, job_uuid, s3_client=None):
         )
 
     bucket = config["bucket_name"]
+    key_by_file_path = {}
     for file_name in os.listdir(raw_data_directory_path):
         file_path = os.path.join(raw_data_directory_path, file_name)
         s3_key = f"{datetime.now().strftime('%Y/%m/%d')}/job_{job_uuid}/{file_name}"
         print(f"Uploading {file_name} to s3://{bucket}/{s3_key}.")
-        s3_client.upload_file(file_path, bucket, s3_key)
+        key_by_file_path[file_path] = s3_key
+
+    s3_transfer = S3Transfer(s3_client, max_concurrency=concurrency)
+    s3_transfer.upload_files(bucket, key_by_file_path)
+    s3_transfer.print_statistics()
+
+
+def convert_to_ndjson(raw_data_directory_path, ndjson_directory_path):
+    # "raw-1.json" with a JSON array of data assets -> "raw-1.ndjson" with one data asset per line,
+    # FilesProcessor parses large newline-delimited files in parallel blocks
+    for file_name in sorted(os.listdir(raw_data_directory_path)):
+        file_path = os.path.join(raw_data_directory_path, file_name)
+        if file_name.endswith(NDJSON_EXTENSIONS):
+            ndjson_file_name = file_name
+        else:
+            ndjson_file_name = f"{os.path.splitext(file_name)[0]}.ndjson"
+        print(f"Converting {file_name} to {ndjson_file_name}.")
+        data_assets = load_raw_data_file(file_path, "auto")
+        with open(os.path.join(ndjson_directory_path, ndjson_file_name), "w") as f:
+            f.writelines(json.dumps(data_asset) + "\n" for data_asset in data_assets)
 
 
 def main():
@@ -52,6 +88,18 @@ def main():
         help="Directory containing raw data files in JSON format (default: /data)",
     )
     parser.add_argument("--job_uuid", type=str, default=None, help="Job UUID (default: randomly generated)")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=UPLOAD_CONCURRENCY,
+        help=f"Number of files uploaded at the same time (default: {UPLOAD_CONCURRENCY})",
+    )
+
+    parser.add_argument(
+        "--ndjson",
+        action="store_true",
+        help="Convert files with a JSON array of data assets to newline-delimited JSON before upload",
+    )
 
     args = parser.parse_args()
 
@@ -63,7 +111,7 @@ def main():
         print(f"Error: The specified raw data files directory '{raw_data_dir}' does not exist.")
         return
 
-    upload_raw_data(raw_data_dir, job_uuid)
+    upload_raw_data(raw_data_dir, job_uuid, concurrency=args.concurrency, ndjson=args.ndjson)
 
 
 if __name__ == "__main__":
@@ -1,47 +1,198 @@
-import boto3
 import json
+import math
 import os
 import time
+import uuid
+from collections import deque
+
+import boto3
+
+# INLINE Map runs up to 40 FilesProcessors of an EXPRESS state machine started synchronously.
+# DISTRIBUTED Map of a STANDARD state machine reads batches from a JSON lines manifest in S3
+# and writes FilesProcessor results to S3, so neither is limited by the 256 KB state payload
+MAP_MODES = ("INLINE", "DISTRIBUTED")
+BATCH_MANIFESTS_PREFIX = "_batch_manifests"
+EXECUTION_POLL_SECONDS = 2
+# Auto-tuning keeps durations of the last executions, a cold pooler starts from the static values
+RECENT_EXECUTIONS_COUNT = 5
+DEFAULT_TARGET_EXECUTION_SECONDS = 120
+DEFAULT_MAX_FILES_PER_PROCESSOR = 100
+
+# Kept by a warm pooler lambda between invocations
+_batch_tuner = None
+
+
+class BatchTuner:
+    """Chooses processors count, files per processor and batching window of a run from the queue depth."""
 
+    def __init__(
+        self,
+        max_processors_count,
+        default_files_per_processor,
+        max_batching_window_in_seconds,
+        min_files_per_processor=1,
+        max_files_per_processor=DEFAULT_MAX_FILES_PER_PROCESSOR,
+        target_execution_seconds=DEFAULT_TARGET_EXECUTION_SECONDS,
+    ):
+        self.max_processors_count = max_processors_count
+        self.default_files_per_processor = default_files_per_processor
+        self.max_batching_window_in_seconds = max_batching_window_in_seconds
+        self.min_files_per_processor = min_files_per_processor
+        self.max_files_per_processor = max_files_per_processor
+        self.target_execution_seconds = target_execution_seconds
+        self.recent_executions = deque(maxlen=RECENT_EXECUTIONS_COUNT)
 
-def lambda_handler(trigger_event, context, sqs=None, stepfunctions=None):
+    @classmethod
+    def from_env(cls):
+        return cls(
+            int(os.environ["FILE_PROCESSORS_COUNT"]),
+            int(os.environ["RAW_DATA_FILES_PER_PROCESSOR"]),
+            float(os.environ["MAXIMUM_BATCHING_WINDOW_IN_SECONDS"]),
+            int(os.environ.get("MIN_RAW_DATA_FILES_PER_PROCESSOR", "1")),
+            int(os.environ.get("MAX_RAW_DATA_FILES_PER_PROCESSOR", str(DEFAULT_MAX_FILES_PER_PROCESSOR))),
+            float(os.environ.get("TARGET_EXECUTION_SECONDS", DEFAULT_TARGET_EXECUTION_SECONDS)),
+        )
+
+    def record_execution(self, duration_seconds, files_per_processor):
+        # Processors run in parallel, so the execution takes about as long as the one with the most files
+        if files_per_processor > 0:
+            self.recent_executions.append((files_per_processor, duration_seconds))
+
+    def fitting_files_count(self):
+        # Duration is fixed overhead plus time per file, both fitted by least squares over recent executions.
+        # With one batch size among them the whole duration counts as time per file
+        if not self.recent_executions:
+            return self.default_files_per_processor
+        files_counts = [files_count for files_count, _duration in self.recent_executions]
+        durations = [duration for _files_count, duration in self.recent_executions]
+        mean_files_count = sum(files_counts) / len(files_counts)
+        mean_duration = sum(durations) / len(durations)
+        variance = sum((files_count - mean_files_count) ** 2 for files_count in files_counts)
+        seconds_per_file = overhead_seconds = 0
+        if variance > 0:
+            covariance = sum(
+                (files_count - mean_files_count) * (duration - mean_duration)
+                for files_count, duration in self.recent_executions
+            )
+            seconds_per_file = covariance / variance
+            overhead_seconds = max(mean_duration - seconds_per_file * mean_files_count, 0)
+        if seconds_per_file <= 0:
+            seconds_per_file = max(duration / files_count for files_count, duration in self.recent_executions)
+            overhead_seconds = 0
+        return int((self.target_execution_seconds - overhead_seconds) / max(seconds_per_file, 1e-3))
+
+    def tune(self, pending_files_count):
+        # Under backlog all processors take as many files as fit into the target execution time,
+        # a quiet queue gets fewer processors, smaller batches and a shorter wait for more messages
+        files_limit = min(max(self.fitting_files_count(), self.min_files_per_processor), self.max_files_per_processor)
+
+        pending_files_count = max(pending_files_count, 1)
+        processors_count = min(max(math.ceil(pending_files_count / files_limit), 1), self.max_processors_count)
+        files_per_processor = min(
+            max(math.ceil(pending_files_count / processors_count), self.min_files_per_processor), files_limit
+        )
+        fill = min(pending_files_count / (self.max_processors_count * files_limit), 1)
+        return processors_count, files_per_processor, self.max_batching_window_in_seconds * fill
+
+
+def lambda_handler(
+    trigger_event, context, sqs=None, stepfunctions=None, s3=None, sleep=time.sleep, batch_tuner=None, clock=time.time
+):
     file_keys_list = files_from_trigger_event(trigger_event)
     if file_keys_list == []:
-        return None
+        return
 
     print(f"Trigger event has following file keys: {file_keys_list}")
 
     files_per_processor = int(os.environ["RAW_DATA_FILES_PER_PROCESSOR"])
     file_processors_count = int(os.environ["FILE_PROCESSORS_COUNT"])
-    total_files_count = file_processors_count * files_per_processor
     max_batching_window_in_seconds = float(os.environ["MAXIMUM_BATCHING_WINDOW_IN_SECONDS"])
+    # 0 waits the whole batching window for a full batch, 1 takes only the files queued already
+    latency_weight = float(os.environ.get("BATCHING_LATENCY_WEIGHT", "0"))
+    if not 0 <= latency_weight <= 1:
+        raise ValueError(f"Batching latency weight must be between 0 and 1, got {latency_weight}")
 
     if sqs is None:
         sqs = boto3.client("sqs")
 
+    queue_depth = None
+    auto_tuning = os.environ.get("AUTO_TUNING", "false").lower() == "true"
+    if auto_tuning:
+        batch_tuner = batch_tuner or warm_batch_tuner()
+        queue_depth = approximate_queue_depth(sqs)
+        file_processors_count, files_per_processor, max_batching_window_in_seconds = batch_tuner.tune(
+            len(file_keys_list) + queue_depth
+        )
+        print(
+            f"Auto-tuned for {queue_depth} queued messages: {file_processors_count} processors, "
+            f"{files_per_processor} files per processor, {max_batching_window_in_seconds:.1f} s batching window."
+        )
+    total_files_count = file_processors_count * files_per_processor
+
     from_sqs_count = total_files_count - len(file_keys_list)
-    print(
-        f"Starting to pool {from_sqs_count} file keys from SQS, {len(file_keys_list)} file keys came from trigger event."
-    )
-    sqs_file_keys, sqs_messages_ids_receipts = pool_file_keys(from_sqs_count, sqs, max_batching_window_in_seconds)
-    print(f"Pooled {len(sqs_file_keys)} file keys from SQS.")
+    # Latency-optimized mode checks the queue before waiting for files, a trigger event filling the batch
+    # is dispatched without any SQS request
+    if latency_weight > 0 and from_sqs_count > 0:
+        if queue_depth is None:
+            queue_depth = approximate_queue_depth(sqs)
+        max_batching_window_in_seconds = latency_batching_window(
+            max_batching_window_in_seconds, from_sqs_count, queue_depth, latency_weight
+        )
+        print(f"{queue_depth} queued messages, {max_batching_window_in_seconds:.1f} s batching window.")
+        if queue_depth == 0:
+            from_sqs_count = 0
+
+    sqs_file_keys, sqs_messages_ids_receipts = [], []
+    if from_sqs_count > 0:
+        print(
+            f"Starting to pool {from_sqs_count} file keys from SQS, "
+            f"{len(file_keys_list)} file keys came from trigger event."
+        )
+        sqs_file_keys, sqs_messages_ids_receipts = pool_file_keys(
+            from_sqs_count, sqs, max_batching_window_in_seconds, clock
+        )
+        print(f"Pooled {len(sqs_file_keys)} file keys from SQS.")
     file_keys_list.extend(sqs_file_keys)
     file_keys_list = list(dict.fromkeys(file_keys_list))
 
     files_list_chunks = [
         file_keys_list[i : i + files_per_processor] for i in range(0, len(file_keys_list), files_per_processor)
     ]
-    files_list_json = json.dumps(files_list_chunks)
 
     if stepfunctions is None:
         stepfunctions = boto3.client("stepfunctions")
 
+    map_mode = os.environ.get("PROCESSING_MAP_MODE", "INLINE")
+    if map_mode not in MAP_MODES:
+        raise ValueError(f"Unknown processing map mode: {map_mode}, expected one of {MAP_MODES}")
+    if map_mode == "DISTRIBUTED" and s3 is None:
+        s3 = boto3.client("s3")
+
     state_machine_arn = os.environ["DATA_PROCESSING_STATE_MACHINE_ARN"]
     print(f"Starting step function execution: {state_machine_arn} with {len(file_keys_list)} unique Raw data files.")
-    response = stepfunctions.start_sync_execution(stateMachineArn=state_machine_arn, input=files_list_json)
+    started_at = time.monotonic()
+    if map_mode == "DISTRIBUTED":
+        batch_manifest = write_batch_manifest(files_list_chunks, s3)
+        print(f"Wrote {len(files_list_chunks)} batches to s3://{batch_manifest['bucket']}/{batch_manifest['key']}")
+        response = run_execution(
+            stepfunctions, state_machine_arn, json.dumps({"batch_manifest": batch_manifest}), sleep
+        )
+    else:
+        response = stepfunctions.start_sync_execution(
+            stateMachineArn=state_machine_arn, input=json.dumps(files_list_chunks)
+        )
     print(f"Step function execution completed with status: {response['status']}")
 
     if response["status"] == "SUCCEEDED":
+        if auto_tuning:
+            batch_tuner.record_execution(time.monotonic() - started_at, len(files_list_chunks[0]))
+
+        unprocessed_keys = unprocessed_file_keys(response.get("output"), s3)
+        if unprocessed_keys:
+            # FilesProcessors stopped before their time or memory limit, their files go back to the queue
+            print(f"Rescheduling {len(unprocessed_keys)} Raw data files left unprocessed.")
+            reschedule_file_keys(unprocessed_keys, sqs)
+
         sqs_messages_count = len(sqs_messages_ids_receipts)
         if sqs_messages_count > 0:
             print(f"Deleteing {len(sqs_messages_ids_receipts)} SQS messages.")
@@ -56,12 +207,34 @@ def lambda_handler(trigger_event, context, sqs=None, stepfunctions=None):
                 )
             print(f"Deleted {sqs_messages_count} SQS messages in batches.")
     else:
-        error = {"status": response["status"], "error": response["error"], "cause": response["cause"]}
+        error = {"status": response["status"], "error": response.get("error"), "cause": response.get("cause")}
         raise RuntimeError(
             f"Step Function: {state_machine_arn} execution: {response['executionArn']} failed with error: {error}"
         )
 
 
+def latency_batching_window(max_batching_window_in_seconds, missing_count, queue_depth, latency_weight):
+    # An empty queue dispatches the trigger files right away. Otherwise the window is shortened by the share
+    # of the missing files that is queued already and by the weight, queued files are received without waiting
+    if missing_count <= 0 or queue_depth <= 0:
+        return 0
+    return max_batching_window_in_seconds * (1 - latency_weight) * min(queue_depth / missing_count, 1)
+
+
+def warm_batch_tuner():
+    global _batch_tuner
+    if _batch_tuner is None:
+        _batch_tuner = BatchTuner.from_env()
+    return _batch_tuner
+
+
+def approximate_queue_depth(sqs):
+    response = sqs.get_queue_attributes(
+        QueueUrl=os.environ["RAW_DATA_FILES_SQS_QUEUE_URL"], AttributeNames=["ApproximateNumberOfMessages"]
+    )
+    return int(response.get("Attributes", {}).get("ApproximateNumberOfMessages", 0))
+
+
 def files_from_trigger_event(event):
     files_keys = []
     for message in event.get("Records", []):
@@ -76,14 +249,79 @@ def files_from_trigger_event(event):
     return files_keys
 
 
-def pool_file_keys(keys_count, sqs, timeout):
+def unprocessed_file_keys(execution_output, s3=None):
+    # Execution output is the list of FilesProcessor results, a list of chunk keys, {"chunk_manifest_key": "..."}
+    # or a dict with "unprocessed_keys": [...] too for a processor that stopped early.
+    # DISTRIBUTED Map outputs {"ResultWriterDetails": {...}} pointing to the results written to S3
+    if not execution_output:
+        return []
+    results = json.loads(execution_output)
+    if isinstance(results, dict) and "ResultWriterDetails" in results:
+        results = list(result_writer_outputs(results["ResultWriterDetails"], s3))
+    if not isinstance(results, list):
+        return []
+    return [key for result in results if isinstance(result, dict) for key in result.get("unprocessed_keys", [])]
+
+
+def write_batch_manifest(files_list_chunks, s3):
+    # One {"file_keys": [...]} line per FilesProcessor, the Map item reader passes each line as the processor input
+    bucket = os.environ["BATCH_MANIFESTS_BUCKET_NAME"]
+    key = f"{BATCH_MANIFESTS_PREFIX}/{uuid.uuid4()}.jsonl"
+    lines = "".join(json.dumps({"file_keys": file_keys}) + "\n" for file_keys in files_list_chunks)
+    s3.put_object(Bucket=bucket, Key=key, Body=lines.encode("utf-8"))
+    return {"bucket": bucket, "key": key}
+
+
+def run_execution(stepfunctions, state_machine_arn, execution_input, sleep=time.sleep):
+    # STANDARD state machines can't be started synchronously, the execution is polled until it stops
+    execution_arn = stepfunctions.start_execution(stateMachineArn=state_machine_arn, input=execution_input)[
+        "executionArn"
+    ]
+    poll_seconds = float(os.environ.get("EXECUTION_POLL_SECONDS", EXECUTION_POLL_SECONDS))
+    while True:
+        response = stepfunctions.describe_execution(executionArn=execution_arn)
+        if response["status"] != "RUNNING":
+            return response
+        sleep(poll_seconds)
+
+
+def result_writer_outputs(result_writer_details, s3):
+    # manifest.json lists result files, each of them is a JSON array of child executions with their "Output"
+    manifest = load_json_object(s3, result_writer_details["Bucket"], result_writer_details["Key"])
+    for result_file in manifest["ResultFiles"].get("SUCCEEDED", []):
+        for execution in load_json_object(s3, manifest["DestinationBucket"], result_file["Key"]):
+            yield json.loads(execution["Output"])
+
+
+def load_json_object(s3, bucket, key):
+    return json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+
+
+def reschedule_file_keys(file_keys, sqs):
+    # Messages have the shape of S3 event notifications, so they are parsed like the original ones.
+    # New messages start with zero receive count, a split batch doesn't bring files closer to the DLQ
+    queue_url = os.environ["RAW_DATA_FILES_SQS_QUEUE_URL"]
+    for i in range(0, len(file_keys), 10):
+        batch = file_keys[i : i + 10]
+        sqs.send_message_batch(
+            QueueUrl=queue_url,
+            Entries=[
+                {"Id": str(index), "MessageBody": json.dumps({"Records": [{"s3": {"object": {"key": key}}}]})}
+                for index, key in enumerate(batch)
+            ],
+        )
+
+
+def pool_file_keys(keys_count, sqs, timeout, clock=time.time):
     queue_url = os.environ["RAW_DATA_FILES_SQS_QUEUE_URL"]
 
     file_keys = []
     message_ids_receipts = []
-    start = time.time()
+    start = clock()
+    requests_count = 0
     while len(file_keys) < keys_count:
-        if time.time() - start > timeout:
+        # Messages queued already are received at least once, even with a zero window
+        if requests_count > 0 and clock() - start > timeout:
             print(
                 f"Batching window timeout reached while pooling file keys from SQS, {keys_count - len(file_keys)} keys left to pool."
             )
@@ -93,6 +331,7 @@ def pool_file_keys(keys_count, sqs, timeout):
         response = sqs.receive_message(
             QueueUrl=queue_url, MessageSystemAttributeNames=[], MaxNumberOfMessages=fetch_count
         )
+        requests_count += 1
         messages = response.get("Messages", [])[:fetch_count]
         keys_batch, message_ids_receipts_batch = parse_sqs_messages(messages)
         file_keys.extend(keys_batch)
@@ -0,0 +1,98 @@
+import json
+import re
+
+from botocore.exceptions import ClientError
+
+# FilesProcessor results pass through Step Functions state, which is limited to 256 KB. A processor with more
+# chunk keys than the limit writes them to a chunk manifest object and returns only its key
+CHUNK_MANIFESTS_PREFIX = "_chunk_manifests"
+# Compacted chunk is named after its window and the digest of the chunks it replaces, f.e.
+# "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-c1a2b3c4d.parquet/part-0.parquet".
+# Keys of the replaced chunks are kept next to its part files
+COMPACTED_CHUNK_PATTERN = re.compile(r"T\d{2}_\d{2}m-c[0-9a-f]{8}\.(?:parquet|arrow)/")
+COMPACTED_CHUNK_SOURCES_FILE_NAME = "_sources.json"
+
+
+def chunk_manifest_key(invocation_id: str) -> str:
+    return f"{CHUNK_MANIFESTS_PREFIX}/{invocation_id}.json"
+
+
+def write_chunk_manifest(s3_client, bucket, invocation_id, chunk_keys):
+    key = chunk_manifest_key(invocation_id)
+    s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps({"chunk_keys": chunk_keys}).encode("utf-8"))
+    return key
+
+
+def is_compacted_chunk_key(key: str) -> bool:
+    return COMPACTED_CHUNK_PATTERN.search(key) is not None
+
+
+def compacted_chunk_sources_key(key: str) -> str:
+    # "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-c1a2b3c4d.parquet/part-0.parquet"
+    # -> "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-c1a2b3c4d.parquet/_sources.json"
+    return f"{key[: nth_slash_index(key, 5)]}/{COMPACTED_CHUNK_SOURCES_FILE_NAME}"
+
+
+def iter_chunk_keys(items, s3_client, bucket):
+    # Items are FilesProcessor results: lists of chunk keys, {"chunk_keys": [...], ...}
+    # or {"chunk_manifest_key": "...", ...}, or DISTRIBUTED Map output {"ResultWriterDetails": {...}, ...}
+    # pointing to the results written to S3. Keys are yielded one by one, nothing is concatenated
+    for item in items:
+        if not isinstance(item, dict):
+            yield from item
+        elif "ResultWriterDetails" in item:
+            yield from iter_chunk_keys(result_writer_outputs(s3_client, item["ResultWriterDetails"]), s3_client, bucket)
+        elif "chunk_manifest_key" in item:
+            yield from load_chunk_manifest(s3_client, bucket, item["chunk_manifest_key"])
+        else:
+            yield from item["chunk_keys"]
+
+
+def load_chunk_manifest(s3_client, bucket, key):
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            raise ValueError(f"Chunk manifest s3://{bucket}/{key} doesn't exist") from e
+        raise
+    return json.loads(response["Body"].read())["chunk_keys"]
+
+
+def result_writer_outputs(s3_client, result_writer_details):
+    # manifest.json of the Map run lists result files, each of them is a JSON array of child executions
+    # with the FilesProcessor result as an "Output" JSON string
+    manifest = load_json_object(s3_client, result_writer_details["Bucket"], result_writer_details["Key"])
+    for result_file in manifest["ResultFiles"].get("SUCCEEDED", []):
+        for execution in load_json_object(s3_client, manifest["DestinationBucket"], result_file["Key"]):
+            yield json.loads(execution["Output"])
+
+
+def load_json_object(s3_client, bucket, key):
+    return json.loads(s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+
+
+def group_chunk_keys(keys):
+    # "15min_chunks/job_<id>/<bucket>/<product>/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    # -> {(job_id, bucket, product, day): [keys]} in one pass. Chunks of a product share the prefix up to
+    # the product, so job, bucket and product are parsed once per prefix, and the day is sliced by position
+    keys_by_jbpd = {}
+    jbp_by_prefix = {}
+    for key in keys:
+        product_end = nth_slash_index(key, 4)
+        prefix = key[:product_end]
+        jbp = jbp_by_prefix.get(prefix)
+        if jbp is None:
+            job, bucket, product = prefix.split("/")[1:4]
+            jbp = jbp_by_prefix[prefix] = (job.split("_")[1], bucket, product)
+        day = key[product_end + 1 : key.find("T", product_end)]
+        keys_by_jbpd.setdefault((*jbp, day), []).append(key)
+    return keys_by_jbpd
+
+
+def nth_slash_index(key, n):
+    index = -1
+    for _ in range(n):
+        index = key.find("/", index + 1)
+        if index == -1:
+            raise ValueError(f"Chunk key has less than {n} path segments: {key}")
+    return index
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import boto3
+import pyarrow as pa
+
+from chunk_index import (
+    COMPACTED_CHUNK_SOURCES_FILE_NAME,
+    iter_chunk_keys,
+    nth_slash_index,
+    result_writer_outputs,
+    write_chunk_manifest,
+)
+from compaction import chunk_window
+from files_processor import MAX_ROWS_PER_FILE, MAX_ROWS_PER_GROUP
+from metrics import put_metric
+from s3_transfer import S3Transfer, s3_client_config
+from sparse_tables import CHUNK_FORMATS, chunk_format_from_env, chunk_schema, sparse_row_groups, write_sparse_dataset
+from watermarks import is_late_chunk_key
+
+# Every FilesProcessor invocation writes its own chunk per product and 15 minutes window, so a window of a busy
+# product has a tiny chunk per invocation. Chunks below the threshold are merged into one chunk per window before
+# the daily assembly, which then downloads and opens one object per window instead of one per invocation
+COMPACTED_CHUNK_TAG = {"Key": "compacted", "Value": "true"}
+
+
+def lambda_handler(
+    chunked_parquet_files,
+    context,
+    s3_client=None,
+    temp_dir=None,
+    s3_transfer=None,
+    min_chunk_bytes=None,
+    expire_consumed=None,
+    chunk_format=None,
+    inline_chunk_keys_limit=None,
+):
+    # Takes the Map output like ParquetFilesProcessor and returns it as one FilesProcessor result with compacted keys
+    print(f"Compacting chunked parquet files: {chunked_parquet_files}")
+
+    if s3_client is None:
+        s3_client = boto3.client("s3", config=s3_client_config())
+
+    if s3_transfer is None:
+        s3_transfer = S3Transfer.from_env(s3_client)
+
+    if temp_dir is None:
+        temp_dir = tempfile.gettempdir()
+
+    if min_chunk_bytes is None:
+        min_chunk_bytes = int(float(os.environ.get("CHUNK_COMPACTION_THRESHOLD_KB", "0")) * 1024)
+
+    if expire_consumed is None:
+        # Consumed chunks are tagged, the lifecycle rule of the bucket expires them after a few days, so ledger
+        # entries pointing to them stay valid while SQS can still redeliver their Raw data files
+        expire_consumed = os.environ.get("EXPIRE_COMPACTED_CHUNKS", "false").lower() == "true"
+
+    if chunk_format is None:
+        chunk_format = chunk_format_from_env()
+
+    if inline_chunk_keys_limit is None:
+        inline_chunk_keys_limit = int(os.environ.get("INLINE_CHUNK_KEYS_LIMIT", "0"))
+
+    bucket_name = os.environ["PARQUET_FILES_BUCKET_NAME"]
+
+    if isinstance(chunked_parquet_files, dict):
+        chunked_parquet_files = [chunked_parquet_files]
+    results = list(processor_results(chunked_parquet_files, s3_client))
+    unprocessed_keys = [
+        key for result in results if isinstance(result, dict) for key in result.get("unprocessed_keys", [])
+    ]
+    chunk_keys = list(dict.fromkeys(iter_chunk_keys(results, s3_client, bucket_name)))
+
+    keys_by_window = {}
+    if min_chunk_bytes:
+        # Late chunks hold a whole day, they are merged by the daily assembly as they are
+        window_keys = [key for key in chunk_keys if not is_late_chunk_key(key)]
+        size_by_key = chunk_sizes(s3_transfer, bucket_name, window_keys)
+        for key in window_keys:
+            if size_by_key[key] < min_chunk_bytes:
+                keys_by_window.setdefault(chunk_window_prefix(key), []).append(key)
+        keys_by_window = {window: keys for window, keys in keys_by_window.items() if len(keys) > 1}
+
+    source_files_path = os.path.join(temp_dir, "source_files")
+    compacted_files_path = os.path.join(temp_dir, "compacted_files")
+    extension, compression = CHUNK_FORMATS[chunk_format]
+    consumed_keys = [key for keys in keys_by_window.values() for key in keys]
+    print(
+        f"Compacting {len(consumed_keys)} chunks smaller than {min_chunk_bytes} bytes of {len(keys_by_window)} windows."
+    )
+
+    downloaded_file_by_key = {key: os.path.join(source_files_path, key) for key in consumed_keys}
+    s3_transfer.download_files(bucket_name, downloaded_file_by_key)
+
+    compacted_key_prefix_by_directory = {}
+    window_prefix_by_directory = {}
+    for window_prefix, keys in keys_by_window.items():
+        # Named after the merged chunks, so a retry overwrites the compacted chunk instead of adding another one
+        digest = hashlib.sha256("\n".join(keys).encode("utf-8")).hexdigest()[:8]
+        compacted_key_prefix = f"{window_prefix}-c{digest}.{extension}"
+        directory_path = os.path.join(compacted_files_path, compacted_key_prefix)
+        file_paths = [downloaded_file_by_key[key] for key in keys]
+        # Rows keep the order of the chunk keys, so the keep policy of the daily deduplication sees the same order
+        write_sparse_dataset(
+            sparse_row_groups(file_paths),
+            pa.unify_schemas([chunk_schema(file_path) for file_path in file_paths], promote_options="permissive"),
+            directory_path,
+            basename_template=f"part-{{i}}.{extension}",
+            max_rows_per_file=MAX_ROWS_PER_FILE,
+            max_rows_per_group=MAX_ROWS_PER_GROUP,
+            compression=compression,
+            file_format="arrow" if extension == "arrow" else "parquet",
+        )
+        compacted_key_prefix_by_directory[directory_path] = compacted_key_prefix
+        window_prefix_by_directory[directory_path] = window_prefix
+
+    compacted_keys_by_directory = s3_transfer.upload_directories(bucket_name, compacted_key_prefix_by_directory)
+    # Daily assembly in the append merge mode records the replaced chunks in the daily manifest, so the same chunks
+    # returned again for a redelivered Raw data file are not appended twice
+    s3_transfer.map(
+        "put_object",
+        [
+            (
+                (),
+                {
+                    "Bucket": bucket_name,
+                    "Key": f"{compacted_key_prefix_by_directory[directory_path]}/{COMPACTED_CHUNK_SOURCES_FILE_NAME}",
+                    "Body": json.dumps({"chunk_keys": keys_by_window[window_prefix]}).encode("utf-8"),
+                },
+            )
+            for directory_path, window_prefix in window_prefix_by_directory.items()
+        ],
+    )
+
+    # Compacted chunk takes the place of the first of its chunks
+    replacement_keys_by_key = {}
+    for directory_path, window_prefix in window_prefix_by_directory.items():
+        keys = keys_by_window[window_prefix]
+        replacement_keys_by_key[keys[0]] = sorted(compacted_keys_by_directory[directory_path])
+        for key in keys[1:]:
+            replacement_keys_by_key[key] = []
+    output_keys = [output_key for key in chunk_keys for output_key in replacement_keys_by_key.get(key, [key])]
+
+    if expire_consumed and consumed_keys:
+        s3_transfer.map(
+            "put_object_tagging",
+            [
+                ((), {"Bucket": bucket_name, "Key": key, "Tagging": {"TagSet": [COMPACTED_CHUNK_TAG]}})
+                for key in consumed_keys
+            ],
+        )
+        print(f"Tagged {len(consumed_keys)} consumed chunks to expire.")
+
+    put_metric("CompactedChunks", len(consumed_keys), Stage="ChunksCompactor")
+    put_metric("CompactedChunkObjects", len(output_keys), Stage="ChunksCompactor")
+    s3_transfer.report("ChunksCompactor")
+
+    if os.path.exists(source_files_path):
+        shutil.rmtree(source_files_path)
+    if os.path.exists(compacted_files_path):
+        shutil.rmtree(compacted_files_path)
+
+    # Output is a list of one FilesProcessor result, so ParquetFilesProcessor and the pooler read it like Map output
+    if inline_chunk_keys_limit and len(output_keys) > inline_chunk_keys_limit:
+        invocation_id = hashlib.sha256("\n".join(output_keys).encode("utf-8")).hexdigest()[:8]
+        result = {"chunk_manifest_key": write_chunk_manifest(s3_client, bucket_name, invocation_id, output_keys)}
+    elif unprocessed_keys:
+        result = {"chunk_keys": output_keys}
+    else:
+        return [output_keys]
+    if unprocessed_keys:
+        result["unprocessed_keys"] = unprocessed_keys
+    return [result]
+
+
+def chunk_sizes(s3_transfer, bucket_name, keys):
+    # One LIST page has sizes of up to 1000 chunks of a product and day, a HEAD request has the size of one chunk
+    day_prefixes = dict.fromkeys(key[: key.find("T", nth_slash_index(key, 4)) + 1] for key in keys)
+    listings = [s3_transfer.list_objects(bucket_name, prefix) for prefix in day_prefixes]
+    listed_size_by_key = {item["Key"]: item["Size"] for objects in listings for item in objects}
+    return {key: listed_size_by_key[key] for key in keys}
+
+
+def chunk_window_prefix(key: str) -> str:
+    # "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    # -> "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m"
+    return f"{key[: nth_slash_index(key, 4)]}/{chunk_window(key)}"
+
+
+def processor_results(items, s3_client):
+    # DISTRIBUTED Map output points to the FilesProcessor results written to S3, INLINE Map output is their list
+    for item in items:
+        if isinstance(item, dict) and "ResultWriterDetails" in item:
+            yield from result_writer_outputs(s3_client, item["ResultWriterDetails"])
+        else:
+            yield item
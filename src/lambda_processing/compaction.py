@@ -0,0 +1,122 @@
+import os
+import re
+
+import numpy as np
+import pyarrow as pa
+
+from deduplication import CHECK_HASH_KEY, deduplicate_tables, key_hashes
+from sparse_tables import sequential_positions, sparse_row_groups
+
+# "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+# -> "2023-04-01T13_30m", quarters sort in time order as strings, "_15m" < "_30m" < "_45m" < "_60m"
+CHUNK_WINDOW_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2}T\d{2}_\d{2}m)-[^/]+\.(?:parquet|arrow)")
+TIMESTAMP_COLUMN = "timestamp"
+
+
+def chunk_window(key: str) -> str:
+    match = CHUNK_WINDOW_PATTERN.search(key)
+    if match is None:
+        raise ValueError(f"Chunk key has no 15 minutes window: {key}")
+    return match.group(1)
+
+
+def chunk_windows(keys):
+    # Chunks of a day cover disjoint 15 minutes windows, so the day is the concatenation of windows in time order,
+    # and merging the k chunk streams needs no sorting of rows. Chunks of one window keep their order in keys
+    keys_by_window = {}
+    for key in dict.fromkeys(keys):
+        keys_by_window.setdefault(chunk_window(key), []).append(key)
+    return sorted(keys_by_window.items())
+
+
+def compacted_row_groups(
+    file_paths_by_window, key_columns=None, keep="first", remove_consumed=False, stats=None, fetch_window=None
+):
+    # Yields row groups of the day in windows order reading them lazily, so memory is bounded by a few row groups.
+    # Repeated readings have the same timestamp, so they are in the same window and deduplicated window by window.
+    # fetch_window(file_paths) starts the downloads of the chunks of a window and returns their futures,
+    # without it the chunks are on disk already
+    key_owners = None
+    if key_columns and TIMESTAMP_COLUMN not in key_columns:
+        # Without timestamp in the key, repeated readings can be in any window of the day. A first pass over
+        # the key columns finds the window keeping each key, then windows are still compacted one by one
+        key_owners = key_owner_windows(file_paths_by_window, key_columns, keep, fetch_window, remove_consumed)
+
+    for window_index, file_paths in fetched_windows(file_paths_by_window, fetch_window):
+        row_groups = sparse_row_groups(file_paths)
+
+        if key_columns:
+            row_groups = list(row_groups)
+            positions = sequential_positions(row_groups)
+            rows_before = sum(table.num_rows for table in row_groups)
+            row_groups, _positions = deduplicate_tables(row_groups, positions, key_columns, keep)
+            if key_owners is not None:
+                row_groups = [
+                    table.filter(owned_keys_mask(table, key_columns, key_owners, window_index)) for table in row_groups
+                ]
+            if stats is not None:
+                stats["rows_before_dedup"] = stats.get("rows_before_dedup", 0) + rows_before
+                stats["rows_after_dedup"] = stats.get("rows_after_dedup", 0) + sum(t.num_rows for t in row_groups)
+
+        yield from row_groups
+
+        # Consumed chunks are removed from /tmp while the daily file grows
+        if remove_consumed:
+            remove_files(file_paths)
+
+
+def fetched_windows(file_paths_by_window, fetch_window=None):
+    # Yields (window index, file paths) once the chunks of the window are on disk. The next window is downloaded
+    # while the caller reads the current one, so /tmp holds the chunks of two windows instead of the whole day
+    downloads = fetch_window(file_paths_by_window[0][1]) if fetch_window and file_paths_by_window else []
+    for window_index, (_window, file_paths) in enumerate(file_paths_by_window):
+        for download in downloads:
+            download.result()
+        downloads = []
+        if fetch_window and window_index + 1 < len(file_paths_by_window):
+            downloads = fetch_window(file_paths_by_window[window_index + 1][1])
+        yield window_index, file_paths
+
+
+def key_owner_windows(file_paths_by_window, key_columns, keep="first", fetch_window=None, remove_consumed=False):
+    # -> sorted distinct key hashes, the index of the window keeping each key, the first or the last one
+    # by the keep policy, and whether the hash is shared by different keys. Only key columns are read,
+    # and 20 bytes per row are kept instead of the rows. Downloaded chunks are downloaded again by the second pass
+    hashes = []
+    check_hashes = []
+    windows = []
+    for window_index, file_paths in fetched_windows(file_paths_by_window, fetch_window):
+        for table in sparse_row_groups(file_paths, columns=key_columns):
+            hashes.append(key_hashes(table, key_columns))
+            check_hashes.append(key_hashes(table, key_columns, CHECK_HASH_KEY))
+            windows.append(np.full(table.num_rows, window_index, dtype=np.int32))
+        if fetch_window and remove_consumed:
+            remove_files(file_paths)
+    if not hashes:
+        return np.array([], dtype=np.uint64), np.array([], dtype=np.int32), np.array([], dtype=bool)
+
+    hashes = np.concatenate(hashes)
+    check_hashes = np.concatenate(check_hashes)
+    windows = np.concatenate(windows)
+    if keep == "last":
+        # np.unique returns the first occurrence of each hash
+        hashes = hashes[::-1]
+        check_hashes = check_hashes[::-1]
+        windows = windows[::-1]
+    distinct_hashes, first_indices, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    # Different keys with the same hash almost surely differ in the second hash of an independent hash key.
+    # Rows of such keys are kept by every window, they are deduplicated within their windows only
+    collided = np.zeros(len(distinct_hashes), dtype=bool)
+    collided[inverse[check_hashes != check_hashes[first_indices][inverse]]] = True
+    return distinct_hashes, windows[first_indices], collided
+
+
+def owned_keys_mask(table, key_columns, key_owners, window_index):
+    distinct_hashes, owner_windows, collided = key_owners
+    indices = np.searchsorted(distinct_hashes, key_hashes(table, key_columns))
+    return pa.array((owner_windows[indices] == window_index) | collided[indices])
+
+
+def remove_files(file_paths):
+    for file_path in file_paths:
+        os.remove(file_path)
@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# first - the earliest occurrence of a key in the table order is kept
+# last - the latest occurrence of a key in the table order is kept, f.e. the reading from a re-uploaded file
+KEEP_POLICIES = ("first", "last")
+ROW_INDEX_COLUMN = "__row_index"
+KEY_SEPARATOR = "\x1f"
+NULL_KEY_VALUE = "\x00"
+# 16 characters keys of the pandas hash function, the check hash tells apart different keys sharing a hash
+HASH_KEY = "0123456789123456"
+CHECK_HASH_KEY = "6543219876543210"
+
+
+def deduplicate_table(table: pa.Table, key_columns, keep="first") -> pa.Table:
+    if keep not in KEEP_POLICIES:
+        raise ValueError(f"Unknown deduplication keep policy: {keep}, expected one of {KEEP_POLICIES}")
+
+    missing_columns = [column for column in key_columns if column not in table.column_names]
+    if missing_columns:
+        raise ValueError(f"Deduplication key columns are missing in the table: {missing_columns}")
+
+    if table.num_rows == 0:
+        return table
+
+    # Hash group-by over the key columns only, it returns one row index per distinct key
+    row_indices = pa.array(np.arange(table.num_rows, dtype=np.int64))
+    keys_table = table.select(key_columns).append_column(ROW_INDEX_COLUMN, row_indices)
+    aggregation = "min" if keep == "first" else "max"
+    grouped = keys_table.group_by(key_columns, use_threads=False).aggregate([(ROW_INDEX_COLUMN, aggregation)])
+
+    if grouped.num_rows == table.num_rows:
+        return table
+
+    kept_indices = np.sort(grouped[f"{ROW_INDEX_COLUMN}_{aggregation}"].to_numpy())
+    return table.take(pa.array(kept_indices))
+
+
+def deduplicate_tables(tables, positions, key_columns, keep="first"):
+    # Same as deduplicate_table over tables with different column sets, positions give the order of rows
+    # across tables for the keep policy, only key columns of all tables are concatenated
+    if keep not in KEEP_POLICIES:
+        raise ValueError(f"Unknown deduplication keep policy: {keep}, expected one of {KEEP_POLICIES}")
+
+    present_columns = {column for table in tables for column in table.column_names}
+    missing_columns = [column for column in key_columns if column not in present_columns]
+    if missing_columns:
+        raise ValueError(f"Deduplication key columns are missing in the table: {missing_columns}")
+
+    if not tables:
+        return tables, positions
+
+    # A key column missing in some tables is null for their rows
+    keys_tables = []
+    for table, table_positions in zip(tables, positions):
+        keys_columns = [
+            table[column] if column in table.column_names else pa.nulls(table.num_rows) for column in key_columns
+        ]
+        keys_columns.append(pa.array(table_positions))
+        keys_tables.append(pa.table(keys_columns, names=[*key_columns, ROW_INDEX_COLUMN]))
+
+    keys_table = pa.concat_tables(keys_tables, promote_options="permissive")
+    aggregation = "min" if keep == "first" else "max"
+    grouped = keys_table.group_by(key_columns, use_threads=False).aggregate([(ROW_INDEX_COLUMN, aggregation)])
+
+    if grouped.num_rows == keys_table.num_rows:
+        return tables, positions
+
+    kept_positions = grouped[f"{ROW_INDEX_COLUMN}_{aggregation}"]
+    deduplicated_tables = []
+    deduplicated_positions = []
+    for table, table_positions in zip(tables, positions):
+        mask = pc.is_in(pa.array(table_positions), value_set=kept_positions)
+        deduplicated_tables.append(table.filter(mask))
+        deduplicated_positions.append(table_positions[mask.to_numpy(zero_copy_only=False)])
+    return deduplicated_tables, deduplicated_positions
+
+
+def key_hashes(table: pa.Table, key_columns, hash_key=HASH_KEY) -> np.ndarray:
+    # 64-bit hash of the key columns per row, equal keys of tables with different column types get equal hashes,
+    # f.e. 1 and 1.0, a key column missing in the table is null for its rows
+    key_values = [
+        table[column].cast(pa.string()) if column in table.column_names else pa.nulls(table.num_rows, pa.string())
+        for column in key_columns
+    ]
+    joined_keys = pc.binary_join_element_wise(
+        *key_values, KEY_SEPARATOR, null_handling="replace", null_replacement=NULL_KEY_VALUE
+    )
+    return pd.util.hash_array(joined_keys.to_numpy(zero_copy_only=False), hash_key=hash_key)
+
+
+def dedup_settings_from_env():
+    # DEDUP_KEY_COLUMNS="dataAsset,timestamp" -> ["dataAsset", "timestamp"], empty value disables deduplication
+    key_columns = [column.strip() for column in os.environ.get("DEDUP_KEY_COLUMNS", "").split(",") if column.strip()]
+    keep = os.environ.get("DEDUP_KEEP", "first")
+    return key_columns, keep
+
+
+def dedup_ratio(rows_before, rows_after):
+    if rows_before == 0:
+        return 0.0
+    return (rows_before - rows_after) / rows_before
@@ -1,85 +1,378 @@
-import boto3
-import json
 import os
-import pyarrow as pa
 import shutil
 import tempfile
+import time
 import uuid
-
-from pyarrow import dataset as ds
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 
+import boto3
+from botocore.exceptions import ClientError
+
+from chunk_index import write_chunk_manifest
+from deduplication import dedup_ratio, dedup_settings_from_env, deduplicate_tables
+from json_parsers import (
+    NDJSON_EXTENSIONS,
+    json_parse_workers_from_env,
+    json_parser_from_env,
+    load_raw_data_chunks,
+    load_raw_data_file,
+)
+from metrics import put_metric
+from output_shapes import dedup_key_columns_for_schema, long_table_from_assets, output_shape_from_env
+from processing_ledger import deterministic_invocation_id, processing_ledger_from_env, source_chunk_id
+from s3_transfer import S3Transfer, s3_client_config
+from sparse_tables import (
+    CHUNK_FORMATS,
+    MAX_COLUMN_SETS,
+    chunk_file_paths,
+    chunk_format_from_env,
+    column_set_tables,
+    sequential_positions,
+    sparse_row_groups,
+    unify_sparse_schemas,
+    write_sparse_dataset,
+)
+from upload_ledger import upload_ledger_from_env
+from watermarks import late_chunk_file_name, watermarks_from_env
+from work_budget import WorkBudget
 
 MAX_ROWS_PER_FILE = 100000
 MAX_ROWS_PER_GROUP = 10000  # Dataset writer will batch incoming data and only write the row groups to the disk when sufficient rows have accumulated.
 
 
-def lambda_handler(files_list, context, s3_client=None, temp_dir=None, invocation_id=None):
+def lambda_handler(
+    files_list,
+    context,
+    s3_client=None,
+    temp_dir=None,
+    invocation_id=None,
+    dedup_key_columns=None,
+    dedup_keep=None,
+    ledger=None,
+    output_shape=None,
+    work_budget=None,
+    s3_transfer=None,
+    write_workers=None,
+    chunk_format=None,
+    inline_chunk_keys_limit=None,
+    json_parser=None,
+    json_parse_workers=None,
+    ranged_download_threshold_bytes=None,
+    range_part_size_bytes=None,
+    watermarks=None,
+    verify_ledger_chunks=None,
+    upload_ledger=None,
+):
     print(f"Processing files: {files_list}")
 
+    # DISTRIBUTED Map passes a line of the batch manifest, {"file_keys": [...]}, INLINE Map passes the list itself
+    if isinstance(files_list, dict):
+        files_list = files_list["file_keys"]
+
     if s3_client is None:
-        s3_client = boto3.client("s3")
+        s3_client = boto3.client("s3", config=s3_client_config())
+
+    if s3_transfer is None:
+        s3_transfer = S3Transfer.from_env(s3_client)
 
     if temp_dir is None:
         temp_dir = tempfile.gettempdir()
 
-    if invocation_id is None:
-        invocation_id = uuid.uuid4().hex[:8]
+    if ledger is None:
+        ledger = processing_ledger_from_env(s3_client)
+
+    if output_shape is None:
+        output_shape = output_shape_from_env()
+
+    if work_budget is None:
+        work_budget = WorkBudget.from_env(context)
+
+    if write_workers is None:
+        write_workers = int(os.environ.get("PARQUET_WRITE_WORKERS", "1"))
+
+    if chunk_format is None:
+        chunk_format = chunk_format_from_env()
+
+    if inline_chunk_keys_limit is None:
+        # 0 returns all chunk keys inline
+        inline_chunk_keys_limit = int(os.environ.get("INLINE_CHUNK_KEYS_LIMIT", "0"))
+
+    if json_parser is None:
+        json_parser = json_parser_from_env()
+
+    if json_parse_workers is None:
+        json_parse_workers = json_parse_workers_from_env()
+
+    if ranged_download_threshold_bytes is None:
+        # 0 downloads every file whole
+        ranged_download_threshold_bytes = int(float(os.environ.get("RANGED_DOWNLOAD_THRESHOLD_MB", "0")) * 1024 * 1024)
+
+    if range_part_size_bytes is None:
+        range_part_size_bytes = int(float(os.environ.get("RANGED_DOWNLOAD_PART_SIZE_MB", "8")) * 1024 * 1024)
+
+    if watermarks is None:
+        watermarks = watermarks_from_env(s3_client)
+
+    if verify_ledger_chunks is None:
+        verify_ledger_chunks = os.environ.get("DELETE_CONSUMED_CHUNKS", "false").lower() == "true"
+
+    env_dedup_key_columns, env_dedup_keep = dedup_settings_from_env()
+    if dedup_key_columns is None:
+        dedup_key_columns = env_dedup_key_columns
+    if dedup_keep is None:
+        dedup_keep = env_dedup_keep
 
     source_bucket = os.environ["RAW_DATA_FILES_BUCKET_NAME"]
     source_files_directory = os.path.join(temp_dir, "source_files")
     generated_files_directory = os.path.join(temp_dir, "generated_files")
     directory_paths_to_upload = []
+    directory_paths_by_file_key = {}
+    uploaded_file_keys = []
 
-    # Download and process files one by one to avoid spike load on S3
-    print(f"Downloading and processing {len(files_list)} Raw data files from s3://{source_bucket}")
+    head_response_by_file_key = {}
+    if ledger is not None or ranged_download_threshold_bytes:
+        head_response_by_file_key = dict(zip(files_list, s3_transfer.head_objects(source_bucket, files_list)))
+
+    etag_by_file_key = {}
+    if ledger is not None:
+        files_to_process = []
+        chunk_keys_by_file_key = {}
+        for file_key in files_list:
+            head_response = head_response_by_file_key[file_key]
+            etag_by_file_key[file_key] = head_response["ETag"].strip('"')
+            chunk_keys_by_file_key[file_key] = ledger.get(file_key, etag_by_file_key[file_key])
+
+        # Consumed chunks are deleted after the daily assembly, a file recorded with deleted chunks is processed again
+        existing_chunk_keys = None
+        if verify_ledger_chunks:
+            recorded_chunk_keys = [key for keys in chunk_keys_by_file_key.values() if keys for key in keys]
+            existing_chunk_keys = existing_keys(
+                s3_transfer, os.environ["PARQUET_FILES_BUCKET_NAME"], recorded_chunk_keys
+            )
+
+        for file_key in files_list:
+            chunk_keys = chunk_keys_by_file_key[file_key]
+            if chunk_keys is None or (
+                existing_chunk_keys is not None and not existing_chunk_keys.issuperset(chunk_keys)
+            ):
+                files_to_process.append(file_key)
+            else:
+                print(f"Skipping already processed {file_key} (ETag {etag_by_file_key.pop(file_key)}).")
+                uploaded_file_keys.extend(chunk_keys)
+        files_list = files_to_process
+
+    if invocation_id is None:
+        if ledger is not None:
+            invocation_id = deterministic_invocation_id(etag_by_file_key.items())
+        else:
+            invocation_id = uuid.uuid4().hex[:8]
+
+    # Chunk names repeat on retry only with the ledger, the run ledger is kept for it
+    if upload_ledger is None:
+        upload_ledger = upload_ledger_from_env(s3_client, "files_processor", [invocation_id])
+    s3_transfer.upload_ledger = upload_ledger
+
+    file_path_by_key = {}
     for file_key in files_list:
         job_subdirectory = os.path.basename(os.path.dirname(file_key))
-        file_name = os.path.basename(file_key)
-        file_path = os.path.join(source_files_directory, source_bucket, job_subdirectory, file_name)
+        file_path = os.path.join(source_files_directory, source_bucket, job_subdirectory, os.path.basename(file_key))
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        s3_client.download_file(source_bucket, file_key, file_path)
+        file_path_by_key[file_key] = file_path
+
+    # Large files are fetched in concurrent byte ranges when they are processed, and parsed as the ranges arrive
+    ranged_size_by_file_key = {}
+    if ranged_download_threshold_bytes:
+        for file_key in files_list:
+            size = head_response_by_file_key[file_key]["ContentLength"]
+            if size >= ranged_download_threshold_bytes:
+                ranged_size_by_file_key[file_key] = size
+
+    def start_download(file_key):
+        if file_key in ranged_size_by_file_key:
+            return None
+        return s3_transfer.download_file(source_bucket, file_key, file_path_by_key[file_key])
+
+    # Process files one by one, the next file is downloaded while the current one is converted to Parquet
+    print(f"Downloading and processing {len(files_list)} Raw data files from s3://{source_bucket}")
+    unprocessed_file_keys = []
+    late_rows = 0
+    next_download = None
+    if files_list:
+        next_download = start_download(files_list[0])
+    for index, file_key in enumerate(files_list):
+        # At least one file is processed by each invocation, so rescheduled files always make progress
+        exhausted_reason = work_budget.exhausted_reason() if index > 0 else None
+        if exhausted_reason is not None:
+            unprocessed_file_keys = files_list[index:]
+            print(f"Stopping before {len(unprocessed_file_keys)} files to reschedule them: {exhausted_reason}.")
+            put_metric("RescheduledFiles", len(unprocessed_file_keys), Stage="FilesProcessor")
+            break
 
-        if os.path.exists(file_path):
-            with open(file_path, "r") as raw_data_file:
-                data_assets = json.load(raw_data_file)
-                output_directory_path = os.path.join(generated_files_directory, job_subdirectory, source_bucket)
-                generated_parquet_paths = dump_to_parquet(data_assets, output_directory_path, invocation_id)
-                directory_paths_to_upload.extend(generated_parquet_paths)
+        file_started_at = time.monotonic()
+        job_subdirectory = os.path.basename(os.path.dirname(file_key))
+        file_path = file_path_by_key[file_key]
+
+        data_assets = None
+        if file_key in ranged_size_by_file_key:
+            ranges = s3_transfer.iter_object_ranges(
+                source_bucket, file_key, ranged_size_by_file_key[file_key], range_part_size_bytes
+            )
+            data_assets = load_raw_data_chunks(
+                ranges, json_parser, True if file_key.endswith(NDJSON_EXTENSIONS) else None
+            )
+        else:
+            next_download.result()
+            if os.path.exists(file_path):
+                data_assets = load_raw_data_file(file_path, json_parser, json_parse_workers)
+
+        # The file is read already, so a repeated key in files_list can't overwrite it while it's being read
+        next_download = None
+        if index + 1 < len(files_list):
+            next_download = start_download(files_list[index + 1])
+
+        if data_assets is not None:
+            output_directory_path = os.path.join(generated_files_directory, job_subdirectory, source_bucket)
+            # Watermarks advance file by file, readings of a file are compared with the ones before it
+            watermark_by_product = watermarks.watermarks(job_subdirectory) if watermarks is not None else None
+            # With the ledger, chunks are named after the file version, not the batch it's delivered with
+            chunk_id = invocation_id
+            if file_key in etag_by_file_key:
+                chunk_id = source_chunk_id(file_key, etag_by_file_key[file_key])
+            dump_stats = {}
+            generated_parquet_paths = dump_to_parquet(
+                data_assets,
+                output_directory_path,
+                chunk_id,
+                dedup_key_columns,
+                dedup_keep,
+                output_shape,
+                write_workers,
+                chunk_format,
+                watermark_by_product,
+                dump_stats,
+            )
+            if watermarks is not None:
+                watermarks.advance(job_subdirectory, dump_stats["max_timestamp_by_product"])
+                late_rows += dump_stats["late_rows"]
+            directory_paths_to_upload.extend(generated_parquet_paths)
+            directory_paths_by_file_key.setdefault(file_key, []).extend(generated_parquet_paths)
+        work_budget.record_file((time.monotonic() - file_started_at) * 1000)
+
+    # Download of the first rescheduled file is left to finish before the source files are removed
+    if next_download is not None:
+        wait([next_download])
 
     # Upload parquet files when all of them are ready, to avoid partial uploads
     destination_bucket = os.environ["PARQUET_FILES_BUCKET_NAME"]
-    uploaded_file_keys = []
     directory_paths_to_upload = list(dict.fromkeys(directory_paths_to_upload))
     print(f"Uploading {len(directory_paths_to_upload)} items of 15min Parquet files to s3://{destination_bucket}")
+    file_key_prefix_by_directory_path = {
+        directory_path: os.path.join("15min_chunks", os.path.relpath(directory_path, generated_files_directory))
+        for directory_path in directory_paths_to_upload
+    }
+    try:
+        uploaded_keys_by_directory_path = s3_transfer.upload_directories(
+            destination_bucket, file_key_prefix_by_directory_path
+        )
+    except Exception:
+        # Chunks uploaded before the failure are skipped by the retry
+        if upload_ledger is not None:
+            upload_ledger.save()
+        raise
     for directory_path in directory_paths_to_upload:
-        file_key_prefix = os.path.relpath(directory_path, generated_files_directory)
-        file_key_prefix = os.path.join("15min_chunks", file_key_prefix)
-        s3_file_keys = upload_directory_to_s3(s3_client, directory_path, destination_bucket, file_key_prefix)
-        uploaded_file_keys.extend(s3_file_keys)
+        uploaded_file_keys.extend(uploaded_keys_by_directory_path[directory_path])
 
     print("Upload finished.")
 
+    # Watermarks are saved after the chunks are uploaded, a failed invocation doesn't move them
+    if watermarks is not None:
+        watermarks.save()
+        print(f"Put {late_rows} readings older than the watermarks into late chunks.")
+        put_metric("LateRows", late_rows, Stage="FilesProcessor")
+
+    # Files are recorded only after all chunks are uploaded, a failed invocation is processed again on retry
+    if ledger is not None:
+        for file_key, etag in etag_by_file_key.items():
+            if file_key in unprocessed_file_keys:
+                continue
+            directory_paths = dict.fromkeys(directory_paths_by_file_key.get(file_key, []))
+            chunk_keys = [key for path in directory_paths for key in uploaded_keys_by_directory_path[path]]
+            ledger.put(file_key, etag, chunk_keys)
+
+    if upload_ledger is not None:
+        upload_ledger.delete()
+
+    s3_transfer.report("FilesProcessor")
+
     # Remove downloaded and generated files
     if os.path.exists(source_files_directory):
         shutil.rmtree(source_files_directory)
     if os.path.exists(generated_files_directory):
         shutil.rmtree(generated_files_directory)
 
+    uploaded_file_keys = list(dict.fromkeys(uploaded_file_keys))
+    if inline_chunk_keys_limit and len(uploaded_file_keys) > inline_chunk_keys_limit:
+        manifest_key = write_chunk_manifest(s3_client, destination_bucket, invocation_id, uploaded_file_keys)
+        print(f"Wrote {len(uploaded_file_keys)} chunk keys to s3://{destination_bucket}/{manifest_key}")
+        result = {"chunk_manifest_key": manifest_key}
+        if unprocessed_file_keys:
+            result["unprocessed_keys"] = unprocessed_file_keys
+        return result
+    if unprocessed_file_keys:
+        # ParquetFilesProcessor takes chunk_keys, the pooler reschedules unprocessed_keys from the execution output
+        return {"chunk_keys": uploaded_file_keys, "unprocessed_keys": unprocessed_file_keys}
     return uploaded_file_keys
 
 
+def existing_keys(s3_transfer, bucket, keys):
+    futures = {key: s3_transfer.submit("head_object", Bucket=bucket, Key=key) for key in dict.fromkeys(keys)}
+    existing = set()
+    for key, future in futures.items():
+        try:
+            future.result()
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            continue
+        existing.add(key)
+    return existing
+
+
 # This function can consume 2x memory size of data_assets
-def dump_to_parquet(data_assets, output_directory_path, invocation_id):
+def dump_to_parquet(
+    data_assets,
+    output_directory_path,
+    invocation_id,
+    dedup_key_columns=None,
+    dedup_keep="first",
+    output_shape="wide",
+    write_workers=1,
+    chunk_format="parquet",
+    watermark_by_product=None,
+    stats=None,
+    max_column_sets=MAX_COLUMN_SETS,
+):
+    # watermark_by_product - {product: datetime}, older readings of the product go to the late chunk of their day
     asset_per_file_path = {}
+    extension, _compression = CHUNK_FORMATS[chunk_format]
+    max_timestamp_by_product = {}
+    late_rows = 0
 
     for data_asset in data_assets:
         normalize_inplace(data_asset)
         product = data_asset["dataAsset"]
 
         timestamp = datetime.fromisoformat(data_asset["timestamp"].replace("Z", "+00:00"))
-        hour_quarter_min = (timestamp.minute // 15 + 1) * 15
-        file_name = f"{timestamp.strftime('%Y-%m-%dT%H')}_{hour_quarter_min}m-{invocation_id}.parquet"
+        if product not in max_timestamp_by_product or timestamp > max_timestamp_by_product[product]:
+            max_timestamp_by_product[product] = timestamp
+        watermark = watermark_by_product.get(product) if watermark_by_product else None
+        if watermark is not None and timestamp < watermark:
+            file_name = late_chunk_file_name(timestamp, invocation_id, extension)
+            late_rows += 1
+        else:
+            hour_quarter_min = (timestamp.minute // 15 + 1) * 15
+            file_name = f"{timestamp.strftime('%Y-%m-%dT%H')}_{hour_quarter_min}m-{invocation_id}.{extension}"
 
         file_path = os.path.join(output_directory_path, product, file_name)
 
@@ -88,42 +381,82 @@ def dump_to_parquet(data_assets, output_directory_path, invocation_id):
         else:
             asset_per_file_path[file_path] = [data_asset]
 
-    for file_path, assets in asset_per_file_path.items():
-        for asset in assets:
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    # Each chunk is written to its own directory, so chunks can be encoded in parallel. Arrow releases the GIL
+    # while encoding Parquet, so threads use all vCPUs of the lambda. Chunk names don't depend on the order of writes
+    def write_chunk(file_path_and_assets):
+        file_path, assets = file_path_and_assets
+        return write_chunk_file(
+            file_path, assets, dedup_key_columns, dedup_keep, output_shape, chunk_format, max_column_sets
+        )
 
-            table = pa.Table.from_pylist([asset])
-            append_dataset = ds.dataset(table)
+    if write_workers > 1 and len(asset_per_file_path) > 1:
+        with ThreadPoolExecutor(max_workers=write_workers) as executor:
+            dedup_counts = list(executor.map(write_chunk, asset_per_file_path.items()))
+    else:
+        dedup_counts = [write_chunk(item) for item in asset_per_file_path.items()]
+    rows_before_dedup = sum(rows_before for rows_before, _rows_after in dedup_counts)
+    rows_after_dedup = sum(rows_after for _rows_before, rows_after in dedup_counts)
 
-            original_file_path = None
-            schema = None
-            if os.path.exists(file_path):
-                original_file_path = file_path + ".orig"
-                os.rename(file_path, original_file_path)
-                original_dataset = ds.dataset(original_file_path, format="parquet")
-                joined_dataset = ds.dataset([original_dataset, append_dataset])
-                schema = pa.unify_schemas([original_dataset.schema, append_dataset.schema])
-            else:
-                joined_dataset = append_dataset
-
-            write_options = ds.ParquetFileFormat().make_write_options(compression="snappy")
-            ds.write_dataset(
-                joined_dataset,
-                file_path,
-                format="parquet",
-                basename_template="part-{i}.parquet",
-                existing_data_behavior="overwrite_or_ignore",
-                file_options=write_options,
-                max_rows_per_file=MAX_ROWS_PER_FILE,
-                max_rows_per_group=MAX_ROWS_PER_GROUP,
-                schema=schema,
-            )
-            if original_file_path:
-                shutil.rmtree(original_file_path)
+    if dedup_key_columns:
+        ratio = dedup_ratio(rows_before_dedup, rows_after_dedup)
+        print(f"Deduplicated 15min chunks: {rows_before_dedup} -> {rows_after_dedup} rows.")
+        put_metric("ChunksDedupRatio", ratio, unit="None", Stage="FilesProcessor")
+
+    if stats is not None:
+        stats["max_timestamp_by_product"] = max_timestamp_by_product
+        stats["late_rows"] = late_rows
 
     return list(asset_per_file_path.keys())
 
 
+def write_chunk_file(
+    file_path,
+    assets,
+    dedup_key_columns=None,
+    dedup_keep="first",
+    output_shape="wide",
+    chunk_format="parquet",
+    max_column_sets=MAX_COLUMN_SETS,
+):
+    # Returns rows before and after deduplication
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    if output_shape == "long":
+        tables = [long_table_from_assets(assets)]
+        positions = sequential_positions(tables)
+    else:
+        # Assets with the same iotreadings keys share a table, missing iotreadings become nulls only when written.
+        # max_column_sets=1 always builds one table with the union of the keys
+        tables, positions = column_set_tables(assets, max_column_sets)
+
+    if os.path.exists(file_path):
+        original_tables = list(sparse_row_groups(chunk_file_paths(file_path)))
+        original_positions = sequential_positions(original_tables)
+        original_rows = sum(table.num_rows for table in original_tables)
+        tables = original_tables + tables
+        positions = original_positions + [table_positions + original_rows for table_positions in positions]
+        shutil.rmtree(file_path)
+
+    schema = unify_sparse_schemas(tables)
+    rows_before_dedup = sum(table.num_rows for table in tables)
+    if dedup_key_columns:
+        key_columns = dedup_key_columns_for_schema(dedup_key_columns, schema)
+        tables, positions = deduplicate_tables(tables, positions, key_columns, dedup_keep)
+
+    extension, compression = CHUNK_FORMATS[chunk_format]
+    write_sparse_dataset(
+        tables,
+        schema,
+        file_path,
+        basename_template=f"part-{{i}}.{extension}",
+        max_rows_per_file=MAX_ROWS_PER_FILE,
+        max_rows_per_group=MAX_ROWS_PER_GROUP,
+        compression=compression,
+        file_format="arrow" if extension == "arrow" else "parquet",
+    )
+    return rows_before_dedup, sum(table.num_rows for table in tables)
+
+
 def normalize_inplace(data_asset):
     # Pull iotreadings one level up
     iotreadings = data_asset.pop("iotreadings", {})
@@ -131,16 +464,3 @@ def normalize_inplace(data_asset):
         data_asset[f"iotreadings_{key}"] = value
     # Clean data
     data_asset["dataAsset"] = data_asset["dataAsset"].strip()
-
-
-def upload_directory_to_s3(s3_client, local_directory, bucket, file_key_prefix):
-    uploaded_file_keys = []
-    for root, _dirs, files in os.walk(local_directory):
-        for filename in files:
-            local_path = os.path.join(root, filename)
-            relative_path = os.path.relpath(local_path, local_directory)
-            s3_path = os.path.join(file_key_prefix, relative_path)
-            s3_client.upload_file(local_path, bucket, s3_path)
-            uploaded_file_keys.append(s3_path)
-
-    return uploaded_file_keys
@@ -0,0 +1,198 @@
+import gc
+import itertools
+import json
+import multiprocessing
+import os
+from contextlib import contextmanager
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+# Raw data files are a JSON array of data assets or newline-delimited JSON, one data asset per line.
+# "auto" picks the fastest available parser for the input, stdlib json is always there as the fallback
+JSON_PARSERS = ("auto", "stdlib", "orjson", "simdjson")
+DEFAULT_JSON_PARSER = "auto"
+# Parsers in the order they are tried. Arrow's JSON reader isn't one of them: its columns can't tell an explicit
+# null from a missing key, and it infers types across lines, f.e. 1 becomes 1.0 next to 2.5 in another line
+ARRAY_PARSERS_ORDER = ("orjson", "simdjson", "stdlib")
+NDJSON_PARSERS_ORDER = ("orjson", "simdjson", "stdlib")
+# Files with these extensions are newline-delimited JSON without looking at the content
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+RAW_DATA_FILE_EXTENSIONS = (".json", *NDJSON_EXTENSIONS)
+# Smaller newline-delimited files are parsed in one block, a process start costs more than their parsing
+PARALLEL_PARSE_MIN_BYTES = 16 * 1024 * 1024
+
+
+def json_parser_from_env():
+    parser = os.environ.get("JSON_PARSER", DEFAULT_JSON_PARSER)
+    if parser not in JSON_PARSERS:
+        raise ValueError(f"Unknown JSON parser: {parser}, expected one of {JSON_PARSERS}")
+    return parser
+
+
+def available_json_parsers():
+    modules = {"stdlib": json, "orjson": orjson, "simdjson": simdjson}
+    return [parser for parser in JSON_PARSERS[1:] if modules[parser] is not None]
+
+
+def resolve_json_parser(parser, ndjson):
+    # The requested parser when it's installed and reads the input, otherwise the next one of the order
+    order = NDJSON_PARSERS_ORDER if ndjson else ARRAY_PARSERS_ORDER
+    available = available_json_parsers()
+    if parser in order and parser in available:
+        return parser
+    return next(candidate for candidate in order if candidate in available)
+
+
+def json_parse_workers_from_env():
+    return int(os.environ.get("JSON_PARSE_WORKERS", "1"))
+
+
+def is_ndjson(file_path):
+    # A JSON array starts with "[", newline-delimited JSON starts with the "{" of its first data asset
+    if file_path.endswith(NDJSON_EXTENSIONS):
+        return True
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(4096)
+            if not block:
+                return False
+            stripped = block.lstrip()
+            if stripped:
+                return stripped[:1] == b"{"
+
+
+def load_raw_data_file(file_path, parser=DEFAULT_JSON_PARSER, parse_workers=1):
+    # Returns the list of data asset dicts, the same as json.load gives for the array input
+    ndjson = is_ndjson(file_path)
+    parser = resolve_json_parser(parser, ndjson)
+    with paused_gc():
+        if ndjson:
+            if parse_workers > 1 and os.path.getsize(file_path) >= PARALLEL_PARSE_MIN_BYTES:
+                return parse_ndjson_blocks(file_path, parser, parse_workers)
+            return load_ndjson_block(file_path, 0, None, parser)
+
+        with open(file_path, "rb") as f:
+            return json_loads(parser)(f.read())
+
+
+def load_raw_data_chunks(chunks, parser=DEFAULT_JSON_PARSER, ndjson=None):
+    # chunks - bytes of a Raw data file in order, f.e. byte ranges of an S3 object arriving one by one
+    with paused_gc():
+        return list(iter_raw_data_records(chunks, parser, ndjson))
+
+
+def iter_raw_data_records(chunks, parser=DEFAULT_JSON_PARSER, ndjson=None):
+    # Lines of newline-delimited JSON are parsed as soon as they arrive, so parsing overlaps the download.
+    # A JSON array is one document, it's parsed when all of its chunks arrived
+    chunks = iter(chunks)
+    first_chunk = next(chunks, b"")
+    if ndjson is None:
+        ndjson = first_chunk.lstrip()[:1] == b"{"
+    parser = resolve_json_parser(parser, ndjson)
+    loads = json_loads(parser)
+
+    if not ndjson:
+        yield from loads(first_chunk + b"".join(chunks))
+        return
+
+    remainder = b""
+    for chunk in itertools.chain([first_chunk], chunks):
+        data = remainder + chunk
+        last_newline = data.rfind(b"\n")
+        if last_newline == -1:
+            remainder = data
+            continue
+        for line in data[:last_newline].splitlines():
+            if line.strip():
+                yield loads(line)
+        remainder = data[last_newline + 1 :]
+    if remainder.strip():
+        yield loads(remainder)
+
+
+def json_loads(parser):
+    return {"stdlib": json.loads, "orjson": getattr(orjson, "loads", None), "simdjson": simdjson_loads}[parser]
+
+
+def ndjson_block_ranges(file_path, blocks_count):
+    # [(start, end)] byte ranges of about equal size, each of them ends after a newline or at the end of the file
+    size = os.path.getsize(file_path)
+    boundaries = [0]
+    with open(file_path, "rb") as f:
+        for index in range(1, blocks_count):
+            position = max(size * index // blocks_count, boundaries[-1])
+            f.seek(position)
+            f.readline()
+            boundaries.append(min(f.tell(), size))
+    boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+def load_ndjson_block(file_path, start, end, parser):
+    # end is exclusive, None reads to the end of the file
+    loads = json_loads(parser)
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        data = f.read() if end is None else f.read(end - start)
+    return [loads(line) for line in data.splitlines() if line.strip()]
+
+
+def parse_ndjson_blocks(file_path, parser, parse_workers):
+    # Python parsers hold the GIL, so blocks are parsed by forked processes. Lambda has no /dev/shm for
+    # the semaphores of multiprocessing pools, plain processes with pipes work there. This process parses
+    # the first block meanwhile, the data assets of the other blocks come back pickled in the file order
+    ranges = ndjson_block_ranges(file_path, parse_workers)
+    context = multiprocessing.get_context("fork")
+    workers = []
+    for start, end in ranges[1:]:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=send_ndjson_block, args=(sender, file_path, start, end, parser), daemon=True)
+        process.start()
+        sender.close()
+        workers.append((process, receiver))
+
+    try:
+        records = load_ndjson_block(file_path, *ranges[0], parser) if ranges else []
+        for _process, receiver in workers:
+            block_records = receiver.recv()
+            if isinstance(block_records, Exception):
+                raise block_records
+            records.extend(block_records)
+        return records
+    finally:
+        for process, receiver in workers:
+            receiver.close()
+            process.join()
+
+
+def send_ndjson_block(sender, file_path, start, end, parser):
+    try:
+        result = load_ndjson_block(file_path, start, end, parser)
+    except Exception as e:  # noqa: BLE001 - any error of the block is raised by the parent process
+        result = e
+    sender.send(result)
+    sender.close()
+
+
+@contextmanager
+def paused_gc():
+    # Parsed JSON has no reference cycles, the collector would only rescan the dicts allocated so far
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def simdjson_loads(data):
+    return simdjson.Parser().parse(data, recursive=True)
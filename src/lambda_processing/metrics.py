@@ -0,0 +1,27 @@
+import json
+import time
+
+NAMESPACE = "MedallionLakehouse"
+
+
+def put_metric(name, value, unit="Count", **dimensions):
+    # Prints the metric in CloudWatch Embedded Metric Format, Lambda log ingestion turns it into a CloudWatch metric
+    # https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+    print(
+        json.dumps(
+            {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": NAMESPACE,
+                            "Dimensions": [sorted(dimensions.keys())],
+                            "Metrics": [{"Name": name, "Unit": unit}],
+                        }
+                    ],
+                },
+                name: value,
+                **dimensions,
+            }
+        )
+    )
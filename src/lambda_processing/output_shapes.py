@@ -0,0 +1,84 @@
+import json
+import os
+
+import pyarrow as pa
+
+# wide - one row per data asset, one iotreadings_<key> column per reading key
+# long - one row per reading: timestamp, dataAsset, reading_name and the value in the column of its type
+OUTPUT_SHAPES = ("wide", "long")
+READING_NAME_COLUMN = "reading_name"
+IOTREADINGS_PREFIX = "iotreadings_"
+VALUE_COLUMNS = {
+    "value_int": pa.int64(),
+    "value_float": pa.float64(),
+    "value_bool": pa.bool_(),
+    "value_string": pa.string(),
+}
+INT64_MIN = -(2**63)
+INT64_MAX = 2**63 - 1
+
+
+def output_shape_from_env():
+    output_shape = os.environ.get("OUTPUT_SHAPE", "wide")
+    if output_shape not in OUTPUT_SHAPES:
+        raise ValueError(f"Unknown output shape: {output_shape}, expected one of {OUTPUT_SHAPES}")
+    return output_shape
+
+
+def long_table_from_assets(data_assets) -> pa.Table:
+    # Takes normalized data assets, data assets without readings produce no rows
+    base_rows = []
+    names = []
+    values = {column: [] for column in VALUE_COLUMNS}
+    for data_asset in data_assets:
+        base_row = {key: value for key, value in data_asset.items() if not key.startswith(IOTREADINGS_PREFIX)}
+        for key, value in data_asset.items():
+            if not key.startswith(IOTREADINGS_PREFIX):
+                continue
+            base_rows.append(base_row)
+            names.append(key[len(IOTREADINGS_PREFIX) :])
+            value_column = value_column_for(value)
+            for column, column_values in values.items():
+                column_values.append(typed_value(value) if column == value_column else None)
+
+    if base_rows:
+        table = pa.Table.from_struct_array(pa.array(base_rows))
+    else:
+        table = pa.table({"timestamp": pa.array([], pa.string()), "dataAsset": pa.array([], pa.string())})
+    # Reading names repeat in every row, dictionary keeps each of them once per column chunk
+    table = table.append_column(READING_NAME_COLUMN, pa.array(names, pa.string()).dictionary_encode())
+    for column, column_type in VALUE_COLUMNS.items():
+        table = table.append_column(column, pa.array(values[column], column_type))
+    return table
+
+
+def value_column_for(value):
+    # bool is a subclass of int, so it goes first
+    if isinstance(value, bool):
+        return "value_bool"
+    if isinstance(value, int):
+        # JSON ints beyond int64 are kept exactly as strings, a float would round them
+        return "value_int" if INT64_MIN <= value <= INT64_MAX else "value_string"
+    if isinstance(value, float):
+        return "value_float"
+    return "value_string"
+
+
+def typed_value(value):
+    if isinstance(value, int) and not isinstance(value, bool) and not INT64_MIN <= value <= INT64_MAX:
+        return str(value)
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    # Nested readings are kept as JSON strings
+    return json.dumps(value)
+
+
+def is_long_schema(schema):
+    return READING_NAME_COLUMN in schema.names
+
+
+def dedup_key_columns_for_schema(key_columns, schema):
+    # In the long shape a reading is identified by its name as well
+    if key_columns and is_long_schema(schema) and READING_NAME_COLUMN not in key_columns:
+        return [*key_columns, READING_NAME_COLUMN]
+    return key_columns
@@ -1,91 +1,448 @@
-import boto3
+import hashlib
+import json
 import os
 import shutil
 import tempfile
-from typing import Tuple
-
+import time
 from datetime import datetime
+
+import boto3
+import pyarrow as pa
+from botocore.exceptions import ClientError
 from pyarrow import dataset as ds
+from pyarrow import parquet as pq
 
+from chunk_index import compacted_chunk_sources_key, group_chunk_keys, is_compacted_chunk_key, iter_chunk_keys
+from compaction import TIMESTAMP_COLUMN, chunk_windows, compacted_row_groups
+from deduplication import dedup_ratio, dedup_settings_from_env, deduplicate_tables
+from metrics import put_metric
+from output_shapes import dedup_key_columns_for_schema
+from rollups import ROLLUP_INTERVALS, build_rollup_from_batches
+from s3_transfer import S3Transfer, directory_file_keys, s3_client_config
+from sparse_tables import (
+    CHUNK_FOOTER_READ_BYTES,
+    chunk_footer_bytes,
+    chunk_footer_schema,
+    chunk_schema,
+    sequential_positions,
+    sparse_row_groups,
+    write_sparse_dataset,
+)
+from upload_ledger import upload_ledger_from_env
+from watermarks import is_late_chunk_key
 
 MAX_ROWS_PER_GROUP = 10000  # Dataset writer will batch incoming data and only write the row groups to the disk when sufficient rows have accumulated.
+# overwrite - daily file is rewritten from the chunks of the current execution
+# append - chunks that are not in the daily manifest yet are written as additional parts of the daily file
+MERGE_MODES = ("overwrite", "append")
+# legacy - job_<id>/<bucket>/<product>/YYYY/MM/DD/YYYY-MM-DD.<job>.snappy.parquet
+# hive - job_<id>/<bucket>/product=<product>/date=YYYY-MM-DD/YYYY-MM-DD.<job>.snappy.parquet
+LAYOUTS = ("legacy", "hive")
 
 
-def lambda_handler(chunked_parquet_files, context, s3_client=None, temp_dir=None, cleanup_on_finish=True):
+def lambda_handler(
+    chunked_parquet_files,
+    context,
+    s3_client=None,
+    temp_dir=None,
+    cleanup_on_finish=True,
+    merge_mode=None,
+    dedup_key_columns=None,
+    dedup_keep=None,
+    layout=None,
+    write_job_manifest=None,
+    write_rollups=None,
+    s3_transfer=None,
+    delete_consumed_chunks=None,
+    upload_ledger=None,
+):
     print(f"Processing chunked parquet files: {chunked_parquet_files}")
 
     if s3_client is None:
-        s3_client = boto3.client("s3")
+        s3_client = boto3.client("s3", config=s3_client_config())
+
+    if s3_transfer is None:
+        s3_transfer = S3Transfer.from_env(s3_client)
 
     if temp_dir is None:
         temp_dir = tempfile.gettempdir()
 
+    if merge_mode is None:
+        merge_mode = os.environ.get("DAILY_FILES_MERGE_MODE", "overwrite")
+    if merge_mode not in MERGE_MODES:
+        raise ValueError(f"Unknown daily files merge mode: {merge_mode}, expected one of {MERGE_MODES}")
+
+    env_dedup_key_columns, env_dedup_keep = dedup_settings_from_env()
+    if dedup_key_columns is None:
+        dedup_key_columns = env_dedup_key_columns
+    if dedup_keep is None:
+        dedup_keep = env_dedup_keep
+
+    if layout is None:
+        layout = os.environ.get("DAILY_FILES_LAYOUT", "legacy")
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown daily files layout: {layout}, expected one of {LAYOUTS}")
+
+    if write_job_manifest is None:
+        write_job_manifest = os.environ.get("WRITE_JOB_MANIFEST", "false").lower() == "true"
+
+    if write_rollups is None:
+        write_rollups = os.environ.get("WRITE_ROLLUPS", "false").lower() == "true"
+
+    if delete_consumed_chunks is None:
+        delete_consumed_chunks = os.environ.get("DELETE_CONSUMED_CHUNKS", "false").lower() == "true"
+    if delete_consumed_chunks and merge_mode != "append":
+        # Overwrite rebuilds a daily file from the chunks of the execution, the chunks of earlier executions
+        # for the same day would be gone
+        raise ValueError("Deleting consumed chunks needs the append daily files merge mode, got: " + merge_mode)
+
     bucket_name = os.environ["PARQUET_FILES_BUCKET_NAME"]
 
-    source_keys_list = sum(chunked_parquet_files, [])
-    print(f"Total: {len(source_keys_list)} file keys.")
+    # FilesProcessor returns a dict with chunk_keys when it left some Raw data files unprocessed,
+    # and a dict with chunk_manifest_key when its chunk keys didn't fit into the state payload
+    if isinstance(chunked_parquet_files, dict):
+        chunked_parquet_files = [chunked_parquet_files]
     # jbpd -> job_id, bucket, product, day
-    source_key_by_jbpd = {}
-    for source_key in source_keys_list:
-        jbpd_parts = chunked_parquet_key_parts(source_key)
-        if jbpd_parts in source_key_by_jbpd:
-            source_key_by_jbpd[jbpd_parts].append(source_key)
-        else:
-            source_key_by_jbpd[jbpd_parts] = [source_key]
+    source_key_by_jbpd = group_chunk_keys(iter_chunk_keys(chunked_parquet_files, s3_client, bucket_name))
+    print(f"Total: {sum(len(keys) for keys in source_key_by_jbpd.values())} file keys.")
+
+    # Retried execution gets the same chunk keys, so it finds the ledger of the failed one and skips the daily files
+    # uploaded by it already
+    if upload_ledger is None:
+        chunk_keys = [key for keys in source_key_by_jbpd.values() for key in keys]
+        upload_ledger = upload_ledger_from_env(s3_client, "parquet_files_processor", chunk_keys)
+    s3_transfer.upload_ledger = upload_ledger
 
     # Let's download and assemble daily Parquet files day by day to reduce a spike load on S3
     source_files_path = os.path.join(temp_dir, "source_files")
     daily_path = os.path.join(temp_dir, "daily_files")
+    late_daily_path = os.path.join(temp_dir, "late_daily_files")
     uploaded_file_keys = []
+    job_manifest_entries_by_job_id = {}
 
     print(f"Assembling daily Parquet files for {len(source_key_by_jbpd)} items.")
 
     for jbpd_parts, source_keys in source_key_by_jbpd.items():
-        print(f"Downloading {len(source_keys)} Parquet files from s3://{bucket_name}")
-        downloaded_files = []
-        for key in source_keys:
-            target_file_path = os.path.join(source_files_path, key)
-            os.makedirs(os.path.dirname(target_file_path), exist_ok=True)
-            s3_client.download_file(bucket_name, key, target_file_path)
-            downloaded_files.append(target_file_path)
+        if upload_ledger is not None:
+            upload_ledger.checkpoint()
+        job_id, bucket, product, day = jbpd_parts
+        target_key = daily_parquet_key(job_id, bucket, product, day, layout)
 
-        joined_dataset = ds.dataset(downloaded_files, format="parquet")
+        # Readings behind the watermarks come in late chunks, one per day and FilesProcessor invocation.
+        # They are merged into one additional part of the daily file, the assembled parts are not rebuilt
+        late_keys = [key for key in source_keys if is_late_chunk_key(key)]
+        if late_keys:
+            source_keys = [key for key in source_keys if not is_late_chunk_key(key)]
+            late_basename_template = late_part_basename_template(late_keys)
+            late_part_path = os.path.join(late_daily_path, target_key)
+            late_part_keys = merge_late_chunks(
+                s3_client,
+                s3_transfer,
+                bucket_name,
+                target_key,
+                {key: os.path.join(source_files_path, key) for key in late_keys},
+                late_part_path,
+                late_basename_template,
+                dedup_key_columns,
+                dedup_keep,
+                merge_mode,
+                cleanup_on_finish,
+            )
+            uploaded_file_keys.extend(late_part_keys)
+            if late_part_keys and write_job_manifest:
+                entries = job_manifest_entries(late_part_path, target_key, bucket, product, day)
+                job_manifest_entries_by_job_id.setdefault(job_id, []).extend(entries)
+            if late_part_keys and write_rollups:
+                uploaded_file_keys.extend(
+                    upload_rollups(
+                        s3_transfer, bucket_name, late_part_path, target_key, late_basename_template, late_daily_path
+                    )
+                )
+            if not source_keys:
+                continue
+
+        manifest = None
+        basename_template = "part-{i}.parquet"
+        if merge_mode == "append":
+            manifest = load_json_object(
+                s3_client, bucket_name, daily_manifest_key(target_key), {"chunks": [], "parts": [], "generation": 0}
+            )
+            source_keys, manifest_chunk_keys = appended_chunk_keys(
+                s3_transfer, bucket_name, source_keys, set(manifest["chunks"])
+            )
+            if not source_keys:
+                print(f"All chunks for {product} {day} are already in the daily Parquet file, skipping.")
+                continue
+            # Each appended generation gets its own part files, existing parts are never rewritten
+            basename_template = f"part-{manifest['generation']}-{{i}}.parquet"
+
+        # Chunks can have different iotreadings columns, row groups are read without their all-null columns
+        # and padded to the unified schema while written. Arrow IPC chunks are memory-mapped, only Parquet ones
+        # are decoded. Schemas come from the chunk footers, so the chunks are downloaded window by window
+        print(f"Reading footers of {len(source_keys)} chunks from s3://{bucket_name}")
+        schema = pa.unify_schemas(chunk_schemas(s3_transfer, bucket_name, source_keys), promote_options="permissive")
+        key_columns = dedup_key_columns_for_schema(dedup_key_columns, schema) if dedup_key_columns else None
+        downloaded_file_by_key = {key: os.path.join(source_files_path, key) for key in source_keys}
+        key_by_file_path = {file_path: key for key, file_path in downloaded_file_by_key.items()}
+        file_paths_by_window = [
+            (window, [downloaded_file_by_key[key] for key in keys]) for window, keys in chunk_windows(source_keys)
+        ]
+
+        def fetch_window(file_paths, key_by_file_path=key_by_file_path):
+            # Binds the chunks of this day, the windows are fetched before the loop moves to the next day
+            return s3_transfer.submit_downloads(bucket_name, {key_by_file_path[path]: path for path in file_paths})
+
+        compaction_stats = {}
+        # Windows are written in time order, within a window rows follow the order of chunk keys in the execution input
+        # and keep policy is applied in that order
+        row_groups = compacted_row_groups(
+            file_paths_by_window,
+            key_columns,
+            dedup_keep,
+            remove_consumed=cleanup_on_finish,
+            stats=compaction_stats,
+            fetch_window=fetch_window,
+        )
 
-        job_id, bucket, product, day = jbpd_parts
-        datetime_obj = datetime.strptime(day, "%Y-%m-%d")
-        target_key = f"job_{job_id}/{bucket}/{product}/{datetime.strftime(datetime_obj, '%Y/%m/%d')}/{datetime.strftime(datetime_obj, '%Y-%m-%d')}.{job_id}.snappy.parquet"
         daily_parquet_path = os.path.join(daily_path, target_key)
         os.makedirs(os.path.dirname(daily_parquet_path), exist_ok=True)
 
         print(f"Writing {os.path.basename(daily_parquet_path)}")
-        write_options = ds.ParquetFileFormat().make_write_options(compression="snappy")
-        ds.write_dataset(
-            joined_dataset,
+        write_sparse_dataset(
+            row_groups,
+            schema,
             daily_parquet_path,
-            format="parquet",
-            basename_template="part-{i}.parquet",
-            existing_data_behavior="overwrite_or_ignore",
-            file_options=write_options,
+            basename_template=basename_template,
             max_rows_per_group=MAX_ROWS_PER_GROUP,
+            compression="snappy",
         )
 
+        if dedup_key_columns:
+            rows_before_dedup = compaction_stats.get("rows_before_dedup", 0)
+            rows_after_dedup = compaction_stats.get("rows_after_dedup", 0)
+            ratio = dedup_ratio(rows_before_dedup, rows_after_dedup)
+            print(f"Deduplicated {product} {day}: {rows_before_dedup} -> {rows_after_dedup} rows.")
+            put_metric("DailyDedupRatio", ratio, unit="None", Stage="ParquetFilesProcessor")
+
+        if write_job_manifest:
+            entries = job_manifest_entries(daily_parquet_path, target_key, bucket, product, day)
+            job_manifest_entries_by_job_id.setdefault(job_id, []).extend(entries)
+
         print(f"Uploading {os.path.basename(daily_parquet_path)} for {product} to s3://{bucket_name}")
-        keys = upload_directory_to_s3(s3_client, daily_parquet_path, bucket_name, target_key)
+        # Rollups are built while the daily parts are uploaded
+        key_by_daily_file_path = directory_file_keys(daily_parquet_path, target_key)
+        daily_uploads = [
+            s3_transfer.upload_file(file_path, bucket_name, key) for file_path, key in key_by_daily_file_path.items()
+        ]
+        keys = list(key_by_daily_file_path.values())
         uploaded_file_keys.extend(keys)
 
+        if write_rollups:
+            uploaded_file_keys.extend(
+                upload_rollups(s3_transfer, bucket_name, daily_parquet_path, target_key, basename_template, daily_path)
+            )
+
+        for daily_upload in daily_uploads:
+            daily_upload.result()
+
+        # Manifest is updated only after the parts are uploaded, so a failed run is appended again on retry
+        if manifest is not None:
+            manifest["chunks"].extend(manifest_chunk_keys)
+            manifest["parts"].extend(keys)
+            manifest["generation"] += 1
+            save_json_object(s3_client, bucket_name, daily_manifest_key(target_key), manifest)
+
+    # Only one ParquetFilesProcessor runs at a time (see S3BronzeLambdaPoolingFunctionReservedConcurrency),
+    # so read-modify-write of the job manifest is not racing with other executions
+    for job_id, entries in job_manifest_entries_by_job_id.items():
+        update_job_manifest(s3_client, bucket_name, job_id, entries)
+
     print("Finished assembling daily Parquet files.")
 
+    if upload_ledger is not None:
+        upload_ledger.delete()
+
+    # Every daily file and manifest of the execution is uploaded at this point, a failed execution never gets here
+    # and is retried from its chunks
+    if delete_consumed_chunks:
+        consumed_chunk_keys = [key for keys in source_key_by_jbpd.values() for key in keys]
+        consumed_chunk_keys += list(
+            dict.fromkeys(
+                compacted_chunk_sources_key(key) for key in consumed_chunk_keys if is_compacted_chunk_key(key)
+            )
+        )
+        delete_chunks(s3_transfer, bucket_name, consumed_chunk_keys)
+
+    s3_transfer.report("ParquetFilesProcessor")
+
     # Remove source and generated daily files
     if cleanup_on_finish:
         if os.path.exists(source_files_path):
             shutil.rmtree(source_files_path)
         if os.path.exists(daily_path):
             shutil.rmtree(daily_path)
+        if os.path.exists(late_daily_path):
+            shutil.rmtree(late_daily_path)
+
+    return uploaded_file_keys
+
+
+def appended_chunk_keys(s3_transfer, bucket_name, source_keys, included_keys):
+    # Returns the chunk keys to append to the daily file and the keys to record in its manifest.
+    # A compacted chunk is recorded with the chunks it replaced, a redelivered Raw data file skipped by the processing
+    # ledger returns those chunks again. A compacted chunk with some of them appended already is replaced by the rest,
+    # they are kept in place until the compacted chunks expire
+    source_keys = [key for key in source_keys if key not in included_keys]
+    sources_keys = list(
+        dict.fromkeys(compacted_chunk_sources_key(key) for key in source_keys if is_compacted_chunk_key(key))
+    )
+    bodies = s3_transfer.map("get_object_body", [((), {"Bucket": bucket_name, "Key": key}) for key in sources_keys])
+    replaced_keys_by_sources_key = {key: json.loads(body)["chunk_keys"] for key, body in zip(sources_keys, bodies)}
+
+    appended_keys = []
+    manifest_chunk_keys = []
+    for key in source_keys:
+        if not is_compacted_chunk_key(key):
+            appended_keys.append(key)
+            manifest_chunk_keys.append(key)
+            continue
+        replaced_keys = replaced_keys_by_sources_key[compacted_chunk_sources_key(key)]
+        new_keys = [replaced_key for replaced_key in replaced_keys if replaced_key not in included_keys]
+        if len(new_keys) == len(replaced_keys):
+            appended_keys.append(key)
+            manifest_chunk_keys.extend([key, *replaced_keys])
+        else:
+            appended_keys.extend(new_keys)
+            manifest_chunk_keys.extend(new_keys)
+    return list(dict.fromkeys(appended_keys)), list(dict.fromkeys(manifest_chunk_keys))
+
+
+def chunk_schemas(s3_transfer, bucket_name, keys):
+    # One suffix range GET per chunk fetches its footer, chunks with larger footers take one more
+    calls = [((), {"Bucket": bucket_name, "Key": key, "Range": f"bytes=-{CHUNK_FOOTER_READ_BYTES}"}) for key in keys]
+    tails = s3_transfer.map("get_object_body", calls)
+    footer_bytes = [chunk_footer_bytes(key, tail) for key, tail in zip(keys, tails)]
+    short_indices = [index for index, tail in enumerate(tails) if footer_bytes[index] > len(tail)]
+    calls = [
+        ((), {"Bucket": bucket_name, "Key": keys[index], "Range": f"bytes=-{footer_bytes[index]}"})
+        for index in short_indices
+    ]
+    for index, tail in zip(short_indices, s3_transfer.map("get_object_body", calls)):
+        tails[index] = tail
+    return [chunk_footer_schema(key, tail) for key, tail in zip(keys, tails)]
 
+
+def delete_chunks(s3_transfer, bucket_name, chunk_keys):
+    # Chunks left after the retries stay in place, their daily files are uploaded already, so they only take space
+    started_at = time.monotonic()
+    requests_before = s3_transfer.requests["delete_objects"]
+    failed_keys = s3_transfer.delete_objects(bucket_name, chunk_keys)
+    seconds = time.monotonic() - started_at
+    requests = s3_transfer.requests["delete_objects"] - requests_before
+    deleted_count = len(set(chunk_keys)) - len(failed_keys)
+    print(
+        f"Deleted {deleted_count} consumed chunks with {requests} DeleteObjects requests in {seconds:.2f} s,"
+        f" {len(failed_keys)} chunks failed."
+    )
+    put_metric("DeletedChunks", deleted_count, Stage="ParquetFilesProcessor")
+    put_metric("ChunksCleanupFailures", len(failed_keys), Stage="ParquetFilesProcessor")
+    put_metric("ChunksCleanupSeconds", seconds, unit="Seconds", Stage="ParquetFilesProcessor")
+    return failed_keys
+
+
+def merge_late_chunks(
+    s3_client,
+    s3_transfer,
+    bucket_name,
+    target_key,
+    downloaded_file_by_key,
+    late_part_path,
+    basename_template,
+    dedup_key_columns=None,
+    dedup_keep="first",
+    merge_mode="overwrite",
+    remove_consumed=True,
+):
+    # Writes and uploads the late part of the daily file from the late chunks, returns the keys of its files.
+    # The part is named after its chunks, so a retry overwrites it, and the overwrite merge mode leaves it in place
+    late_keys = list(downloaded_file_by_key)
+    manifest = None
+    if merge_mode == "append":
+        manifest = load_json_object(
+            s3_client, bucket_name, daily_manifest_key(target_key), {"chunks": [], "parts": [], "generation": 0}
+        )
+        included_keys = set(manifest["chunks"])
+        late_keys = [key for key in late_keys if key not in included_keys]
+        if not late_keys:
+            print(f"All late chunks for {target_key} are already in the daily Parquet file, skipping.")
+            return []
+
+    print(f"Merging {len(late_keys)} late chunks into {os.path.basename(target_key)}")
+    downloaded_file_by_key = {key: downloaded_file_by_key[key] for key in late_keys}
+    s3_transfer.download_files(bucket_name, downloaded_file_by_key)
+    file_paths = list(downloaded_file_by_key.values())
+
+    # Late readings are few and spread over the day, they are merged in memory and sorted by time
+    schema = pa.unify_schemas([chunk_schema(file_path) for file_path in file_paths], promote_options="permissive")
+    tables = list(sparse_row_groups(file_paths))
+    rows_before_dedup = sum(table.num_rows for table in tables)
+    if dedup_key_columns:
+        key_columns = dedup_key_columns_for_schema(dedup_key_columns, schema)
+        tables, _positions = deduplicate_tables(tables, sequential_positions(tables), key_columns, dedup_keep)
+    late_rows = pa.concat_tables(tables, promote_options="permissive").sort_by(TIMESTAMP_COLUMN)
+
+    write_sparse_dataset(
+        [late_rows],
+        schema,
+        late_part_path,
+        basename_template=basename_template,
+        max_rows_per_group=MAX_ROWS_PER_GROUP,
+        compression="snappy",
+    )
+    keys = s3_transfer.upload_directory(late_part_path, bucket_name, target_key)
+    if remove_consumed:
+        for file_path in file_paths:
+            os.remove(file_path)
+
+    print(f"Merged {rows_before_dedup} late readings into {late_rows.num_rows} rows of {keys}")
+    put_metric("LateChunksMerged", len(late_keys), Stage="ParquetFilesProcessor")
+    put_metric("LateRowsMerged", rows_before_dedup, Stage="ParquetFilesProcessor")
+
+    # Manifest is updated only after the part is uploaded, the generation is kept for the regular chunks
+    if manifest is not None:
+        manifest["chunks"].extend(late_keys)
+        manifest["parts"].extend(keys)
+        save_json_object(s3_client, bucket_name, daily_manifest_key(target_key), manifest)
+    return keys
+
+
+def late_part_basename_template(late_keys):
+    digest = hashlib.sha256("\n".join(sorted(late_keys)).encode("utf-8")).hexdigest()[:8]
+    return f"late-{digest}-{{i}}.parquet"
+
+
+def upload_rollups(s3_transfer, bucket_name, daily_parquet_path, target_key, basename_template, local_directory):
+    # Rollup parts mirror daily parts, so appended generations and late parts get their own rollup parts
+    uploaded_file_keys = []
+    daily_file_paths = ds.dataset(daily_parquet_path, format="parquet").files
+    for rollup_name, minutes in ROLLUP_INTERVALS.items():
+        rollup_key = daily_rollup_key(target_key, rollup_name)
+        rollup_path = os.path.join(local_directory, rollup_key)
+        os.makedirs(rollup_path, exist_ok=True)
+        # Daily file can be larger than the memory, it's read batch by batch without dataset readahead
+        daily_batches = (
+            batch
+            for file_path in daily_file_paths
+            for batch in pq.ParquetFile(file_path).iter_batches(batch_size=MAX_ROWS_PER_GROUP)
+        )
+        rollup = build_rollup_from_batches(daily_batches, minutes)
+        pq.write_table(rollup, os.path.join(rollup_path, basename_template.format(i=0)), compression="snappy")
+        print(f"Uploading {rollup_name} rollup of {rollup.num_rows} intervals for {os.path.basename(target_key)}")
+        uploaded_file_keys.extend(s3_transfer.upload_directory(rollup_path, bucket_name, rollup_key))
     return uploaded_file_keys
 
 
-def chunked_parquet_key_parts(key: str) -> Tuple[str, str, str, str]:
+def chunked_parquet_key_parts(key: str) -> tuple[str, str, str, str]:
     # "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
     job, bucket, product, file_name = key.split("/")[1:5]
     job_id = job.split("_")[1]
@@ -93,14 +450,103 @@ def chunked_parquet_key_parts(key: str) -> Tuple[str, str, str, str]:
     return job_id, bucket, product, day
 
 
-def upload_directory_to_s3(s3_client, local_directory, bucket, file_key_prefix):
-    uploaded_file_keys = []
-    for root, _dirs, files in os.walk(local_directory):
-        for filename in files:
+def daily_parquet_key(job_id, bucket, product, day, layout="legacy"):
+    datetime_obj = datetime.strptime(day, "%Y-%m-%d")
+    if layout == "hive":
+        return f"job_{job_id}/{bucket}/product={product}/date={datetime.strftime(datetime_obj, '%Y-%m-%d')}/{datetime.strftime(datetime_obj, '%Y-%m-%d')}.{job_id}.snappy.parquet"
+    return f"job_{job_id}/{bucket}/{product}/{datetime.strftime(datetime_obj, '%Y/%m/%d')}/{datetime.strftime(datetime_obj, '%Y-%m-%d')}.{job_id}.snappy.parquet"
+
+
+def daily_manifest_key(daily_key: str) -> str:
+    # "job_1001/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.1001.snappy.parquet"
+    # -> "job_1001/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.1001.manifest.json"
+    return daily_key.removesuffix(".snappy.parquet") + ".manifest.json"
+
+
+def daily_rollup_key(daily_key: str, rollup_name: str) -> str:
+    # "job_1001/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.1001.snappy.parquet"
+    # -> "job_1001/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.1001.rollup_15min.snappy.parquet"
+    return daily_key.removesuffix(".snappy.parquet") + f".rollup_{rollup_name}.snappy.parquet"
+
+
+def job_manifest_key(job_id: str) -> str:
+    return f"job_{job_id}/_manifest.json"
+
+
+def job_manifest_entries(daily_parquet_path, target_key, bucket, product, day):
+    # Row counts and timestamp ranges come from Parquet footers, so readers can plan scans without S3 LIST calls
+    entries = []
+    for root, _dirs, files in os.walk(daily_parquet_path):
+        for filename in sorted(files):
             local_path = os.path.join(root, filename)
-            relative_path = os.path.relpath(local_path, local_directory)
-            s3_path = os.path.join(file_key_prefix, relative_path)
-            s3_client.upload_file(local_path, bucket, s3_path)
-            uploaded_file_keys.append(s3_path)
+            metadata = pq.read_metadata(local_path)
+            min_timestamp, max_timestamp = column_min_max(metadata, "timestamp")
+            entries.append(
+                {
+                    "key": os.path.join(target_key, os.path.relpath(local_path, daily_parquet_path)),
+                    "bucket": bucket,
+                    "product": product,
+                    "date": day,
+                    "rows": metadata.num_rows,
+                    "size_bytes": os.path.getsize(local_path),
+                    "min_timestamp": min_timestamp,
+                    "max_timestamp": max_timestamp,
+                }
+            )
+    return entries
 
-    return uploaded_file_keys
+
+def update_job_manifest(s3_client, bucket_name, job_id, entries):
+    manifest_key = job_manifest_key(job_id)
+    manifest = load_json_object(s3_client, bucket_name, manifest_key, {"job_id": job_id, "files": []})
+    manifest["files"] = merge_job_manifest_files(manifest["files"], entries)
+    print(f"Writing job manifest with {len(manifest['files'])} files to s3://{bucket_name}/{manifest_key}")
+    save_json_object(s3_client, bucket_name, manifest_key, manifest)
+
+
+def column_min_max(metadata, column_name):
+    if column_name not in metadata.schema.names:
+        return None, None
+    column_index = metadata.schema.names.index(column_name)
+
+    minimums = []
+    maximums = []
+    for row_group_index in range(metadata.num_row_groups):
+        minimum, maximum = row_group_min_max(metadata.row_group(row_group_index), column_index)
+        if minimum is None:
+            return None, None
+        minimums.append(minimum)
+        maximums.append(maximum)
+
+    if not minimums:
+        return None, None
+    return min(minimums), max(maximums)
+
+
+def row_group_min_max(row_group, column_index):
+    statistics = row_group.column(column_index).statistics
+    if statistics is None or not statistics.has_min_max:
+        return None, None
+    return statistics.min, statistics.max
+
+
+def merge_job_manifest_files(files, new_files):
+    # Overwritten daily parts replace their previous entries, appended parts are added
+    files_by_key = {entry["key"]: entry for entry in files}
+    for entry in new_files:
+        files_by_key[entry["key"]] = entry
+    return sorted(files_by_key.values(), key=lambda entry: entry["key"])
+
+
+def load_json_object(s3_client, bucket, key, default):
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+        return default
+    return json.loads(response["Body"].read())
+
+
+def save_json_object(s3_client, bucket, key, value):
+    s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps(value).encode("utf-8"))
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+
+from botocore.exceptions import ClientError
+
+# Ledger remembers which 15min chunk keys were produced from a Raw data file version (S3 key and ETag),
+# so redelivered files are not downloaded and parsed again.
+LEDGER_PREFIX = "_ledger/files_processor"  # underscore prefix is ignored by query engines listing the bucket
+
+
+class S3ProcessingLedger:
+    def __init__(self, s3_client, bucket, prefix=LEDGER_PREFIX):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, source_key, etag):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.entry_key(source_key, etag))
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            return None
+        return json.loads(response["Body"].read())["chunk_keys"]
+
+    def put(self, source_key, etag, chunk_keys):
+        entry = {"source_key": source_key, "etag": etag, "chunk_keys": chunk_keys}
+        self.s3_client.put_object(
+            Bucket=self.bucket, Key=self.entry_key(source_key, etag), Body=json.dumps(entry).encode("utf-8")
+        )
+
+    def entry_key(self, source_key, etag):
+        return f"{self.prefix}/{ledger_entry_id(source_key, etag)}.json"
+
+
+class LocalProcessingLedger:
+    # Single JSON file table, f.e. for local runs and tests
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, source_key, etag):
+        entry = self._read().get(ledger_entry_id(source_key, etag))
+        return None if entry is None else entry["chunk_keys"]
+
+    def put(self, source_key, etag, chunk_keys):
+        entries = self._read()
+        entries[ledger_entry_id(source_key, etag)] = {"source_key": source_key, "etag": etag, "chunk_keys": chunk_keys}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as ledger_file:
+            json.dump(entries, ledger_file)
+        os.replace(temp_path, self.path)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as ledger_file:
+            return json.load(ledger_file)
+
+
+def ledger_entry_id(source_key, etag):
+    return hashlib.sha256(f"{source_key}:{etag}".encode()).hexdigest()
+
+
+def source_chunk_id(source_key, etag):
+    # A Raw data file version gets the same 15min chunk names in any batch it's delivered with,
+    # so a redelivered file overwrites its chunks instead of adding a second copy of its readings
+    return hashlib.sha256(f"{source_key}:{etag}".encode()).hexdigest()[:8]
+
+
+def deterministic_invocation_id(source_key_etags):
+    # Same set of Raw data file versions gets the same invocation id on retry, f.e. for the run ledger
+    digest = hashlib.sha256()
+    for source_key, etag in sorted(source_key_etags):
+        digest.update(f"{source_key}:{etag}\n".encode())
+    return digest.hexdigest()[:8]
+
+
+def processing_ledger_from_env(s3_client):
+    # PROCESSING_LEDGER=s3 keeps the ledger in the Parquet files bucket, empty value disables it
+    ledger_type = os.environ.get("PROCESSING_LEDGER", "")
+    if ledger_type == "":
+        return None
+    if ledger_type == "s3":
+        return S3ProcessingLedger(s3_client, os.environ["PARQUET_FILES_BUCKET_NAME"])
+    if ledger_type.startswith("local:"):
+        return LocalProcessingLedger(ledger_type.removeprefix("local:"))
+    raise ValueError(f"Unknown processing ledger: {ledger_type}, expected s3, local:<path> or empty value")
@@ -0,0 +1,106 @@
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from output_shapes import READING_NAME_COLUMN, is_long_schema
+
+# Rollup name -> interval length in minutes
+ROLLUP_INTERVALS = {"15min": 15, "1h": 60}
+# sum and count make rollups of separate daily parts mergeable, mean is for direct reads
+ROLLUP_AGGREGATIONS = ("min", "max", "mean", "count", "sum")
+INTERVAL_START_COLUMN = "interval_start"
+
+
+def build_rollup(table: pa.Table, minutes) -> pa.Table:
+    # wide: iotreadings_value1 -> iotreadings_value1_min, iotreadings_value1_max, ... per interval
+    # long: value_int, value_float -> value_int_min, value_float_min, ... per interval and reading_name
+    if is_long_schema(table.schema):
+        # Dictionary encoded reading names can't be sorted, rollups are small enough to keep plain strings
+        table = table.set_column(
+            table.schema.get_field_index(READING_NAME_COLUMN),
+            READING_NAME_COLUMN,
+            table[READING_NAME_COLUMN].cast(pa.string()),
+        )
+        group_columns = [INTERVAL_START_COLUMN, READING_NAME_COLUMN]
+        value_columns = [name for name in ("value_int", "value_float") if name in table.column_names]
+    else:
+        group_columns = [INTERVAL_START_COLUMN]
+        value_columns = [
+            field.name
+            for field in table.schema
+            if field.name.startswith("iotreadings_")
+            and (pa.types.is_integer(field.type) or pa.types.is_floating(field.type))
+        ]
+    interval_start = pc.floor_temporal(parse_timestamps(table["timestamp"]), multiple=minutes, unit="minute")
+    intervals_table = table.select([*group_columns[1:], *value_columns]).append_column(
+        INTERVAL_START_COLUMN, interval_start
+    )
+
+    aggregations = [(column, aggregation) for column in value_columns for aggregation in ROLLUP_AGGREGATIONS]
+    rollup = intervals_table.group_by(group_columns, use_threads=False).aggregate(aggregations)
+    rollup = rollup.select([*group_columns, *[name for name in rollup.column_names if name not in group_columns]])
+    return rollup.sort_by([(column, "ascending") for column in group_columns])
+
+
+def build_rollup_from_batches(batches, minutes) -> pa.Table:
+    # Rollup of a daily file read batch by batch, partial rollups of batches are merged,
+    # sum and count add up, min and max are taken of partial ones, mean is sum / count
+    partial_rollups = [build_rollup(pa.Table.from_batches([batch]), minutes) for batch in batches]
+    if not partial_rollups:
+        return pa.table({INTERVAL_START_COLUMN: pa.array([], pa.timestamp("ms", tz="UTC"))})
+    rollup = pa.concat_tables(partial_rollups, promote_options="permissive")
+    group_columns = [name for name in (INTERVAL_START_COLUMN, READING_NAME_COLUMN) if name in rollup.column_names]
+    value_columns = [
+        name.removesuffix("_min")
+        for name in rollup.column_names
+        if name.endswith("_min") and f"{name.removesuffix('_min')}_count" in rollup.column_names
+    ]
+
+    merge_aggregations = {"min": "min", "max": "max", "count": "sum", "sum": "sum"}
+    aggregations = [
+        (f"{column}_{aggregation}", merge_aggregations[aggregation])
+        for column in value_columns
+        for aggregation in ROLLUP_AGGREGATIONS
+        if aggregation in merge_aggregations
+    ]
+    merged = rollup.group_by(group_columns, use_threads=False).aggregate(aggregations)
+
+    columns = {column: merged[column] for column in group_columns}
+    for column in value_columns:
+        sums = merged[f"{column}_sum_sum"]
+        counts = merged[f"{column}_count_sum"]
+        merged_columns = {
+            "min": merged[f"{column}_min_min"],
+            "max": merged[f"{column}_max_max"],
+            "mean": pc.divide(pc.cast(sums, pa.float64()), pc.cast(counts, pa.float64())),
+            "count": counts,
+            "sum": sums,
+        }
+        for aggregation in ROLLUP_AGGREGATIONS:
+            columns[f"{column}_{aggregation}"] = merged_columns[aggregation]
+    return pa.table(columns).sort_by([(column, "ascending") for column in group_columns])
+
+
+def parse_timestamps(timestamps):
+    # Devices send "2024-09-30T13:44:01.000Z", timestamps without a zone offset are taken as UTC
+    try:
+        return pc.cast(timestamps, pa.timestamp("ms", tz="UTC"))
+    except pa.ArrowInvalid:
+        pass
+    try:
+        return pc.assume_timezone(pc.cast(timestamps, pa.timestamp("ms")), "UTC")
+    except pa.ArrowInvalid:
+        pass
+
+    # Mixed formats are parsed one by one, like in files_processor
+    parsed = []
+    for value in timestamps.to_pylist():
+        if value is None:
+            parsed.append(None)
+            continue
+        timestamp = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        parsed.append(timestamp)
+    return pa.array(parsed, type=pa.timestamp("ms", tz="UTC"))
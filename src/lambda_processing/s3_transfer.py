@@ -0,0 +1,311 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError, ConnectionError, HTTPClientError
+
+from metrics import put_metric
+from upload_ledger import CHECKSUM_METADATA_KEY, file_checksum
+
+# Concurrency 1 keeps S3 requests one by one, the stack parameter raises it for the deployed lambdas
+DEFAULT_MAX_CONCURRENCY = 1
+DEFAULT_MAX_ATTEMPTS = 5
+BASE_RETRY_DELAY_SECONDS = 0.1
+MAX_RETRY_DELAY_SECONDS = 5
+# Blocking boto3 calls run on threads, the client is thread safe and shares its connection pool between them
+MAX_TRANSFER_THREADS = 64
+LIST_PAGE_SIZE = 1000
+# DeleteObjects takes up to 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+# Large objects are fetched in byte ranges, each of them is a GET request of its own
+DEFAULT_RANGE_PART_SIZE = 8 * 1024 * 1024
+RETRYABLE_ERROR_CODES = {
+    "500",
+    "503",
+    "InternalError",
+    "RequestTimeout",
+    "RequestTimeTooSkewed",
+    "ServiceUnavailable",
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+}
+# Upper bounds of the request latency histogram buckets in milliseconds, the last bucket is unbounded
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# One event loop thread per process is shared by all transfers, so warm lambdas don't leak threads
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+
+class S3Transfer:
+    """Runs S3 requests concurrently on an asyncio event loop, with retries and per operation statistics."""
+
+    def __init__(
+        self,
+        s3_client,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        base_retry_delay_seconds=BASE_RETRY_DELAY_SECONDS,
+        upload_ledger=None,
+    ):
+        self.s3_client = s3_client
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.base_retry_delay_seconds = base_retry_delay_seconds
+        # Set by the handler once its input is known, see upload_ledger.py
+        self.upload_ledger = upload_ledger
+        # Created on the event loop, Python 3.9 binds a semaphore to the loop of the thread creating it
+        self.semaphore = None
+        # Updated on the event loop thread only
+        self.requests = Counter()
+        self.retries = Counter()
+        self.latency_histograms = {}
+        self.skipped_uploads = 0
+        # Operations reading the response body on the transfer thread, boto3 streams it lazily otherwise
+        self.body_operations = {"get_object_body": self.get_object_body}
+
+    @classmethod
+    def from_env(cls, s3_client):
+        max_concurrency = int(os.environ.get("S3_TRANSFER_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+        max_attempts = int(os.environ.get("S3_TRANSFER_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS))
+        return cls(s3_client, max_concurrency, max_attempts)
+
+    def submit(self, operation_name, *args, **kwargs):
+        # Returns concurrent.futures.Future, so callers can overlap the request with their own work
+        return asyncio.run_coroutine_threadsafe(self.call(operation_name, *args, **kwargs), event_loop())
+
+    def map(self, operation_name, calls):
+        # calls - [(args, kwargs)], results are in calls order, the first failed request raises its error
+        futures = [self.submit(operation_name, *args, **kwargs) for args, kwargs in calls]
+        return [future.result() for future in futures]
+
+    async def call(self, operation_name, *args, **kwargs):
+        operation = self.body_operations.get(operation_name) or getattr(self.s3_client, operation_name)
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            for attempt in range(1, self.max_attempts + 1):
+                started_at = time.monotonic()
+                try:
+                    return await asyncio.to_thread(operation, *args, **kwargs)
+                except Exception as e:
+                    if attempt == self.max_attempts or not is_retryable(e):
+                        raise
+                    self.retries[operation_name] += 1
+                    await asyncio.sleep(retry_delay_seconds(attempt, self.base_retry_delay_seconds))
+                finally:
+                    self.record_request(operation_name, (time.monotonic() - started_at) * 1000)
+
+    def record_request(self, operation_name, latency_ms):
+        self.requests[operation_name] += 1
+        histogram = self.latency_histograms.setdefault(operation_name, Counter())
+        histogram[latency_bucket(latency_ms)] += 1
+
+    def download_file(self, bucket, key, file_path):
+        return self.submit("download_file", bucket, key, file_path)
+
+    def get_object_body(self, **kwargs):
+        return self.s3_client.get_object(**kwargs)["Body"].read()
+
+    def iter_object_ranges(self, bucket, key, size, part_size=DEFAULT_RANGE_PART_SIZE):
+        # Up to max_concurrency ranges are requested ahead of the one the caller reads, so memory holds that many
+        # ranges instead of the whole object. Ranges are yielded in order, each as soon as it arrived
+        futures = deque()
+        try:
+            for start in range(0, size, part_size):
+                byte_range = f"bytes={start}-{min(start + part_size, size) - 1}"
+                futures.append(self.submit("get_object_body", Bucket=bucket, Key=key, Range=byte_range))
+                if len(futures) > self.max_concurrency:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def submit_downloads(self, bucket, file_path_by_key):
+        # Returns futures of the downloads, so callers can download the next files while reading the current ones
+        for file_path in file_path_by_key.values():
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        return [self.download_file(bucket, key, file_path) for key, file_path in file_path_by_key.items()]
+
+    def download_files(self, bucket, file_path_by_key):
+        for future in self.submit_downloads(bucket, file_path_by_key):
+            future.result()
+
+    def head_objects(self, bucket, keys):
+        return self.map("head_object", [((), {"Bucket": bucket, "Key": key}) for key in keys])
+
+    def upload_file(self, file_path, bucket, key):
+        # Returns concurrent.futures.Future like submit(). The ledger is read on the caller thread, it loads lazily
+        recorded_checksum = self.upload_ledger.checksum(key) if self.upload_ledger is not None else None
+        return asyncio.run_coroutine_threadsafe(
+            self.checked_upload(file_path, bucket, key, recorded_checksum), event_loop()
+        )
+
+    async def checked_upload(self, file_path, bucket, key, recorded_checksum):
+        # S3 verifies the body of each upload request against its SHA256 and rejects a corrupted one.
+        # A file recorded by the failed run before is skipped when the object in S3 has the same checksum
+        checksum = await asyncio.to_thread(file_checksum, file_path)
+        if recorded_checksum == checksum and await self.stored_checksum(bucket, key) == checksum:
+            self.skipped_uploads += 1
+            return
+        extra_args = {"ChecksumAlgorithm": "SHA256", "Metadata": {CHECKSUM_METADATA_KEY: checksum}}
+        await self.call("upload_file", file_path, bucket, key, ExtraArgs=extra_args)
+        if self.upload_ledger is not None:
+            self.upload_ledger.record(key, checksum)
+
+    async def stored_checksum(self, bucket, key):
+        try:
+            response = await self.call("head_object", Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            return None
+        return response.get("Metadata", {}).get(CHECKSUM_METADATA_KEY)
+
+    def upload_files(self, bucket, key_by_file_path):
+        futures = [self.upload_file(file_path, bucket, key) for file_path, key in key_by_file_path.items()]
+        for future in futures:
+            future.result()
+        return list(key_by_file_path.values())
+
+    def upload_directory(self, local_directory, bucket, file_key_prefix):
+        return self.upload_directories(bucket, {local_directory: file_key_prefix})[local_directory]
+
+    def upload_directories(self, bucket, file_key_prefix_by_directory):
+        # Files of all directories are uploaded concurrently, a 15min chunk directory usually has one file
+        key_by_file_path_by_directory = {
+            directory: directory_file_keys(directory, file_key_prefix)
+            for directory, file_key_prefix in file_key_prefix_by_directory.items()
+        }
+        self.upload_files(
+            bucket, {path: key for keys in key_by_file_path_by_directory.values() for path, key in keys.items()}
+        )
+        return {directory: list(keys.values()) for directory, keys in key_by_file_path_by_directory.items()}
+
+    def list_objects(self, bucket, prefix=""):
+        # Pages of up to 1000 keys, each page needs the continuation token of the previous one
+        objects = []
+        kwargs = {"Bucket": bucket, "Prefix": prefix, "MaxKeys": LIST_PAGE_SIZE}
+        while True:
+            response = self.submit("list_objects_v2", **kwargs).result()
+            objects.extend(response.get("Contents", []))
+            if not response.get("IsTruncated"):
+                return objects
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    def delete_objects(self, bucket, keys):
+        # Batches are deleted concurrently, failed requests are retried by call(). DeleteObjects also fails
+        # single keys inside a successful response, f.e. with SlowDown, those keys are sent again in the next round.
+        # Returns keys that couldn't be deleted, the caller decides whether leftovers are worth failing for
+        pending_keys = list(dict.fromkeys(keys))
+        failed_keys = []
+        for attempt in range(1, self.max_attempts + 1):
+            batches = [pending_keys[i : i + DELETE_BATCH_SIZE] for i in range(0, len(pending_keys), DELETE_BATCH_SIZE)]
+            futures = [
+                self.submit(
+                    "delete_objects",
+                    Bucket=bucket,
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+                )
+                for batch in batches
+            ]
+            retryable_keys = []
+            for batch, future in zip(batches, futures):
+                try:
+                    errors = future.result().get("Errors", [])
+                except (BotoCoreError, ClientError) as e:
+                    print(f"Failed to delete {len(batch)} objects from s3://{bucket}: {e}")
+                    failed_keys.extend(batch)
+                    continue
+                for error in errors:
+                    if error.get("Code") in RETRYABLE_ERROR_CODES and attempt < self.max_attempts:
+                        retryable_keys.append(error["Key"])
+                    else:
+                        failed_keys.append(error["Key"])
+            if not retryable_keys:
+                break
+            time.sleep(retry_delay_seconds(attempt, self.base_retry_delay_seconds))
+            pending_keys = retryable_keys
+        return failed_keys
+
+    def print_statistics(self):
+        for operation_name, count in sorted(self.requests.items()):
+            histogram = self.latency_histograms[operation_name]
+            buckets = ", ".join(f"{label}: {histogram[label]}" for label in latency_bucket_labels() if histogram[label])
+            print(f"S3 {operation_name}: {count} requests, {self.retries[operation_name]} retries, latency {buckets}")
+
+    def report(self, stage):
+        self.print_statistics()
+        if self.upload_ledger is not None:
+            print(f"Skipped {self.skipped_uploads} uploads of objects already in S3 with matching checksums.")
+            put_metric("S3SkippedUploads", self.skipped_uploads, Stage=stage)
+        for operation_name, count in sorted(self.requests.items()):
+            put_metric("S3Requests", count, Stage=stage, Operation=operation_name)
+            put_metric("S3Retries", self.retries[operation_name], Stage=stage, Operation=operation_name)
+
+
+def s3_client_config():
+    # Connection pool fits the concurrent requests, botocore keeps 10 connections by default
+    max_concurrency = int(os.environ.get("S3_TRANSFER_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+    return Config(max_pool_connections=max(10, max_concurrency))
+
+
+def directory_file_keys(local_directory, file_key_prefix):
+    key_by_file_path = {}
+    for root, _dirs, files in os.walk(local_directory):
+        for filename in files:
+            local_path = os.path.join(root, filename)
+            relative_path = os.path.relpath(local_path, local_directory)
+            key_by_file_path[local_path] = os.path.join(file_key_prefix, relative_path)
+    return key_by_file_path
+
+
+def forget_event_loop():
+    # A forked process has no event loop thread, f.e. a worker of the local runner pool, it starts its own
+    global _event_loop, _event_loop_lock
+    _event_loop = None
+    _event_loop_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=forget_event_loop)
+
+
+def event_loop():
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            _event_loop.set_default_executor(ThreadPoolExecutor(MAX_TRANSFER_THREADS, thread_name_prefix="s3-transfer"))
+            threading.Thread(target=_event_loop.run_forever, name="s3-transfer-loop", daemon=True).start()
+    return _event_loop
+
+
+def is_retryable(error):
+    # Missing keys and denied access won't change on retry, throttling and connection errors might
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES
+    return isinstance(error, (ConnectionError, HTTPClientError))
+
+
+def retry_delay_seconds(attempt, base_delay_seconds=BASE_RETRY_DELAY_SECONDS):
+    # Full jitter spreads retries of concurrent requests throttled at the same moment
+    return random.uniform(0, min(MAX_RETRY_DELAY_SECONDS, base_delay_seconds * 2 ** (attempt - 1)))
+
+
+def latency_bucket(latency_ms):
+    for upper_bound in LATENCY_BUCKETS_MS:
+        if latency_ms <= upper_bound:
+            return f"<={upper_bound}ms"
+    return f">{LATENCY_BUCKETS_MS[-1]}ms"
+
+
+def latency_bucket_labels():
+    return [f"<={upper_bound}ms" for upper_bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
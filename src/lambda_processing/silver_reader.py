@@ -0,0 +1,251 @@
+import hashlib
+import io
+import json
+import os
+from datetime import datetime, timedelta, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from botocore.exceptions import ClientError
+from pyarrow import parquet as pq
+
+from parquet_files_processor import daily_parquet_key, job_manifest_key, row_group_min_max
+
+# Reads daily Parquet files of the S3 Silver bucket for a product and time range,
+# fetching only the footers and the row groups that can contain the requested rows.
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+class SilverReader:
+    def __init__(
+        self,
+        s3_client,
+        bucket,
+        source_bucket,
+        layout="legacy",
+        cache_directory=None,
+        cache_max_bytes=DEFAULT_CACHE_MAX_BYTES,
+    ):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.source_bucket = source_bucket
+        self.layout = layout
+        self.cache = None if cache_directory is None else DiskLRUCache(cache_directory, cache_max_bytes)
+        self.stats = {"requests": 0, "bytes_fetched": 0, "cache_hits": 0, "row_groups_read": 0, "row_groups_skipped": 0}
+
+    def read(self, job_id, product, start, end, columns=None) -> pa.Table:
+        # Rows with start <= timestamp < end, timestamps are compared as ISO 8601 strings in UTC
+        start_iso = iso_timestamp(start)
+        end_iso = iso_timestamp(end)
+
+        tables = []
+        for key in self.resolve_keys(job_id, product, start, end):
+            table = self._read_object(key, start_iso, end_iso, columns)
+            if table is not None:
+                tables.append(table)
+
+        if not tables:
+            return pa.table({})
+        return pa.concat_tables(tables, promote_options="default")
+
+    def resolve_keys(self, job_id, product, start, end):
+        days = days_in_range(start, end)
+        manifest = self._load_manifest(job_id)
+        if manifest is not None:
+            start_iso = iso_timestamp(start)
+            end_iso = iso_timestamp(end)
+            return [
+                entry["key"]
+                for entry in manifest["files"]
+                if entry.get("bucket") == self.source_bucket
+                and entry.get("product") == product
+                and entry.get("date") in days
+                and (entry.get("max_timestamp") is None or entry["max_timestamp"] >= start_iso)
+                and (entry.get("min_timestamp") is None or entry["min_timestamp"] < end_iso)
+            ]
+
+        # Without a manifest, list each daily Parquet file prefix of the key layout
+        keys = []
+        for day in days:
+            prefix = daily_parquet_key(job_id, self.source_bucket, product, day, self.layout) + "/"
+            keys.extend(self._list_keys(prefix))
+        return keys
+
+    def _read_object(self, key, start_iso, end_iso, columns):
+        head = self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        self.stats["requests"] += 1
+        source = S3RangeFile(
+            self.s3_client, self.bucket, key, head["ContentLength"], head["ETag"], self.cache, self.stats
+        )
+        parquet_file = pq.ParquetFile(source, pre_buffer=True)
+        metadata = parquet_file.metadata
+
+        if "timestamp" not in metadata.schema.names:
+            raise ValueError(f"Daily Parquet file s3://{self.bucket}/{key} has no timestamp column to filter by")
+        timestamp_index = metadata.schema.names.index("timestamp")
+        row_groups = []
+        for index in range(metadata.num_row_groups):
+            min_timestamp, max_timestamp = row_group_min_max(metadata.row_group(index), timestamp_index)
+            if min_timestamp is not None and (max_timestamp < start_iso or min_timestamp >= end_iso):
+                self.stats["row_groups_skipped"] += 1
+                continue
+            row_groups.append(index)
+        if not row_groups:
+            return None
+        self.stats["row_groups_read"] += len(row_groups)
+
+        read_columns = None
+        if columns is not None:
+            # Sparse iotreadings columns can be missing in some daily files
+            read_columns = [name for name in dict.fromkeys(["timestamp", *columns]) if name in metadata.schema.names]
+        table = parquet_file.read_row_groups(row_groups, columns=read_columns)
+        mask = pc.and_(pc.greater_equal(table["timestamp"], start_iso), pc.less(table["timestamp"], end_iso))
+        table = table.filter(mask)
+        if columns is not None:
+            table = table.select([name for name in columns if name in table.column_names])
+        return table
+
+    def _load_manifest(self, job_id):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=job_manifest_key(job_id))
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            return None
+        finally:
+            self.stats["requests"] += 1
+        return json.loads(response["Body"].read())
+
+    def _list_keys(self, prefix):
+        keys = []
+        continuation = {}
+        while True:
+            response = self.s3_client.list_objects_v2(Bucket=self.bucket, Prefix=prefix, **continuation)
+            self.stats["requests"] += 1
+            keys.extend(entry["Key"] for entry in response.get("Contents", []))
+            if not response.get("IsTruncated"):
+                return keys
+            continuation = {"ContinuationToken": response["NextContinuationToken"]}
+
+
+class S3RangeFile(io.RawIOBase):
+    # Read-only file over an S3 object, every read is a ranged GET, or a hit in the disk cache
+    def __init__(self, s3_client, bucket, key, size, etag, cache=None, stats=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.etag = etag
+        self.cache = cache
+        self.stats = stats if stats is not None else {"requests": 0, "bytes_fetched": 0, "cache_hits": 0}
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+        data = self.read_range(self.position, length)
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def read_range(self, start, length):
+        cache_key = f"{self.bucket}/{self.key}@{self.etag}:{start}+{length}"
+        if self.cache is not None:
+            data = self.cache.get(cache_key)
+            if data is not None:
+                self.stats["cache_hits"] += 1
+                return data
+
+        response = self.s3_client.get_object(
+            Bucket=self.bucket, Key=self.key, Range=f"bytes={start}-{start + length - 1}"
+        )
+        data = response["Body"].read()
+        self.stats["requests"] += 1
+        self.stats["bytes_fetched"] += len(data)
+        if self.cache is not None:
+            self.cache.put(cache_key, data)
+        return data
+
+
+class DiskLRUCache:
+    # Byte ranges (Parquet footers and column chunks of row groups) stored as files, least recently used are evicted
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as cached_file:
+                data = cached_file.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # mtime tracks the last access
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as cached_file:
+            cached_file.write(data)
+        os.replace(temp_path, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+        for _mtime, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            os.remove(path)
+            total_size -= size
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+
+def iso_timestamp(value):
+    # datetime or ISO 8601 string -> "2024-09-30T13:44:01.000Z" as written by the devices
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def days_in_range(start, end):
+    first_day = datetime.fromisoformat(iso_timestamp(start)[:10])
+    last_day = datetime.fromisoformat(iso_timestamp(end)[:10])
+    days = []
+    day = first_day
+    while day <= last_day:
+        days.append(day.strftime("%Y-%m-%d"))
+        day += timedelta(days=1)
+    return days
@@ -0,0 +1,229 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import dataset as ds
+
+# Data assets send different iotreadings key sets, a table with the union of all keys is mostly nulls.
+# Rows are kept as a list of tables, one per distinct column set, and missing columns are filled with
+# slices of one shared null array per type only when row groups are written,
+# so memory scales with the values actually present.
+
+# 15min chunks are Parquet files, or Arrow IPC files the daily assembly memory-maps without decoding.
+# Chunk format -> (file extension, compression)
+CHUNK_FORMATS = {"parquet": ("parquet", "snappy"), "arrow": ("arrow", None), "arrow_lz4": ("arrow", "lz4")}
+ARROW_EXTENSION = ".arrow"
+# Chunk footers are fetched with one suffix range GET, a larger footer takes one more request
+CHUNK_FOOTER_READ_BYTES = 64 * 1024
+# Parquet file ends with the footer length and "PAR1", Arrow IPC file with the footer length and "ARROW1"
+PARQUET_MAGIC = b"PAR1"
+ARROW_MAGIC = b"ARROW1"
+# Column set tables pay off for a few large groups of records only, see column_set_tables
+MAX_COLUMN_SETS = 64
+MIN_ROWS_PER_COLUMN_SET = 250
+
+
+def chunk_format_from_env():
+    chunk_format = os.environ.get("CHUNK_FORMAT", "parquet")
+    if chunk_format not in CHUNK_FORMATS:
+        raise ValueError(f"Unknown chunk format: {chunk_format}, expected one of {tuple(CHUNK_FORMATS)}")
+    return chunk_format
+
+
+def column_set_tables(records, max_column_sets=MAX_COLUMN_SETS, min_rows_per_column_set=MIN_ROWS_PER_COLUMN_SET):
+    # [{"a": 1}, {"b": 2}, {"a": 3}] -> tables [a: [1, 3]], [b: [2]] and positions [0, 2], [1]
+    # Every column set table costs a table build and a column chunk per column of each row group, so with
+    # many or small column sets all records become one table with the union of the keys instead
+    records_by_column_set = {}
+    positions_by_column_set = {}
+    for position, record in enumerate(records):
+        # Same keys in a different order are the same column set
+        column_set = frozenset(record)
+        if column_set in records_by_column_set:
+            records_by_column_set[column_set].append(record)
+            positions_by_column_set[column_set].append(position)
+        else:
+            if len(records_by_column_set) == max_column_sets:
+                return union_table(records)
+            records_by_column_set[column_set] = [record]
+            positions_by_column_set[column_set] = [position]
+
+    column_sets = len(records_by_column_set)
+    if column_sets > 1 and len(records) < column_sets * min_rows_per_column_set:
+        return union_table(records)
+
+    tables = [pa.Table.from_pylist(group) for group in records_by_column_set.values()]
+    positions = [np.array(group, dtype=np.int64) for group in positions_by_column_set.values()]
+    return tables, positions
+
+
+def union_table(records):
+    # One table with the union of the keys of all records, missing keys are nulls
+    tables = [pa.Table.from_struct_array(pa.array(records))]
+    return tables, sequential_positions(tables)
+
+
+def sequential_positions(tables, start=0):
+    positions = []
+    for table in tables:
+        positions.append(np.arange(start, start + table.num_rows, dtype=np.int64))
+        start += table.num_rows
+    return positions
+
+
+def unify_sparse_schemas(tables):
+    # Permissive promotion matches the type inference over all rows, f.e. int64 and double columns become double
+    return pa.unify_schemas([table.schema for table in tables], promote_options="permissive")
+
+
+def sparse_row_groups(file_paths, columns=None):
+    # Yields row groups with only the columns having values, all-null column chunks are not read at all.
+    # columns limits the read to the given columns, the ones without values are still left out
+    for file_path in file_paths:
+        if file_path.endswith(ARROW_EXTENSION):
+            for batch_table in arrow_record_batches(file_path):
+                if columns is not None:
+                    batch_table = batch_table.select([name for name in batch_table.column_names if name in columns])
+                yield batch_table
+            continue
+        parquet_file = pq.ParquetFile(file_path)
+        metadata = parquet_file.metadata
+        for row_group_index in range(metadata.num_row_groups):
+            read_columns = non_null_columns(metadata.row_group(row_group_index))
+            if columns is not None:
+                read_columns = [name for name in read_columns if name in columns]
+            yield parquet_file.read_row_group(row_group_index, columns=read_columns)
+
+
+def arrow_record_batches(file_path):
+    # Batches of an uncompressed file reference the memory-mapped pages, nothing is decoded or copied.
+    # Null counts are stored in the IPC message headers, so dropping all-null columns needs no scan either
+    reader = pa.ipc.open_file(pa.memory_map(file_path))
+    for batch_index in range(reader.num_record_batches):
+        batch = reader.get_batch(batch_index)
+        columns = [field.name for field, column in zip(batch.schema, batch.columns) if column.null_count < len(column)]
+        yield pa.Table.from_batches([batch]).select(columns)
+
+
+def chunk_schema(file_path):
+    if file_path.endswith(ARROW_EXTENSION):
+        return pa.ipc.open_file(pa.memory_map(file_path)).schema
+    return pq.read_schema(file_path)
+
+
+def chunk_footer_bytes(key, tail):
+    # -> number of bytes at the end of the chunk file holding its footer, tail is the end of the file
+    magic = ARROW_MAGIC if key.endswith(ARROW_EXTENSION) else PARQUET_MAGIC
+    if not tail.endswith(magic):
+        raise ValueError(f"Chunk {key} doesn't end with the {magic.decode()} footer")
+    footer_length = int.from_bytes(tail[-len(magic) - 4 : -len(magic)], "little")
+    return footer_length + len(magic) + 4
+
+
+def chunk_footer_schema(key, tail):
+    # Schema is read from the footer alone, prefixed with the leading magic, so a file is open without its data.
+    # Offsets of the row groups and record batches point outside of it, they are not followed
+    footer = tail[-chunk_footer_bytes(key, tail) :]
+    if key.endswith(ARROW_EXTENSION):
+        return pa.ipc.open_file(pa.BufferReader(ARROW_MAGIC + b"\x00\x00" + footer)).schema
+    return pq.read_schema(pa.BufferReader(PARQUET_MAGIC + footer))
+
+
+def chunk_file_paths(directory_path):
+    file_format = "ipc" if directory_path.endswith(ARROW_EXTENSION) else "parquet"
+    return ds.dataset(directory_path, format=file_format).files
+
+
+def non_null_columns(row_group):
+    # Nested columns have several leaves, like "location.lat", the top level column is kept if any leaf has values
+    columns = {}
+    for column_index in range(row_group.num_columns):
+        column = row_group.column(column_index)
+        name = column.path_in_schema.split(".")[0]
+        statistics = column.statistics
+        all_null = statistics is not None and statistics.has_null_count and statistics.null_count == column.num_values
+        columns[name] = columns.get(name, False) or not all_null
+    return [name for name, has_values in columns.items() if has_values]
+
+
+def write_sparse_dataset(
+    tables,
+    schema,
+    directory_path,
+    basename_template="part-{i}.parquet",
+    max_rows_per_file=None,
+    max_rows_per_group=10000,
+    compression="snappy",
+    file_format="parquet",
+):
+    # Same files as ds.write_dataset, but row groups are assembled from column set tables without
+    # concatenation, every column of a row group is a chunked array of the tables' columns and null slices.
+    # With file_format="arrow" row groups are written as record batches of an Arrow IPC file
+    os.makedirs(directory_path, exist_ok=True)
+    null_arrays = {}
+    file_paths = []
+    writer = None
+    rows_in_file = 0
+    try:
+        for pieces in row_group_pieces(tables, max_rows_per_group):
+            rows = sum(piece.num_rows for piece in pieces)
+            if writer is None or (max_rows_per_file and rows_in_file + rows > max_rows_per_file):
+                if writer is not None:
+                    writer.close()
+                file_path = os.path.join(directory_path, basename_template.format(i=len(file_paths)))
+                if file_format == "arrow":
+                    writer = pa.ipc.new_file(file_path, schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+                else:
+                    writer = pq.ParquetWriter(file_path, schema, compression=compression)
+                file_paths.append(file_path)
+                rows_in_file = 0
+            table = padded_table(pieces, schema, null_arrays, max_rows_per_group)
+            if file_format == "arrow":
+                # One record batch per row group, so the reader maps a few large batches
+                writer.write_batch(table.combine_chunks().to_batches()[0])
+            else:
+                writer.write_table(table, row_group_size=rows)
+            rows_in_file += rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return file_paths
+
+
+def row_group_pieces(tables, max_rows_per_group):
+    # Yields lists of table slices with max_rows_per_group rows in total, the last one can be smaller.
+    # MAX_ROWS_PER_FILE is a multiple of MAX_ROWS_PER_GROUP in lambdas, so row groups fill files evenly
+    pieces = []
+    rows = 0
+    for table in tables:
+        offset = 0
+        while offset < table.num_rows:
+            length = min(table.num_rows - offset, max_rows_per_group - rows)
+            pieces.append(table.slice(offset, length))
+            rows += length
+            offset += length
+            if rows == max_rows_per_group:
+                yield pieces
+                pieces = []
+                rows = 0
+    if pieces:
+        yield pieces
+
+
+def padded_table(pieces, schema, null_arrays, max_rows):
+    # null_arrays caches one null array per type, every missing column chunk is a zero-copy slice of it
+    columns = []
+    for field in schema:
+        chunks = []
+        for piece in pieces:
+            index = piece.schema.get_field_index(field.name)
+            if index == -1:
+                if field.type not in null_arrays:
+                    null_arrays[field.type] = pa.nulls(max_rows, field.type)
+                chunks.append(null_arrays[field.type].slice(0, piece.num_rows))
+            else:
+                column = piece.column(index)
+                chunks.extend((column if column.type == field.type else column.cast(field.type)).chunks)
+        columns.append(pa.chunked_array(chunks, type=field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
@@ -0,0 +1,108 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# Run ledger remembers the objects a run uploaded with their SHA256 checksums. A retried run with the same input
+# skips files whose checksum matches the one recorded for their key and stored with the object in S3.
+# The ledger is removed when the run succeeds
+UPLOAD_LEDGER_PREFIX = "_ledger/uploads"  # underscore prefix is ignored by query engines listing the bucket
+# S3 stores a composite checksum for multipart uploads, the checksum of the whole file goes to the object metadata
+CHECKSUM_METADATA_KEY = "sha256"
+CHECKPOINT_INTERVAL_SECONDS = 10
+
+
+class S3UploadLedger:
+    def __init__(
+        self,
+        s3_client,
+        bucket,
+        run_id,
+        prefix=UPLOAD_LEDGER_PREFIX,
+        checkpoint_interval_seconds=CHECKPOINT_INTERVAL_SECONDS,
+    ):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.run_id = run_id
+        self.prefix = prefix
+        self.checkpoint_interval_seconds = checkpoint_interval_seconds
+        self.checksum_by_key = None
+        self.stored = False
+        self.recorded = False
+        self.saved_at = time.monotonic()
+        # Uploads are recorded on the transfer event loop thread, the ledger is saved from the handler thread
+        self.lock = threading.Lock()
+
+    def checksum(self, key):
+        with self.lock:
+            if self.checksum_by_key is None:
+                self.checksum_by_key = self.load()
+                self.stored = bool(self.checksum_by_key)
+            return self.checksum_by_key.get(key)
+
+    def record(self, key, checksum):
+        with self.lock:
+            if self.checksum_by_key is None:
+                self.checksum_by_key = {}
+            self.checksum_by_key[key] = checksum
+            self.recorded = True
+
+    def checkpoint(self):
+        # Saving the whole ledger after every upload would cost a PUT per object, a failed run loses
+        # the records of the last interval and uploads those objects again
+        if self.recorded and time.monotonic() - self.saved_at >= self.checkpoint_interval_seconds:
+            self.save()
+
+    def save(self):
+        with self.lock:
+            body = json.dumps({"checksums": self.checksum_by_key or {}}).encode("utf-8")
+            self.recorded = False
+        self.s3_client.put_object(Bucket=self.bucket, Key=self.key(), Body=body)
+        self.stored = True
+        self.saved_at = time.monotonic()
+
+    def delete(self):
+        if self.stored:
+            self.s3_client.delete_object(Bucket=self.bucket, Key=self.key())
+            self.stored = False
+
+    def load(self):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key())
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            return {}
+        return json.loads(response["Body"].read())["checksums"]
+
+    def key(self):
+        return f"{self.prefix}/{self.run_id}.json"
+
+
+def file_checksum(file_path):
+    # Base64 encoded SHA256, the way S3 reports ChecksumSHA256 of an object uploaded in one part
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return base64.b64encode(digest.digest()).decode("ascii")
+
+
+def run_id(stage, input_keys):
+    # Same input of a retried execution gets the same ledger
+    digest = hashlib.sha256("\n".join(sorted(input_keys)).encode("utf-8")).hexdigest()[:16]
+    return f"{stage}/{digest}"
+
+
+def upload_ledger_from_env(s3_client, stage, input_keys):
+    # UPLOAD_LEDGER=s3 keeps run ledgers in the Parquet files bucket, empty value disables them
+    ledger_type = os.environ.get("UPLOAD_LEDGER", "")
+    if ledger_type == "":
+        return None
+    if ledger_type == "s3":
+        return S3UploadLedger(s3_client, os.environ["PARQUET_FILES_BUCKET_NAME"], run_id(stage, input_keys))
+    raise ValueError(f"Unknown upload ledger: {ledger_type}, expected s3 or empty value")
@@ -0,0 +1,90 @@
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+from botocore.exceptions import ClientError
+
+# Watermark of a product trails the latest reading time seen for it in the job by the allowed lateness.
+# Readings older than the watermark belong to 15min windows that are assembled into daily files already,
+# so they go to one late chunk per day instead of new tiny chunks of old windows
+WATERMARKS_PREFIX = "_watermarks"  # underscore prefix is ignored by query engines listing the bucket
+# "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars/2023-04-01T_late-90147479.parquet/part-0.parquet"
+LATE_CHUNK_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}T_late-[^/]+\.(?:parquet|arrow)")
+
+
+def allowed_lateness_from_env():
+    # 0 disables watermarks, every reading goes to the chunk of its 15 minutes window
+    minutes = float(os.environ.get("ALLOWED_LATENESS_MINUTES", "0"))
+    return timedelta(minutes=minutes) if minutes > 0 else None
+
+
+def late_chunk_file_name(timestamp: datetime, invocation_id: str, extension: str) -> str:
+    return f"{timestamp.strftime('%Y-%m-%d')}T_late-{invocation_id}.{extension}"
+
+
+def is_late_chunk_key(key: str) -> bool:
+    return LATE_CHUNK_PATTERN.search(key) is not None
+
+
+class S3Watermarks:
+    """Latest reading time per product of a job, kept in one JSON object per job in the Parquet files bucket."""
+
+    def __init__(self, s3_client, bucket, allowed_lateness, prefix=WATERMARKS_PREFIX):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.allowed_lateness = allowed_lateness
+        self.prefix = prefix
+        self.max_timestamps_by_job = {}
+        self.updated_jobs = set()
+
+    def watermarks(self, job):
+        # {product: datetime}, readings of a product before its watermark are late
+        return {
+            product: max_timestamp - self.allowed_lateness
+            for product, max_timestamp in self.max_timestamps(job).items()
+        }
+
+    def advance(self, job, max_timestamp_by_product):
+        max_timestamps = self.max_timestamps(job)
+        for product, timestamp in max_timestamp_by_product.items():
+            if product not in max_timestamps or timestamp > max_timestamps[product]:
+                max_timestamps[product] = timestamp
+                self.updated_jobs.add(job)
+
+    def save(self):
+        # FilesProcessors of a Map run concurrently, the stored times are read again and the later ones win.
+        # A lost race only leaves a watermark behind, which keeps more readings in their 15min chunks
+        for job in sorted(self.updated_jobs):
+            max_timestamps = self.load(job)
+            for product, timestamp in self.max_timestamps_by_job[job].items():
+                if product not in max_timestamps or timestamp > max_timestamps[product]:
+                    max_timestamps[product] = timestamp
+            body = {"max_timestamps": {product: value.isoformat() for product, value in max_timestamps.items()}}
+            self.s3_client.put_object(Bucket=self.bucket, Key=self.key(job), Body=json.dumps(body).encode("utf-8"))
+        self.updated_jobs.clear()
+
+    def max_timestamps(self, job):
+        if job not in self.max_timestamps_by_job:
+            self.max_timestamps_by_job[job] = self.load(job)
+        return self.max_timestamps_by_job[job]
+
+    def load(self, job):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key(job))
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                raise
+            return {}
+        max_timestamps = json.loads(response["Body"].read())["max_timestamps"]
+        return {product: datetime.fromisoformat(value) for product, value in max_timestamps.items()}
+
+    def key(self, job):
+        return f"{self.prefix}/{job}.json"
+
+
+def watermarks_from_env(s3_client):
+    allowed_lateness = allowed_lateness_from_env()
+    if allowed_lateness is None:
+        return None
+    return S3Watermarks(s3_client, os.environ["PARQUET_FILES_BUCKET_NAME"], allowed_lateness)
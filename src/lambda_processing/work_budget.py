@@ -0,0 +1,51 @@
+import os
+import resource
+
+# FilesProcessor stops taking new Raw data files when the time left is less than the reserve for uploading
+# the chunks plus the longest file processing time so far, or when its memory is above the share of the limit.
+DEFAULT_TIME_RESERVE_SECONDS = 30
+DEFAULT_MEMORY_LIMIT_SHARE = 0.8
+
+
+class WorkBudget:
+    def __init__(self, context, time_reserve_seconds=DEFAULT_TIME_RESERVE_SECONDS, memory_limit_share=None):
+        # Lambda context has get_remaining_time_in_millis and memory_limit_in_mb, local runs pass a dict
+        self.get_remaining_time_in_millis = getattr(context, "get_remaining_time_in_millis", None)
+        memory_limit_in_mb = getattr(context, "memory_limit_in_mb", None)
+        self.memory_limit_bytes = int(memory_limit_in_mb) * 1024 * 1024 if memory_limit_in_mb else None
+        self.time_reserve_millis = time_reserve_seconds * 1000
+        self.memory_limit_share = DEFAULT_MEMORY_LIMIT_SHARE if memory_limit_share is None else memory_limit_share
+        self.longest_file_millis = 0
+
+    @classmethod
+    def from_env(cls, context):
+        time_reserve_seconds = float(os.environ.get("SPLIT_TIME_RESERVE_SECONDS", DEFAULT_TIME_RESERVE_SECONDS))
+        memory_limit_share = float(os.environ.get("SPLIT_MEMORY_LIMIT_SHARE", DEFAULT_MEMORY_LIMIT_SHARE))
+        return cls(context, time_reserve_seconds, memory_limit_share)
+
+    def record_file(self, duration_millis):
+        self.longest_file_millis = max(self.longest_file_millis, duration_millis)
+
+    def exhausted_reason(self):
+        # None when the next file fits into the budget
+        if self.get_remaining_time_in_millis is not None:
+            remaining_millis = self.get_remaining_time_in_millis()
+            needed_millis = self.time_reserve_millis + self.longest_file_millis
+            if remaining_millis < needed_millis:
+                return f"{remaining_millis} ms left, {needed_millis} ms needed for the next file and upload"
+
+        if self.memory_limit_bytes is not None:
+            used_bytes = memory_used_bytes()
+            if used_bytes > self.memory_limit_bytes * self.memory_limit_share:
+                return f"{used_bytes // 1024 // 1024} MB of {self.memory_limit_bytes // 1024 // 1024} MB memory used"
+
+        return None
+
+
+def memory_used_bytes():
+    # Resident set size of the process, /proc is there on Lambda, peak RSS is the fallback elsewhere
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -0,0 +1,225 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+import boto3
+
+# Lambda modules import each other as top level modules, like in Lambda runtime
+SRC_DIRECTORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (SRC_DIRECTORY_PATH, os.path.join(SRC_DIRECTORY_PATH, "lambda_processing")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import files_processor
+import parquet_files_processor
+from chunk_index import group_chunk_keys, iter_chunk_keys
+from json_parsers import RAW_DATA_FILE_EXTENSIONS
+from local_runner.local_s3_client import BucketRoutingS3Client, LocalDirectoryS3Client
+from s3_transfer import S3Transfer, s3_client_config
+
+RAW_DATA_FILES_BUCKET_NAME = "medallion-lakehouse-s3bronze"
+PARQUET_FILES_BUCKET_NAME = "medallion-lakehouse-s3silver"
+RAW_DATA_FILES_PER_PROCESSOR = 10
+
+# Each pool process builds its own S3 client, boto3 clients can't be passed between processes
+worker_s3_client = None
+
+
+def run_pipeline(
+    source,
+    destination,
+    processes=None,
+    files_per_processor=RAW_DATA_FILES_PER_PROCESSOR,
+    job_uuid=None,
+    raw_bucket_name=RAW_DATA_FILES_BUCKET_NAME,
+    silver_bucket_name=PARQUET_FILES_BUCKET_NAME,
+):
+    # source and destination are local directories or s3://bucket/prefix URLs
+    processes = processes or os.cpu_count()
+    source_location = parse_location(source, raw_bucket_name)
+    destination_location = parse_location(destination, silver_bucket_name)
+    if source_location["type"] == "local":
+        source_location["key_prefix"] = flat_directory_key_prefix(source_location["path"], job_uuid)
+
+    # Lambdas take bucket names from the environment, pool processes inherit it
+    os.environ["RAW_DATA_FILES_BUCKET_NAME"] = source_location["bucket"]
+    os.environ["PARQUET_FILES_BUCKET_NAME"] = destination_location["bucket"]
+    s3_client = build_s3_client(source_location, destination_location)
+
+    raw_files = list_raw_data_files(source_location)
+    raw_bytes = sum(size for _key, size in raw_files)
+    raw_keys = [key for key, _size in raw_files]
+    print(f"Processing {len(raw_keys)} Raw data files from {source} into {destination} with {processes} processes.")
+
+    started_at = time.perf_counter()
+    with multiprocessing.Pool(
+        processes, initializer=init_worker, initargs=(source_location, destination_location)
+    ) as pool:
+        # Same split as FilesProcessors of the Step Functions Map get from the pooler
+        batches = [raw_keys[i : i + files_per_processor] for i in range(0, len(raw_keys), files_per_processor)]
+        results = list(pool.imap_unordered(process_raw_data_files, batches))
+        chunks_finished_at = time.perf_counter()
+
+        # Each job, bucket, product and day is assembled by its own ParquetFilesProcessor call
+        chunk_keys = list(iter_chunk_keys(results, s3_client, destination_location["bucket"]))
+        chunk_keys_by_jbpd = group_chunk_keys(chunk_keys)
+        daily_file_keys = []
+        job_manifest_entries_by_job_id = {}
+        for job_id, uploaded_keys, entries in pool.imap_unordered(assemble_daily_files, chunk_keys_by_jbpd.values()):
+            daily_file_keys.extend(uploaded_keys)
+            job_manifest_entries_by_job_id.setdefault(job_id, []).extend(entries)
+
+    # Job manifests are updated by this process only, pool processes would overwrite each other's entries
+    for job_id, entries in job_manifest_entries_by_job_id.items():
+        if entries:
+            parquet_files_processor.update_job_manifest(s3_client, destination_location["bucket"], job_id, entries)
+    finished_at = time.perf_counter()
+
+    report = {
+        "processes": processes,
+        "raw_files": len(raw_keys),
+        "raw_bytes": raw_bytes,
+        "chunk_files": len(chunk_keys),
+        "daily_files": len(daily_file_keys),
+        "chunks_seconds": chunks_finished_at - started_at,
+        "daily_files_seconds": finished_at - chunks_finished_at,
+        "total_seconds": finished_at - started_at,
+    }
+    print_throughput_report(report)
+    return report
+
+
+def init_worker(source_location, destination_location):
+    global worker_s3_client
+    worker_s3_client = build_s3_client(source_location, destination_location)
+
+
+def process_raw_data_files(file_keys):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        return files_processor.lambda_handler(file_keys, {}, worker_s3_client, temp_dir)
+
+
+def assemble_daily_files(chunk_keys):
+    job_id, bucket, product, day = parquet_files_processor.chunked_parquet_key_parts(chunk_keys[0])
+    with tempfile.TemporaryDirectory() as temp_dir:
+        uploaded_keys = parquet_files_processor.lambda_handler(
+            [chunk_keys], {}, worker_s3_client, temp_dir, cleanup_on_finish=False, write_job_manifest=False
+        )
+        # Job manifest entries come from footers of the written daily parts, before the temp directory is removed
+        entries = []
+        if os.environ.get("WRITE_JOB_MANIFEST", "false").lower() == "true":
+            layout = os.environ.get("DAILY_FILES_LAYOUT", "legacy")
+            target_key = parquet_files_processor.daily_parquet_key(job_id, bucket, product, day, layout)
+            daily_parquet_path = os.path.join(temp_dir, "daily_files", target_key)
+            if os.path.isdir(daily_parquet_path):
+                entries = parquet_files_processor.job_manifest_entries(
+                    daily_parquet_path, target_key, bucket, product, day
+                )
+    return job_id, uploaded_keys, entries
+
+
+def parse_location(location, default_bucket):
+    # "s3://bucket/prefix" -> S3 bucket and prefix, anything else is a local directory taken as a bucket
+    if location.startswith("s3://"):
+        bucket, _, prefix = location.removeprefix("s3://").partition("/")
+        return {"type": "s3", "bucket": bucket, "prefix": prefix}
+    return {"type": "local", "bucket": default_bucket, "path": location, "key_prefix": ""}
+
+
+def flat_directory_key_prefix(directory_path, job_uuid=None):
+    # Flat directory of Raw data files, like /data, gets the keys raw_data_files_S3_uploader.py would upload them with
+    if any(file_name.endswith(RAW_DATA_FILE_EXTENSIONS) for file_name in os.listdir(directory_path)):
+        return f"{datetime.now().strftime('%Y/%m/%d')}/job_{job_uuid or uuid.uuid4()}/"
+    return ""
+
+
+def build_s3_client(source_location, destination_location):
+    clients_by_bucket = {}
+    s3_client = None
+    for location in (source_location, destination_location):
+        if location["type"] == "local":
+            clients_by_bucket[location["bucket"]] = LocalDirectoryS3Client(location["path"], location["key_prefix"])
+        else:
+            s3_client = s3_client or boto3.client("s3", config=s3_client_config())
+            clients_by_bucket[location["bucket"]] = s3_client
+    return BucketRoutingS3Client(clients_by_bucket)
+
+
+def list_raw_data_files(source_location):
+    # [(key, size in bytes)] of Raw data files, JSON arrays or newline-delimited JSON
+    if source_location["type"] == "local":
+        client = LocalDirectoryS3Client(source_location["path"], source_location["key_prefix"])
+        if source_location["key_prefix"]:
+            keys = [source_location["key_prefix"] + name for name in sorted(os.listdir(source_location["path"]))]
+            keys = [key for key in keys if key.endswith(RAW_DATA_FILE_EXTENSIONS)]
+        else:
+            keys = [key for key in client.object_keys() if key.endswith(RAW_DATA_FILE_EXTENSIONS)]
+        return [(key, os.path.getsize(client.path(key))) for key in keys]
+
+    objects = S3Transfer(boto3.client("s3")).list_objects(source_location["bucket"], source_location["prefix"])
+    return [(item["Key"], item["Size"]) for item in objects if item["Key"].endswith(RAW_DATA_FILE_EXTENSIONS)]
+
+
+def print_throughput_report(report):
+    raw_megabytes = report["raw_bytes"] / 1024 / 1024
+    chunks_seconds = max(report["chunks_seconds"], 1e-9)
+    total_seconds = max(report["total_seconds"], 1e-9)
+    print(f"\nProcesses:            {report['processes']}")
+    print(
+        f"Raw data files:       {report['raw_files']} files, {raw_megabytes:.1f} MB -> {report['chunk_files']} chunks"
+        f" in {report['chunks_seconds']:.1f} s ({report['raw_files'] / chunks_seconds:.1f} files/s,"
+        f" {raw_megabytes / chunks_seconds:.1f} MB/s)"
+    )
+    print(f"Daily Parquet files:  {report['daily_files']} files in {report['daily_files_seconds']:.1f} s")
+    print(
+        f"Total:                {report['total_seconds']:.1f} s ({raw_megabytes / total_seconds:.1f} MB/s of Raw data)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run Medallion Lakehouse ETL pipeline on this machine with a pool of processes, f.e. for backfills."
+    )
+    parser.add_argument(
+        "source", type=str, help="Directory or s3://bucket/prefix with Raw data files in JSON or NDJSON format"
+    )
+    parser.add_argument("destination", type=str, help="Directory or s3://bucket for 15min chunks and daily files")
+    parser.add_argument("--processes", type=int, default=None, help="Number of processes (default: all cores)")
+    parser.add_argument(
+        "--files_per_processor",
+        type=int,
+        default=RAW_DATA_FILES_PER_PROCESSOR,
+        help=f"Raw data files per FilesProcessor call (default: {RAW_DATA_FILES_PER_PROCESSOR})",
+    )
+    parser.add_argument(
+        "--job_uuid", type=str, default=None, help="Job UUID for a flat directory of Raw data files (default: random)"
+    )
+    parser.add_argument(
+        "--raw_bucket_name",
+        type=str,
+        default=RAW_DATA_FILES_BUCKET_NAME,
+        help=f"Raw bucket name in the keys of chunks from a local directory (default: {RAW_DATA_FILES_BUCKET_NAME})",
+    )
+    args = parser.parse_args()
+
+    if not args.source.startswith("s3://") and not os.path.isdir(args.source):
+        print(f"Error: The specified Raw data files directory '{args.source}' does not exist.")
+        return
+
+    run_pipeline(
+        args.source,
+        args.destination,
+        processes=args.processes,
+        files_per_processor=args.files_per_processor,
+        job_uuid=args.job_uuid,
+        raw_bucket_name=args.raw_bucket_name,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import hashlib
+import io
+import os
+import re
+import shutil
+
+from botocore.exceptions import ClientError
+
+
+class LocalDirectoryS3Client:
+    """S3 client methods used by the lambdas, over a local directory standing for one bucket."""
+
+    def __init__(self, directory, key_prefix=""):
+        # key_prefix is stripped from keys, f.e. a flat directory of Raw data files gets "YYYY/MM/DD/job_<uuid>/" keys
+        self.directory = directory
+        self.key_prefix = key_prefix
+
+    def path(self, key):
+        return os.path.join(self.directory, key.removeprefix(self.key_prefix))
+
+    def object_keys(self, suffix=""):
+        keys = []
+        for root, _dirs, files in os.walk(self.directory):
+            for file_name in files:
+                relative_path = os.path.relpath(os.path.join(root, file_name), self.directory)
+                if relative_path.endswith(suffix):
+                    keys.append(self.key_prefix + relative_path.replace(os.sep, "/"))
+        return sorted(keys)
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        shutil.copyfile(self._existing_path(Key, "GetObject"), Filename)
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        os.makedirs(os.path.dirname(self.path(Key)), exist_ok=True)
+        shutil.copyfile(Filename, self.path(Key))
+
+    def head_object(self, Bucket, Key, **kwargs):
+        path = self._existing_path(Key, "HeadObject")
+        return {"ContentLength": os.path.getsize(path), "ETag": f'"{file_md5(path)}"'}
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        path = self._existing_path(Key, "GetObject")
+        start, length = byte_range_bounds(Range, os.path.getsize(path))
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(length)
+        return {"Body": io.BytesIO(data), "ContentLength": len(data), "ETag": f'"{file_md5(path)}"'}
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, **kwargs):
+        # The continuation token is the index of the first key of the next page
+        keys = [key for key in self.object_keys() if key.startswith(Prefix)]
+        start = int(ContinuationToken or 0)
+        page = keys[start : start + MaxKeys]
+        response = {
+            "Contents": [{"Key": key, "Size": os.path.getsize(self.path(key))} for key in page],
+            "KeyCount": len(page),
+            "IsTruncated": start + MaxKeys < len(keys),
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        # Same as S3, deleting a missing key succeeds
+        deleted = []
+        for entry in Delete["Objects"]:
+            if os.path.isfile(self.path(entry["Key"])):
+                os.remove(self.path(entry["Key"]))
+            deleted.append({"Key": entry["Key"]})
+        return {"Deleted": deleted}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        os.makedirs(os.path.dirname(self.path(Key)), exist_ok=True)
+        with open(self.path(Key), "wb") as f:
+            f.write(Body.read() if hasattr(Body, "read") else Body)
+        return {"ETag": f'"{file_md5(self.path(Key))}"'}
+
+    def _existing_path(self, key, operation_name):
+        path = self.path(key)
+        if not os.path.isfile(path):
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": f"{key} not found"}}, operation_name)
+        return path
+
+
+class BucketRoutingS3Client:
+    """Sends each call to the client of its bucket, f.e. Raw data files from S3 and Silver files to a directory."""
+
+    def __init__(self, clients_by_bucket):
+        self.clients_by_bucket = clients_by_bucket
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        return self.clients_by_bucket[Bucket].download_file(Bucket, Key, Filename, **kwargs)
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        return self.clients_by_bucket[Bucket].upload_file(Filename, Bucket, Key, **kwargs)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        return self.clients_by_bucket[Bucket].head_object(Bucket=Bucket, Key=Key, **kwargs)
+
+    def get_object(self, Bucket, Key, **kwargs):
+        return self.clients_by_bucket[Bucket].get_object(Bucket=Bucket, Key=Key, **kwargs)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        return self.clients_by_bucket[Bucket].put_object(Bucket=Bucket, Key=Key, Body=Body, **kwargs)
+
+    def list_objects_v2(self, Bucket, **kwargs):
+        return self.clients_by_bucket[Bucket].list_objects_v2(Bucket=Bucket, **kwargs)
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        return self.clients_by_bucket[Bucket].delete_objects(Bucket=Bucket, Delete=Delete, **kwargs)
+
+
+def byte_range_bounds(byte_range, size):
+    # "bytes=start-end" with inclusive end, "bytes=start-" or "bytes=-length" -> (start, length) within the object
+    if byte_range is None:
+        return 0, size
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", byte_range)
+    if match is None or match.groups() == ("", ""):
+        raise ValueError(f"Unsupported Range: {byte_range}, expected bytes=start-end, bytes=start- or bytes=-length")
+    start, end = match.groups()
+    if not start:
+        return max(size - int(end), 0), min(int(end), size)
+    end = min(int(end), size - 1) if end else size - 1
+    return int(start), max(end - int(start) + 1, 0)
+
+
+def file_md5(path):
+    # Same as S3 ETag of an object uploaded in one part
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
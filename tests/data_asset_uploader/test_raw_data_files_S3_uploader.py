@@ -1,9 +1,10 @@
+import json
 import os
-import pytest
 import tempfile
 import uuid
+from unittest.mock import ANY, MagicMock
 
-from unittest.mock import MagicMock
+import pytest
 
 from data_asset_uploader.raw_data_files_S3_uploader import upload_raw_data
 
@@ -32,10 +33,28 @@ def test_pass_upload_raw_data_given_raw_data_path_and_job_uuid_uploads_to_s3(fre
     assert mock_s3_client.upload_file.call_count == 3
     for file_name in ["raw-1.json", "raw-2.json", "raw-3.json"]:
         mock_s3_client.upload_file.assert_any_call(
-            os.path.join(temp_dir, file_name), BUCKET_NAME, s3_key_prefix + file_name
+            os.path.join(temp_dir, file_name), BUCKET_NAME, s3_key_prefix + file_name, ExtraArgs=ANY
         )
 
 
+def test_pass_upload_raw_data_given_ndjson_converts_json_arrays_before_upload(freezer, temp_dir):
+    uploaded_contents = {}
+    mock_s3_client = MagicMock()
+    mock_s3_client.upload_file.side_effect = lambda file_path, _bucket, key, **_kwargs: uploaded_contents.update(
+        {key: open(file_path).read()}
+    )
+    freezer.move_to("2023-04-15")
+    data_assets = [{"timestamp": "2023-04-01T13:15:00.000Z", "dataAsset": "mars", "iotreadings": {"value1": 3}}] * 2
+    with open(os.path.join(temp_dir, "raw-1.json"), "w") as f:
+        json.dump(data_assets, f, indent=4)
+
+    upload_raw_data(temp_dir, "1001", mock_s3_client, ndjson=True)
+
+    content = uploaded_contents["2023/04/15/job_1001/raw-1.ndjson"]
+    assert [json.loads(line) for line in content.splitlines()] == data_assets
+    assert os.listdir(temp_dir) == ["raw-1.json"]
+
+
 def test_pass_upload_raw_data_prints_job_uuid(capfd, temp_dir):
     mock_s3_client = MagicMock()
     job_uuid = str(uuid.uuid4())
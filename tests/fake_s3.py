@@ -0,0 +1,127 @@
+import hashlib
+import io
+import os
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+
+class FakeS3Client:
+    """In-memory stand-in for the boto3 S3 client methods used by the pipeline, counts requests per operation."""
+
+    def __init__(self):
+        self.objects = {}
+        self.etags = {}
+        self.tags = {}
+        self.metadata = {}
+        self.requests = Counter()
+
+    def put(self, bucket, key, data):
+        self.objects[(bucket, key)] = bytes(data)
+        # Hashed once per write, ranged GETs of a large object would hash all of it on each request otherwise
+        self.etags[(bucket, key)] = '"' + hashlib.md5(self.objects[(bucket, key)]).hexdigest() + '"'
+        self.metadata.pop((bucket, key), None)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.requests["put_object"] += 1
+        self.put(Bucket, Key, Body.read() if hasattr(Body, "read") else Body)
+        self.metadata[(Bucket, Key)] = kwargs.get("Metadata", {})
+        return {"ETag": self._etag(Bucket, Key)}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, **kwargs):
+        self.requests["upload_file"] += 1
+        with open(Filename, "rb") as f:
+            self.put(Bucket, Key, f.read())
+        self.metadata[(Bucket, Key)] = (ExtraArgs or {}).get("Metadata", {})
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        self.requests["download_file"] += 1
+        data = self._object(Bucket, Key, "GetObject")
+        with open(Filename, "wb") as f:
+            f.write(data)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.requests["head_object"] += 1
+        data = self._object(Bucket, Key, "HeadObject")
+        return {
+            "ContentLength": len(data),
+            "ETag": self._etag(Bucket, Key),
+            "Metadata": self.metadata.get((Bucket, Key), {}),
+        }
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self.requests["get_object"] += 1
+        data = object_range(self._object(Bucket, Key, "GetObject"), Range)
+        return {"Body": io.BytesIO(data), "ContentLength": len(data), "ETag": self._etag(Bucket, Key)}
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, **kwargs):
+        self.requests["list_objects_v2"] += 1
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start : start + MaxKeys]
+        response = {
+            "Contents": [{"Key": key, "Size": len(self.objects[(Bucket, key)])} for key in page],
+            "KeyCount": len(page),
+            "IsTruncated": start + MaxKeys < len(keys),
+        }
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(start + MaxKeys)
+        return response
+
+    def put_object_tagging(self, Bucket, Key, Tagging, **kwargs):
+        self.requests["put_object_tagging"] += 1
+        self._object(Bucket, Key, "PutObjectTagging")
+        self.tags[(Bucket, Key)] = {tag["Key"]: tag["Value"] for tag in Tagging["TagSet"]}
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.requests["delete_object"] += 1
+        self.objects.pop((Bucket, Key), None)
+        self.etags.pop((Bucket, Key), None)
+        self.metadata.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self.requests["delete_objects"] += 1
+        deleted = []
+        for entry in Delete["Objects"]:
+            self.objects.pop((Bucket, entry["Key"]), None)
+            self.etags.pop((Bucket, entry["Key"]), None)
+            deleted.append({"Key": entry["Key"]})
+        return {"Deleted": deleted}
+
+    def keys(self, bucket, prefix=""):
+        return sorted(key for b, key in self.objects if b == bucket and key.startswith(prefix))
+
+    def _object(self, bucket, key, operation):
+        if (bucket, key) not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey" if operation == "GetObject" else "404"}}, operation)
+        return self.objects[(bucket, key)]
+
+    def _etag(self, bucket, key):
+        return self.etags[(bucket, key)]
+
+
+def object_range(data, byte_range=None):
+    # "bytes=start-end", end is inclusive, or "bytes=-length" for the last bytes of the object
+    if byte_range is None:
+        return data
+    start, end = byte_range.removeprefix("bytes=").split("-")
+    if not start:
+        return data[-int(end) :]
+    return data[int(start) : int(end) + 1]
+
+
+def serve_local_files(mock_s3_client, directory):
+    # get_object of a MagicMock client reads the objects from files the test put in place, f.e. the chunks
+    # "downloaded" by its download_file
+    def get_object(Bucket, Key, Range=None, **kwargs):
+        file_path = os.path.join(directory, Key)
+        if not os.path.exists(file_path):
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        with open(file_path, "rb") as f:
+            data = object_range(f.read(), Range)
+        return {"Body": io.BytesIO(data), "ContentLength": len(data)}
+
+    mock_s3_client.get_object.side_effect = get_object
+    return mock_s3_client
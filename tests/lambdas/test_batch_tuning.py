@@ -0,0 +1,155 @@
+import bisect
+import json
+import statistics
+
+from lambda_pooling.s3bronze_file_events_pooling import BatchTuner, latency_batching_window
+
+ARRIVALS_FIXTURE_PATH = "tests/lambdas/fixtures/raw_data_file_arrivals.json"
+# Static template defaults: FilesProcessorMaxConcurrency, RawDataFilesPerFilesProcessor and batching window
+PROCESSORS_COUNT = 3
+FILES_PER_PROCESSOR = 20
+BATCHING_WINDOW_IN_SECONDS = 10
+# Simulated execution takes the state machine overhead plus the time of the largest batch
+SECONDS_PER_FILE = 0.5
+EXECUTION_OVERHEAD_SECONDS = 3
+
+
+# Batch tuner tests
+
+
+def test_pass_tune_given_no_recent_executions_uses_static_files_per_processor_under_backlog():
+    tuner = BatchTuner(PROCESSORS_COUNT, FILES_PER_PROCESSOR, BATCHING_WINDOW_IN_SECONDS)
+
+    assert tuner.tune(1000) == (3, 20, 10)
+
+
+def test_pass_tune_given_recent_executions_fits_files_per_processor_into_target_time():
+    tuner = BatchTuner(PROCESSORS_COUNT, FILES_PER_PROCESSOR, BATCHING_WINDOW_IN_SECONDS, target_execution_seconds=60)
+    tuner.record_execution(10, 20)
+
+    assert tuner.tune(1000) == (3, 100, 10)
+
+    tuner.record_execution(60, 20)
+
+    # The slowest of recent executions counts, 3 s per file
+    assert tuner.tune(1000) == (3, 20, 10)
+
+
+def test_pass_tune_given_quiet_queue_picks_one_small_batch_and_short_window():
+    tuner = BatchTuner(PROCESSORS_COUNT, FILES_PER_PROCESSOR, BATCHING_WINDOW_IN_SECONDS)
+
+    processors_count, files_per_processor, batching_window_in_seconds = tuner.tune(2)
+
+    assert (processors_count, files_per_processor) == (1, 2)
+    assert batching_window_in_seconds == BATCHING_WINDOW_IN_SECONDS * 2 / 60
+
+
+def test_pass_tune_keeps_files_per_processor_within_bounds():
+    tuner = BatchTuner(
+        PROCESSORS_COUNT, FILES_PER_PROCESSOR, BATCHING_WINDOW_IN_SECONDS, 5, 50, target_execution_seconds=60
+    )
+    tuner.record_execution(0.01, 20)
+
+    assert tuner.tune(1)[:2] == (1, 5)
+    assert tuner.tune(1000)[:2] == (3, 50)
+
+
+# Arrival replay tests
+
+
+def test_pass_auto_tuning_given_recorded_arrivals_drains_backlog_sooner_and_cuts_quiet_latency():
+    arrival_times, quiet_arrival_times = load_arrival_times()
+    static_latencies, static_backlog_drained_at = replay_arrivals(
+        arrival_times, lambda _pending: (PROCESSORS_COUNT, FILES_PER_PROCESSOR, BATCHING_WINDOW_IN_SECONDS)
+    )
+    tuner = BatchTuner(PROCESSORS_COUNT, FILES_PER_PROCESSOR, BATCHING_WINDOW_IN_SECONDS, target_execution_seconds=60)
+    tuned_latencies, tuned_backlog_drained_at = replay_arrivals(arrival_times, tuner.tune, tuner.record_execution)
+
+    # Throughput rises under backlog
+    assert tuned_backlog_drained_at < static_backlog_drained_at * 0.9
+    # Latency drops when the queue is quiet
+    static_quiet_latency = statistics.median(static_latencies[t] for t in quiet_arrival_times)
+    tuned_quiet_latency = statistics.median(tuned_latencies[t] for t in quiet_arrival_times)
+    assert tuned_quiet_latency < static_quiet_latency / 2
+
+
+def test_pass_latency_mode_given_recorded_arrivals_cuts_quiet_latency_at_cost_of_more_executions():
+    arrival_times, quiet_arrival_times = load_arrival_times()
+    wanted_count = PROCESSORS_COUNT * FILES_PER_PROCESSOR
+    results = {}
+    for latency_weight in (0, 0.5, 1):
+        executions = []
+
+        def choose_batch(pending_count, latency_weight=latency_weight):
+            # One pending file came with the trigger event, the rest is the queue depth
+            window = BATCHING_WINDOW_IN_SECONDS
+            if latency_weight > 0:
+                window = latency_batching_window(window, wanted_count - 1, pending_count - 1, latency_weight)
+            return PROCESSORS_COUNT, FILES_PER_PROCESSOR, window
+
+        latencies, backlog_drained_at = replay_arrivals(
+            arrival_times,
+            choose_batch,
+            lambda duration, _files_count, executions=executions: executions.append(duration),
+        )
+        quiet_latency = statistics.median(latencies[t] for t in quiet_arrival_times)
+        results[latency_weight] = (quiet_latency, backlog_drained_at, len(executions))
+
+    static_quiet_latency, static_backlog_drained_at, static_executions_count = results[0]
+    for quiet_latency, backlog_drained_at, executions_count in (results[0.5], results[1]):
+        assert quiet_latency < static_quiet_latency / 2
+        assert backlog_drained_at < static_backlog_drained_at * 1.05
+        assert executions_count > static_executions_count
+    assert results[1][2] >= results[0.5][2]
+
+
+# Helper functions
+
+
+def load_arrival_times():
+    # Files of an interval arrive evenly spread in it, the first burst is the backlog, files arriving
+    # one per 30 s after it are the quiet period
+    with open(ARRIVALS_FIXTURE_PATH) as f:
+        fixture = json.load(f)
+    interval_seconds = fixture["interval_seconds"]
+    arrival_times = []
+    quiet_arrival_times = []
+    for index, count in enumerate(fixture["arrivals_per_interval"]):
+        times = [index * interval_seconds + i * interval_seconds / count for i in range(count)]
+        arrival_times.extend(times)
+        if count == 1:
+            quiet_arrival_times.extend(times)
+    return arrival_times, quiet_arrival_times
+
+
+def replay_arrivals(arrival_times, choose_batch, record_execution=None):
+    # One pooler run at a time, like with the reserved concurrency of 1. A run starts when a message is
+    # in the queue, takes what's there and waits up to the batching window for the rest of its batch.
+    # Returns the latency of each file by its arrival time and the time the first burst was processed
+    latencies = {}
+    backlog_size = arrival_times.index(next(t for t in arrival_times if t >= 30))
+    backlog_drained_at = None
+    clock = 0
+    consumed = 0
+    while consumed < len(arrival_times):
+        clock = max(clock, arrival_times[consumed])
+        pending_count = bisect.bisect_right(arrival_times, clock) - consumed
+        processors_count, files_per_processor, batching_window_in_seconds = choose_batch(pending_count)
+        wanted_count = processors_count * files_per_processor
+        if pending_count < wanted_count:
+            last_wanted_index = min(consumed + wanted_count, len(arrival_times)) - 1
+            clock = min(clock + batching_window_in_seconds, max(clock, arrival_times[last_wanted_index]))
+        taken_count = min(bisect.bisect_right(arrival_times, clock) - consumed, wanted_count)
+        batch = arrival_times[consumed : consumed + taken_count]
+        consumed += taken_count
+
+        largest_batch_size = min(files_per_processor, len(batch))
+        duration = EXECUTION_OVERHEAD_SECONDS + largest_batch_size * SECONDS_PER_FILE
+        clock += duration
+        if record_execution is not None:
+            record_execution(duration, largest_batch_size)
+        for arrival_time in batch:
+            latencies[arrival_time] = clock - arrival_time
+        if backlog_drained_at is None and consumed >= backlog_size:
+            backlog_drained_at = clock
+    return latencies, backlog_drained_at
@@ -0,0 +1,81 @@
+import pytest
+
+from lambda_processing.chunk_index import (
+    compacted_chunk_sources_key,
+    group_chunk_keys,
+    is_compacted_chunk_key,
+    iter_chunk_keys,
+    write_chunk_manifest,
+)
+from tests.fake_s3 import FakeS3Client
+
+BUCKET_NAME = "s3silver-bucket"
+JOB_ID = "41780824-ac46-4b25-9547-a53607b4f37a"
+
+
+def chunk_key(product, quarter, day="2023-04-01"):
+    return f"15min_chunks/job_{JOB_ID}/medallion-lakehouse-s3bronze/{product}/{day}T{quarter}-90147479.parquet/part-0.parquet"
+
+
+# Chunk keys tests
+
+
+def test_pass_iter_chunk_keys_given_lists_dicts_and_manifests_yields_keys_in_order():
+    s3_client = FakeS3Client()
+    keys = [chunk_key("mars", f"{hour:02}_15m") for hour in range(5)]
+    manifest_key = write_chunk_manifest(s3_client, BUCKET_NAME, "90147479", keys[2:4])
+    items = [
+        [keys[0]],
+        {"chunk_keys": [keys[1]], "unprocessed_keys": ["raw-1.json"]},
+        {"chunk_manifest_key": manifest_key},
+        [keys[4]],
+    ]
+
+    assert list(iter_chunk_keys(items, s3_client, BUCKET_NAME)) == keys
+    assert manifest_key == "_chunk_manifests/90147479.json"
+
+
+def test_fail_iter_chunk_keys_given_missing_manifest():
+    with pytest.raises(ValueError, match="Chunk manifest s3://s3silver-bucket/_chunk_manifests/a.json doesn't exist"):
+        list(iter_chunk_keys([{"chunk_manifest_key": "_chunk_manifests/a.json"}], FakeS3Client(), BUCKET_NAME))
+
+
+# Grouping index tests
+
+
+def test_pass_group_chunk_keys_given_keys_groups_them_by_job_bucket_product_day_keeping_order():
+    keys = [
+        chunk_key("mars", "13_30m"),
+        chunk_key("pluto", "13_30m"),
+        chunk_key("mars", "00_15m", day="2023-04-02"),
+        chunk_key("mars", "13_45m"),
+    ]
+
+    assert group_chunk_keys(keys) == {
+        (JOB_ID, "medallion-lakehouse-s3bronze", "mars", "2023-04-01"): [keys[0], keys[3]],
+        (JOB_ID, "medallion-lakehouse-s3bronze", "pluto", "2023-04-01"): [keys[1]],
+        (JOB_ID, "medallion-lakehouse-s3bronze", "mars", "2023-04-02"): [keys[2]],
+    }
+
+
+def test_fail_group_chunk_keys_given_key_without_product_segment():
+    with pytest.raises(ValueError, match="less than 4 path segments"):
+        group_chunk_keys(["15min_chunks/job_1/bucket"])
+
+
+# Compacted chunk keys tests
+
+
+def test_pass_is_compacted_chunk_key_given_compacted_and_original_chunk_keys_tells_them_apart():
+    prefix = f"15min_chunks/job_{JOB_ID}/medallion-lakehouse-s3bronze/mars"
+
+    assert is_compacted_chunk_key(f"{prefix}/2023-04-01T13_30m-c1a2b3c4d.parquet/part-0.parquet")
+    assert is_compacted_chunk_key(f"{prefix}/2023-04-01T13_30m-cc1a2b3c4.arrow/part-1.arrow")
+    assert not is_compacted_chunk_key(f"{prefix}/2023-04-01T13_30m-c1a2b3c4.parquet/part-0.parquet")
+    assert not is_compacted_chunk_key(f"{prefix}/2023-04-01T_late-c1a2b3c4d.parquet/part-0.parquet")
+
+
+def test_pass_compacted_chunk_sources_key_given_part_key_returns_key_next_to_it():
+    prefix = f"15min_chunks/job_{JOB_ID}/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-c1a2b3c4d.parquet"
+
+    assert compacted_chunk_sources_key(f"{prefix}/part-1.parquet") == f"{prefix}/_sources.json"
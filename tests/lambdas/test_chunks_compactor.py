@@ -0,0 +1,159 @@
+import io
+import json
+import tempfile
+from unittest.mock import patch
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from lambda_processing.chunks_compactor import chunk_window_prefix, lambda_handler
+from lambda_processing.parquet_files_processor import lambda_handler as parquet_files_processor_handler
+from tests.fake_s3 import FakeS3Client
+
+PARQUET_FILES_BUCKET_NAME = "s3silver-bucket"
+CHUNK_PREFIX = "15min_chunks/job_1001/s3bronze-bucket/mars"
+
+
+@pytest.fixture(autouse=True)
+def mock_env_variables():
+    with patch.dict("os.environ", {"PARQUET_FILES_BUCKET_NAME": PARQUET_FILES_BUCKET_NAME}):
+        yield
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+# Lambda handler tests
+
+
+def test_pass_lambda_handler_given_small_chunks_of_window_merges_them_into_one_chunk_in_keys_order(temp_dir):
+    s3_client = FakeS3Client()
+    keys = [
+        put_chunk(s3_client, "2023-04-01T13_30m-aaaaaaaa", [{"value1": 1}]),
+        put_chunk(s3_client, "2023-04-01T13_45m-aaaaaaaa", [{"value1": 2}]),
+        put_chunk(s3_client, "2023-04-01T13_30m-bbbbbbbb", [{"value2": 3.5}]),
+        put_chunk(s3_client, "2023-04-01T13_30m-cccccccc", [{"value1": 4}]),
+    ]
+
+    result = lambda_handler([keys[:2], {"chunk_keys": keys[2:]}], {}, s3_client, temp_dir, min_chunk_bytes=1024 * 1024)
+
+    assert len(result) == 1 and len(result[0]) == 2
+    compacted_key, window_key = result[0]
+    assert compacted_key.startswith(f"{CHUNK_PREFIX}/2023-04-01T13_30m-c") and compacted_key.endswith("/part-0.parquet")
+    assert window_key == keys[1]
+    compacted = pq.read_table(io.BytesIO(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, compacted_key)]))
+    assert compacted.column("iotreadings_value1").to_pylist() == [1, None, 4]
+    assert compacted.column("iotreadings_value2").to_pylist() == [None, 3.5, None]
+    assert s3_client.tags == {}
+
+
+def test_pass_lambda_handler_given_chunks_above_threshold_and_late_chunks_keeps_them(temp_dir):
+    s3_client = FakeS3Client()
+    keys = [
+        put_chunk(s3_client, "2023-04-01T13_30m-aaaaaaaa", [{"value1": i} for i in range(500)]),
+        put_chunk(s3_client, "2023-04-01T13_30m-bbbbbbbb", [{"value1": 1}]),
+        put_chunk(s3_client, "2023-04-01T_late-aaaaaaaa", [{"value1": 2}]),
+        put_chunk(s3_client, "2023-04-01T_late-bbbbbbbb", [{"value1": 3}]),
+    ]
+    min_chunk_bytes = len(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, keys[0])])
+
+    result = lambda_handler([keys], {}, s3_client, temp_dir, min_chunk_bytes=min_chunk_bytes)
+
+    assert result == [keys]
+    assert s3_client.requests["download_file"] == 0
+
+
+def test_pass_lambda_handler_given_expire_consumed_tags_merged_chunks_and_keeps_unprocessed_keys(temp_dir):
+    s3_client = FakeS3Client()
+    keys = [
+        put_chunk(s3_client, "2023-04-01T13_30m-aaaaaaaa", [{"value1": 1}]),
+        put_chunk(s3_client, "2023-04-01T13_30m-bbbbbbbb", [{"value1": 2}]),
+    ]
+    items = [[keys[0]], {"chunk_keys": [keys[1]], "unprocessed_keys": ["2024/10/03/job_1001/raw-2.json"]}]
+
+    result = lambda_handler(items, {}, s3_client, temp_dir, min_chunk_bytes=1024 * 1024, expire_consumed=True)
+
+    assert result == [{"chunk_keys": result[0]["chunk_keys"], "unprocessed_keys": ["2024/10/03/job_1001/raw-2.json"]}]
+    assert len(result[0]["chunk_keys"]) == 1
+    assert s3_client.tags == {(PARQUET_FILES_BUCKET_NAME, key): {"compacted": "true"} for key in keys}
+    # Consumed chunks stay in place until the lifecycle rule expires them
+    assert all((PARQUET_FILES_BUCKET_NAME, key) in s3_client.objects for key in keys)
+
+
+def test_pass_lambda_handler_given_inline_chunk_keys_limit_returns_chunk_manifest_for_daily_assembly(temp_dir):
+    s3_client = FakeS3Client()
+    keys = [
+        put_chunk(s3_client, "2023-04-01T13_30m-aaaaaaaa", [{"value1": 1}]),
+        put_chunk(s3_client, "2023-04-01T13_30m-bbbbbbbb", [{"value1": 2}]),
+        put_chunk(s3_client, "2023-04-01T13_45m-aaaaaaaa", [{"value1": 3}]),
+    ]
+
+    result = lambda_handler([keys], {}, s3_client, temp_dir, min_chunk_bytes=1024 * 1024, inline_chunk_keys_limit=1)
+    daily_keys = parquet_files_processor_handler(result, {}, s3_client, temp_dir)
+
+    manifest = json.loads(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, result[0]["chunk_manifest_key"])])
+    assert len(manifest["chunk_keys"]) == 2
+    daily = pq.read_table(io.BytesIO(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, daily_keys[0])]))
+    assert daily.column("iotreadings_value1").to_pylist() == [1, 2, 3]
+
+
+def test_pass_lambda_handler_given_append_mode_and_compacted_chunks_returned_again_doesnt_append_them_twice(temp_dir):
+    s3_client = FakeS3Client()
+    keys = [
+        put_chunk(s3_client, "2023-04-01T13_30m-aaaaaaaa", [{"value1": 1}]),
+        put_chunk(s3_client, "2023-04-01T13_30m-bbbbbbbb", [{"value1": 2}]),
+        put_chunk(s3_client, "2023-04-01T13_30m-cccccccc", [{"value1": 3}]),
+    ]
+
+    first_result = lambda_handler([keys[:2]], {}, s3_client, temp_dir, min_chunk_bytes=1024 * 1024)
+    first_daily_keys = parquet_files_processor_handler(first_result, {}, s3_client, temp_dir, merge_mode="append")
+    # Processing ledger returns the chunk of a redelivered Raw data file, alone and together with a new chunk
+    second_daily_keys = parquet_files_processor_handler([[keys[0]]], {}, s3_client, temp_dir, merge_mode="append")
+    third_result = lambda_handler([[keys[1], keys[2]]], {}, s3_client, temp_dir, min_chunk_bytes=1024 * 1024)
+    third_daily_keys = parquet_files_processor_handler(third_result, {}, s3_client, temp_dir, merge_mode="append")
+
+    compacted_key = first_result[0][0]
+    sources_key = compacted_key.replace("/part-0.parquet", "/_sources.json")
+    assert json.loads(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, sources_key)]) == {"chunk_keys": keys[:2]}
+    assert second_daily_keys == []
+    assert third_result[0][0] != compacted_key
+    daily_values = [
+        value
+        for key in first_daily_keys + third_daily_keys
+        for value in pq.read_table(io.BytesIO(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, key)]))
+        .column("iotreadings_value1")
+        .to_pylist()
+    ]
+    assert daily_values == [1, 2, 3]
+
+
+# Chunk window prefix tests
+
+
+def test_pass_chunk_window_prefix_given_chunk_key_returns_key_up_to_window():
+    key = f"{CHUNK_PREFIX}/2023-04-01T13_30m-90147479.arrow/part-0.arrow"
+
+    assert chunk_window_prefix(key) == f"{CHUNK_PREFIX}/2023-04-01T13_30m"
+
+
+# Helper functions
+
+
+def put_chunk(s3_client, chunk_name, iotreadings):
+    rows = [
+        {
+            "timestamp": f"{chunk_name[:10]}T13:20:00Z",
+            "dataAsset": "mars",
+            **{f"iotreadings_{k}": v for k, v in r.items()},
+        }
+        for r in iotreadings
+    ]
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pylist(rows), buffer)
+    key = f"{CHUNK_PREFIX}/{chunk_name}.parquet/part-0.parquet"
+    s3_client.put(PARQUET_FILES_BUCKET_NAME, key, buffer.getvalue())
+    return key
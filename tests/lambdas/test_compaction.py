@@ -0,0 +1,206 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from lambda_processing.compaction import chunk_window, chunk_windows, compacted_row_groups
+from lambda_processing.deduplication import HASH_KEY, key_hashes
+from lambda_processing.parquet_files_processor import lambda_handler
+from tests.fake_s3 import serve_local_files
+
+JOB_ID = "41780824-ac46-4b25-9547-a53607b4f37a"
+CHUNKS_PREFIX = f"15min_chunks/job_{JOB_ID}/medallion-lakehouse-s3bronze/mars"
+# Peak of Arrow allocations while compacting, the synthetic day below takes several times more
+MEMORY_LIMIT_BYTES = 16 * 1024 * 1024
+# Proxy pool stays referenced for the whole test session, buffers allocated from it can outlive a test
+TRACKING_POOL = pa.proxy_memory_pool(pa.default_memory_pool())
+
+
+@pytest.fixture(autouse=True)
+def mock_env_variables():
+    with patch.dict("os.environ", {"PARQUET_FILES_BUCKET_NAME": "s3silver-bucket"}):
+        yield
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+def chunk_key(window, invocation_id="90147479"):
+    return f"{CHUNKS_PREFIX}/2023-04-01T{window}-{invocation_id}.parquet/part-0.parquet"
+
+
+def dump_chunk(temp_dir, key, table):
+    file_path = os.path.join(temp_dir, "source_files", key)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    pq.write_table(table, file_path)
+    return file_path
+
+
+# Chunk windows tests
+
+
+def test_pass_chunk_window_given_chunk_key_returns_day_hour_and_quarter():
+    assert chunk_window(chunk_key("13_30m")) == "2023-04-01T13_30m"
+
+
+def test_fail_chunk_window_given_key_without_window():
+    with pytest.raises(ValueError, match="window"):
+        chunk_window(f"{CHUNKS_PREFIX}/part-0.parquet")
+
+
+def test_pass_chunk_windows_given_keys_returns_them_by_window_in_time_order_keeping_keys_order():
+    keys = [chunk_key("14_15m"), chunk_key("13_60m", "b"), chunk_key("13_15m"), chunk_key("13_60m", "a")]
+
+    windows = chunk_windows(keys + [keys[0]])
+
+    assert windows == [
+        ("2023-04-01T13_15m", [keys[2]]),
+        ("2023-04-01T13_60m", [keys[1], keys[3]]),
+        ("2023-04-01T14_15m", [keys[0]]),
+    ]
+
+
+# Compacted row groups tests
+
+
+def test_pass_compacted_row_groups_given_repeated_readings_in_window_deduplicates_and_counts_them(temp_dir):
+    first = dump_chunk(temp_dir, chunk_key("13_15m", "a"), pa.table({"timestamp": ["t1", "t2"], "value1": [1, 2]}))
+    second = dump_chunk(temp_dir, chunk_key("13_15m", "b"), pa.table({"timestamp": ["t1"], "value9": [9]}))
+    stats = {}
+
+    row_groups = list(compacted_row_groups([("13_15m", [first, second])], ["timestamp"], "last", stats=stats))
+
+    assert [row_group.to_pydict() for row_group in row_groups] == [
+        {"timestamp": ["t2"], "value1": [2]},
+        {"timestamp": ["t1"], "value9": [9]},
+    ]
+    assert stats == {"rows_before_dedup": 3, "rows_after_dedup": 2}
+
+
+def test_pass_compacted_row_groups_given_key_without_timestamp_deduplicates_across_windows(temp_dir):
+    first = dump_chunk(temp_dir, chunk_key("13_15m"), pa.table({"timestamp": ["t1"], "dataAsset": ["mars"]}))
+    second = dump_chunk(temp_dir, chunk_key("13_30m"), pa.table({"timestamp": ["t2"], "dataAsset": ["mars"]}))
+
+    row_groups = list(compacted_row_groups([("13_15m", [first]), ("13_30m", [second])], ["dataAsset"], "first"))
+
+    assert sum(row_group.num_rows for row_group in row_groups) == 1
+
+
+def test_pass_compacted_row_groups_given_key_without_timestamp_and_keep_last_keeps_reading_of_later_window(temp_dir):
+    first = dump_chunk(
+        temp_dir, chunk_key("13_15m"), pa.table({"timestamp": ["t1", "t2"], "readingId": [1, 2], "value1": [1, 2]})
+    )
+    # Same readingId as double and in a chunk without value1
+    second = dump_chunk(temp_dir, chunk_key("13_30m"), pa.table({"timestamp": ["t3"], "readingId": [1.0]}))
+    stats = {}
+
+    row_groups = list(
+        compacted_row_groups([("13_15m", [first]), ("13_30m", [second])], ["readingId"], "last", stats=stats)
+    )
+
+    assert [row_group.to_pydict() for row_group in row_groups] == [
+        {"timestamp": ["t2"], "readingId": [2], "value1": [2]},
+        {"timestamp": ["t3"], "readingId": [1.0]},
+    ]
+    assert stats == {"rows_before_dedup": 3, "rows_after_dedup": 2}
+
+
+def test_pass_compacted_row_groups_given_different_keys_with_same_hash_in_different_windows_keeps_both(temp_dir):
+    first = dump_chunk(temp_dir, chunk_key("13_15m"), pa.table({"timestamp": ["t1", "t2"], "readingId": [1, 2]}))
+    second = dump_chunk(temp_dir, chunk_key("13_30m"), pa.table({"timestamp": ["t3", "t4"], "readingId": [3, 2]}))
+
+    def colliding_key_hashes(table, key_columns, hash_key=HASH_KEY):
+        # Readings 1 and 3 share the hash, the check hash tells them apart
+        hashes = key_hashes(table, key_columns, hash_key)
+        if hash_key == HASH_KEY:
+            hashes[table["readingId"].to_numpy() == 3] = key_hashes(pa.table({"readingId": [1]}), key_columns)[0]
+        return hashes
+
+    with patch("lambda_processing.compaction.key_hashes", colliding_key_hashes):
+        row_groups = list(compacted_row_groups([("13_15m", [first]), ("13_30m", [second])], ["readingId"], "first"))
+
+    assert [row_group.to_pydict() for row_group in row_groups] == [
+        {"timestamp": ["t1", "t2"], "readingId": [1, 2]},
+        {"timestamp": ["t3"], "readingId": [3]},
+    ]
+
+
+def test_pass_compacted_row_groups_given_remove_consumed_removes_chunks_after_their_window(temp_dir):
+    first = dump_chunk(temp_dir, chunk_key("13_15m"), pa.table({"timestamp": ["t1"]}))
+    second = dump_chunk(temp_dir, chunk_key("13_30m"), pa.table({"timestamp": ["t2"]}))
+
+    row_groups = compacted_row_groups([("13_15m", [first]), ("13_30m", [second])], remove_consumed=True)
+    next(row_groups)
+    assert os.path.exists(first)
+    next(row_groups)
+
+    assert not os.path.exists(first)
+    assert os.path.exists(second)
+
+
+# Bounded memory tests
+
+
+# Without timestamp in the key, repeated readings are searched for across the windows of the day
+@pytest.mark.parametrize("dedup_key_columns", [["dataAsset", "timestamp"], ["dataAsset", "readingId"]])
+def test_pass_lambda_handler_given_day_larger_than_memory_limit_compacts_it_within_the_limit(
+    temp_dir, dedup_key_columns
+):
+    rng = np.random.default_rng(0)
+    start = datetime(2023, 4, 1)
+    rows_per_chunk = 4000
+    keys = []
+    day_bytes = 0
+    for quarter in range(96):
+        window_start = start + timedelta(minutes=15 * quarter)
+        window = f"{window_start.strftime('%H')}_{(window_start.minute // 15 + 1) * 15}m"
+        timestamps = [
+            (window_start + timedelta(milliseconds=int(offset))).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+            for offset in np.sort(rng.choice(15 * 60 * 1000, rows_per_chunk, replace=False))
+        ]
+        # Every quarter has its own reading keys, like devices turned on and off during the day
+        reading_ids = np.arange(quarter * rows_per_chunk, (quarter + 1) * rows_per_chunk)
+        columns = {"timestamp": timestamps, "dataAsset": ["mars"] * rows_per_chunk, "readingId": reading_ids}
+        for reading in range(quarter % 4 * 5, quarter % 4 * 5 + 10):
+            columns[f"iotreadings_value{reading}"] = rng.random(rows_per_chunk)
+        table = pa.table(columns)
+        day_bytes += table.nbytes
+        keys.append(chunk_key(window))
+        dump_chunk(temp_dir, keys[-1], table)
+    assert day_bytes > 2 * MEMORY_LIMIT_BYTES
+
+    default_pool = pa.default_memory_pool()
+    pa.set_memory_pool(TRACKING_POOL)
+    try:
+        allocated_before = TRACKING_POOL.bytes_allocated()
+        lambda_handler(
+            [keys[::-1]],
+            {},
+            serve_local_files(MagicMock(), os.path.join(temp_dir, "source_files")),
+            temp_dir,
+            cleanup_on_finish=False,
+            dedup_key_columns=dedup_key_columns,
+            dedup_keep="first",
+            write_rollups=True,
+        )
+    finally:
+        pa.set_memory_pool(default_pool)
+
+    assert TRACKING_POOL.max_memory() - allocated_before < MEMORY_LIMIT_BYTES
+    daily_path = os.path.join(
+        temp_dir,
+        f"daily_files/job_{JOB_ID}/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.{JOB_ID}.snappy.parquet",
+    )
+    daily_file = pq.ParquetFile(os.path.join(daily_path, "part-0.parquet"))
+    assert daily_file.metadata.num_rows == 96 * rows_per_chunk
+    # Windows are written in time order, even though the chunk keys came in reverse
+    first_timestamps = daily_file.read_row_group(0, columns=["timestamp"])["timestamp"]
+    assert first_timestamps[0].as_py().startswith("2023-04-01T00:")
@@ -0,0 +1,140 @@
+from unittest.mock import patch
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+from lambda_processing.deduplication import (
+    dedup_ratio,
+    dedup_settings_from_env,
+    deduplicate_table,
+    deduplicate_tables,
+    key_hashes,
+)
+
+# Deduplicate table tests
+
+
+def test_pass_deduplicate_table_given_repeated_keys_keeps_first_occurrence():
+    table = pa.table(
+        {
+            "dataAsset": ["mars", "mars", "pluto", "mars"],
+            "timestamp": [
+                "2024-09-30T13:44:01Z",
+                "2024-09-30T13:45:01Z",
+                "2024-09-30T13:44:01Z",
+                "2024-09-30T13:44:01Z",
+            ],
+            "iotreadings_value1": [1, 2, 3, 4],
+        }
+    )
+
+    deduplicated = deduplicate_table(table, ["dataAsset", "timestamp"], "first")
+
+    assert deduplicated["iotreadings_value1"].to_pylist() == [1, 2, 3]
+
+
+def test_pass_deduplicate_table_given_repeated_keys_and_keep_last_keeps_last_occurrence_in_table_order():
+    table = pa.table(
+        {
+            "dataAsset": ["mars", "mars", "pluto", "mars"],
+            "timestamp": [
+                "2024-09-30T13:44:01Z",
+                "2024-09-30T13:45:01Z",
+                "2024-09-30T13:44:01Z",
+                "2024-09-30T13:44:01Z",
+            ],
+            "iotreadings_value1": [1, 2, 3, 4],
+        }
+    )
+
+    deduplicated = deduplicate_table(table, ["dataAsset", "timestamp"], "last")
+
+    assert deduplicated["iotreadings_value1"].to_pylist() == [2, 3, 4]
+
+
+def test_pass_deduplicate_table_given_unique_keys_returns_same_table():
+    table = pa.table({"dataAsset": ["mars", "pluto"], "timestamp": ["2024-09-30T13:44:01Z"] * 2})
+
+    assert deduplicate_table(table, ["dataAsset", "timestamp"]) is table
+
+
+def test_fail_deduplicate_table_given_missing_key_column():
+    table = pa.table({"dataAsset": ["mars"]})
+
+    with pytest.raises(ValueError, match="Deduplication key columns are missing in the table: \\['timestamp'\\]"):
+        deduplicate_table(table, ["dataAsset", "timestamp"])
+
+
+def test_fail_deduplicate_table_given_unknown_keep_policy():
+    table = pa.table({"dataAsset": ["mars"]})
+
+    with pytest.raises(ValueError, match="Unknown deduplication keep policy: any"):
+        deduplicate_table(table, ["dataAsset"], "any")
+
+
+# Deduplicate tables tests
+
+
+def test_pass_deduplicate_tables_given_repeated_keys_across_tables_keeps_occurrence_by_positions():
+    tables = [
+        pa.table({"timestamp": ["t1", "t2"], "iotreadings_value1": [1, 2]}),
+        pa.table({"timestamp": ["t1"], "iotreadings_value9": [9]}),
+    ]
+    positions = [np.array([0, 2]), np.array([1])]
+
+    first_tables, first_positions = deduplicate_tables(tables, positions, ["timestamp"], "first")
+    last_tables, last_positions = deduplicate_tables(tables, positions, ["timestamp"], "last")
+
+    assert [table.num_rows for table in first_tables] == [2, 0]
+    assert [table_positions.tolist() for table_positions in first_positions] == [[0, 2], []]
+    assert last_tables[0]["iotreadings_value1"].to_pylist() == [2]
+    assert last_tables[1]["iotreadings_value9"].to_pylist() == [9]
+    assert [table_positions.tolist() for table_positions in last_positions] == [[2], [1]]
+
+
+def test_pass_deduplicate_tables_given_key_column_missing_in_some_tables_takes_it_as_null():
+    tables = [pa.table({"timestamp": ["t1"], "iotreadings_value1": [1]}), pa.table({"timestamp": ["t1", "t1"]})]
+    positions = [np.array([0]), np.array([1, 2])]
+
+    deduplicated, _positions = deduplicate_tables(tables, positions, ["timestamp", "iotreadings_value1"], "first")
+
+    assert [table.num_rows for table in deduplicated] == [1, 1]
+
+
+def test_fail_deduplicate_tables_given_key_column_missing_in_all_tables():
+    with pytest.raises(ValueError, match="missing"):
+        deduplicate_tables([pa.table({"timestamp": ["t1"]})], [np.array([0])], ["dataAsset"], "first")
+
+
+# Key hashes tests
+
+
+def test_pass_key_hashes_given_same_keys_with_different_types_or_missing_columns_returns_same_hashes():
+    first = pa.table({"dataAsset": ["mars", "mars"], "readingId": pa.array([1, None], pa.int64())})
+    second = pa.table({"dataAsset": pa.array(["mars"]).dictionary_encode(), "readingId": [1.0]})
+    third = pa.table({"dataAsset": ["mars"]})
+
+    first_hashes = key_hashes(first, ["dataAsset", "readingId"])
+
+    assert first_hashes[0] != first_hashes[1]
+    assert key_hashes(second, ["dataAsset", "readingId"]).tolist() == first_hashes[:1].tolist()
+    assert key_hashes(third, ["dataAsset", "readingId"]).tolist() == first_hashes[1:].tolist()
+
+
+# Settings tests
+
+
+def test_pass_dedup_settings_from_env_given_comma_separated_key_columns_returns_list():
+    with patch.dict("os.environ", {"DEDUP_KEY_COLUMNS": "dataAsset, timestamp", "DEDUP_KEEP": "last"}):
+        assert dedup_settings_from_env() == (["dataAsset", "timestamp"], "last")
+
+
+def test_pass_dedup_settings_from_env_given_no_variables_disables_deduplication():
+    with patch.dict("os.environ", {}, clear=True):
+        assert dedup_settings_from_env() == ([], "first")
+
+
+def test_pass_dedup_ratio_given_row_counts_returns_share_of_removed_rows():
+    assert dedup_ratio(10, 5) == 0.5
+    assert dedup_ratio(0, 0) == 0.0
@@ -0,0 +1,106 @@
+import json
+import os
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from lambda_pooling.s3bronze_file_events_pooling import lambda_handler as pooling_handler
+from lambda_processing import files_processor, parquet_files_processor
+from tests.fake_s3 import FakeS3Client
+
+DATA_DIRECTORY_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+RAW_DATA_FILES_BUCKET_NAME = "s3bronze-bucket"
+PARQUET_FILES_BUCKET_NAME = "s3silver-bucket"
+JOB_PREFIX = "2024/10/02/job_328e430e-2569-46f2-8ca7-2fd8eb7f1549"
+
+
+@pytest.fixture(autouse=True)
+def mock_env_variables():
+    variables = {
+        "FILE_PROCESSORS_COUNT": "2",
+        "RAW_DATA_FILES_PER_PROCESSOR": "1",
+        "DATA_PROCESSING_STATE_MACHINE_ARN": "state-machine-arn",
+        "RAW_DATA_FILES_SQS_QUEUE_URL": "raw-sqs-queue-url",
+        "MAXIMUM_BATCHING_WINDOW_IN_SECONDS": "0.1",
+        "PROCESSING_MAP_MODE": "DISTRIBUTED",
+        "BATCH_MANIFESTS_BUCKET_NAME": PARQUET_FILES_BUCKET_NAME,
+        "RAW_DATA_FILES_BUCKET_NAME": RAW_DATA_FILES_BUCKET_NAME,
+        "PARQUET_FILES_BUCKET_NAME": PARQUET_FILES_BUCKET_NAME,
+    }
+    with patch.dict("os.environ", variables):
+        yield
+
+
+class DistributedMapStepFunctions:
+    """Runs the state machine of DISTRIBUTED Map mode in process: item reader, ResultWriter and the aggregation task."""
+
+    def __init__(self, s3_client, temp_dir):
+        self.s3_client = s3_client
+        self.temp_dir = temp_dir
+        self.executions = {}
+
+    def start_execution(self, stateMachineArn, input):
+        batch_manifest = json.loads(input)["batch_manifest"]
+        lines = self.s3_client.get_object(Bucket=batch_manifest["bucket"], Key=batch_manifest["key"])["Body"]
+        items = [json.loads(line) for line in lines.read().decode("utf-8").splitlines()]
+
+        child_executions = []
+        for index, item in enumerate(items):
+            processor_temp_dir = os.path.join(self.temp_dir, f"files_processor_{index}")
+            output = files_processor.lambda_handler(item, {}, self.s3_client, processor_temp_dir)
+            child_executions.append({"Input": json.dumps(item), "Output": json.dumps(output), "Status": "SUCCEEDED"})
+
+        result_writer_details = self.write_results("_map_results/run-1", child_executions)
+        map_output = {"MapRunArn": "map-run-arn", "ResultWriterDetails": result_writer_details}
+        parquet_files_processor.lambda_handler(
+            map_output, {}, self.s3_client, os.path.join(self.temp_dir, "parquet_files_processor")
+        )
+        self.executions["execution-arn"] = {"status": "SUCCEEDED", "output": json.dumps(map_output)}
+        return {"executionArn": "execution-arn"}
+
+    def describe_execution(self, executionArn):
+        return self.executions[executionArn]
+
+    def write_results(self, prefix, child_executions):
+        results_key = f"{prefix}/SUCCEEDED_0.json"
+        self.s3_client.put(PARQUET_FILES_BUCKET_NAME, results_key, json.dumps(child_executions).encode())
+        manifest = {
+            "DestinationBucket": PARQUET_FILES_BUCKET_NAME,
+            "MapRunArn": "map-run-arn",
+            "ResultFiles": {"SUCCEEDED": [{"Key": results_key, "Size": 1}], "FAILED": [], "PENDING": []},
+        }
+        manifest_key = f"{prefix}/manifest.json"
+        self.s3_client.put(PARQUET_FILES_BUCKET_NAME, manifest_key, json.dumps(manifest).encode())
+        return {"Bucket": PARQUET_FILES_BUCKET_NAME, "Key": manifest_key}
+
+
+# Distributed Map simulation tests
+
+
+def test_pass_pooler_given_distributed_map_mode_runs_pipeline_through_batch_manifest_and_result_writer():
+    s3_client = FakeS3Client()
+    file_keys = []
+    for file_name in sorted(os.listdir(DATA_DIRECTORY_PATH)):
+        file_key = f"{JOB_PREFIX}/{file_name}"
+        with open(os.path.join(DATA_DIRECTORY_PATH, file_name), "rb") as f:
+            s3_client.put(RAW_DATA_FILES_BUCKET_NAME, file_key, f.read())
+        file_keys.append(file_key)
+    trigger_event = {
+        "Records": [{"body": json.dumps({"Records": [{"s3": {"object": {"key": key}}}]})} for key in file_keys]
+    }
+    mock_sqs = MagicMock()
+    mock_sqs.receive_message.return_value = {}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        stepfunctions = DistributedMapStepFunctions(s3_client, temp_dir)
+        pooling_handler(trigger_event, {}, mock_sqs, stepfunctions, s3_client)
+
+    batch_manifest_keys = s3_client.keys(PARQUET_FILES_BUCKET_NAME, "_batch_manifests/")
+    assert len(batch_manifest_keys) == 1
+    chunk_keys = s3_client.keys(PARQUET_FILES_BUCKET_NAME, "15min_chunks/")
+    assert len(chunk_keys) > 0
+    daily_keys = [key for key in s3_client.keys(PARQUET_FILES_BUCKET_NAME, "job_") if key.endswith(".parquet")]
+    assert any("/mars/2023/04/01/" in key for key in daily_keys)
+    assert any("/jupiter/2024/01/01/" in key for key in daily_keys)
+    assert mock_sqs.send_message_batch.call_count == 0
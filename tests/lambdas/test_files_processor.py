@@ -1,13 +1,21 @@
+import io
+import json
 import os
-import pandas as pd
-import pytest
 import tempfile
 import uuid
+from datetime import datetime, timedelta, timezone
+from unittest.mock import ANY, MagicMock, patch
 
-from tests.factories import build_data_asset, dump_raw_data_file
-from unittest.mock import MagicMock, patch
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
 
-from lambda_processing.files_processor import lambda_handler, dump_to_parquet, normalize_inplace
+from lambda_processing.files_processor import dump_to_parquet, lambda_handler, normalize_inplace
+from lambda_processing.processing_ledger import LocalProcessingLedger
+from lambda_processing.watermarks import S3Watermarks
+from tests.factories import build_data_asset, dump_raw_data_file
+from tests.fake_s3 import FakeS3Client
 
 RAW_DATA_FILES_BUCKET_NAME = "s3bronze-bucket"
 PARQUET_FILES_BUCKET_NAME = "s3silver-bucket"
@@ -93,7 +101,7 @@ def test_pass_lambda_handler_given_file_list_uploads_appropriate_parquet_directo
         f"2024-09-30T13_45m-{invocation_id}.parquet",
         "part-0.parquet",
     )
-    mock_s3_client.upload_file.assert_any_call(file_path, PARQUET_FILES_BUCKET_NAME, file_key)
+    mock_s3_client.upload_file.assert_any_call(file_path, PARQUET_FILES_BUCKET_NAME, file_key, ExtraArgs=ANY)
     assert uploaded_file_keys == [file_key]
 
 
@@ -134,7 +142,7 @@ def test_pass_lambda_handler_given_duplicate_files_aggregates_them_into_single_1
         f"2024-09-30T13_45m-{invocation_id}.parquet",
         "part-0.parquet",
     )
-    mock_s3_client.upload_file.assert_any_call(file_path, PARQUET_FILES_BUCKET_NAME, file_key)
+    mock_s3_client.upload_file.assert_any_call(file_path, PARQUET_FILES_BUCKET_NAME, file_key, ExtraArgs=ANY)
     assert uploaded_file_keys == [file_key]
 
 
@@ -155,6 +163,190 @@ def test_pass_lambda_handler_given_file_list_removes_downloaded_and_generated_fi
     assert not os.path.exists(os.path.join(temp_dir, "generated_files"))
 
 
+def test_pass_lambda_handler_given_file_in_ledger_skips_it_and_returns_recorded_chunk_keys(temp_dir):
+    job_subdirectory = "job_842d6e1c-0630-4af8-a3e1-8d18a24ce805"
+    file_key = f"2024/10/03/{job_subdirectory}/raw-1.json"
+    chunk_key = f"15min_chunks/{job_subdirectory}/{RAW_DATA_FILES_BUCKET_NAME}/mars/2024-09-30T13_45m-3fde7b3b.parquet/part-0.parquet"
+    ledger = LocalProcessingLedger(os.path.join(temp_dir, "ledger.json"))
+    ledger.put(file_key, "etag-1", [chunk_key])
+    mock_s3_client = MagicMock()
+    mock_s3_client.head_object.return_value = {"ETag": '"etag-1"'}
+
+    uploaded_file_keys = lambda_handler([file_key], {}, mock_s3_client, temp_dir, ledger=ledger)
+
+    assert mock_s3_client.download_file.call_count == 0
+    assert mock_s3_client.upload_file.call_count == 0
+    assert uploaded_file_keys == [chunk_key]
+
+
+def test_pass_lambda_handler_given_file_in_ledger_with_deleted_chunks_processes_it_again(temp_dir):
+    file_keys = ["2024/10/03/job_1001/raw-1.json", "2024/10/03/job_1001/raw-2.json"]
+    data_assets = [{"timestamp": "2024-09-30T13:44:01.000Z", "dataAsset": "mars", "iotreadings": {"value1": 1}}]
+    s3_client = FakeS3Client()
+    for file_key in file_keys:
+        s3_client.put(RAW_DATA_FILES_BUCKET_NAME, file_key, json.dumps(data_assets).encode())
+    ledger = LocalProcessingLedger(os.path.join(temp_dir, "ledger.json"))
+    kept_chunk_key = "15min_chunks/job_1001/s3bronze-bucket/mars/2024-09-30T13_45m-11111111.parquet/part-0.parquet"
+    s3_client.put(PARQUET_FILES_BUCKET_NAME, kept_chunk_key, b"chunk")
+    ledger.put(
+        file_keys[0],
+        s3_client.head_object(RAW_DATA_FILES_BUCKET_NAME, file_keys[0])["ETag"].strip('"'),
+        [kept_chunk_key],
+    )
+    deleted_chunk_key = "15min_chunks/job_1001/s3bronze-bucket/mars/2024-09-30T13_45m-22222222.parquet/part-0.parquet"
+    ledger.put(
+        file_keys[1],
+        s3_client.head_object(RAW_DATA_FILES_BUCKET_NAME, file_keys[1])["ETag"].strip('"'),
+        [deleted_chunk_key],
+    )
+
+    result = lambda_handler(file_keys, {}, s3_client, temp_dir, ledger=ledger, verify_ledger_chunks=True)
+
+    assert s3_client.requests["download_file"] == 1
+    assert result[0] == kept_chunk_key
+    assert len(result) == 2 and result[1] != deleted_chunk_key
+    assert ledger.get(
+        file_keys[1], s3_client.head_object(RAW_DATA_FILES_BUCKET_NAME, file_keys[1])["ETag"].strip('"')
+    ) == [result[1]]
+
+
+def test_pass_lambda_handler_given_ledger_records_processed_files_with_deterministic_chunk_names(temp_dir):
+    data_asset = build_data_asset(dataAsset="mars", timestamp="2024-09-30T13:44:01.000Z")
+    job_subdirectory = "job_842d6e1c-0630-4af8-a3e1-8d18a24ce805"
+    file_key = f"2024/10/03/{job_subdirectory}/raw-1.json"
+    file_path = os.path.join(temp_dir, "source_files", RAW_DATA_FILES_BUCKET_NAME, job_subdirectory, "raw-1.json")
+    mock_s3_client = MagicMock()
+    mock_s3_client.head_object.return_value = {"ETag": '"etag-1"'}
+    mock_s3_client.download_file.side_effect = lambda *args: dump_raw_data_file([dict(data_asset)], file_path)
+
+    # Two attempts with independent ledgers, f.e. when the first attempt failed before recording
+    first_keys = lambda_handler(
+        [file_key], {}, mock_s3_client, temp_dir, ledger=LocalProcessingLedger(os.path.join(temp_dir, "l1.json"))
+    )
+    ledger = LocalProcessingLedger(os.path.join(temp_dir, "l2.json"))
+    second_keys = lambda_handler([file_key], {}, mock_s3_client, temp_dir, ledger=ledger)
+
+    assert len(first_keys) == 1
+    assert first_keys == second_keys
+    assert ledger.get(file_key, "etag-1") == second_keys
+    mock_s3_client.head_object.assert_any_call(Bucket=RAW_DATA_FILES_BUCKET_NAME, Key=file_key)
+
+
+def test_pass_lambda_handler_given_ledger_and_file_redelivered_in_another_batch_overwrites_its_chunks(temp_dir):
+    file_keys = ["2024/10/03/job_1001/raw-1.json", "2024/10/03/job_1001/raw-2.json"]
+    s3_client = FakeS3Client()
+    for index, file_key in enumerate(file_keys):
+        data_assets = [{"timestamp": "2024-09-30T13:44:01.000Z", "dataAsset": "mars", "iotreadings": {"value1": index}}]
+        s3_client.put(RAW_DATA_FILES_BUCKET_NAME, file_key, json.dumps(data_assets).encode())
+
+    # The first batch fails before recording, so the ledger doesn't skip the file when it's redelivered
+    first_keys = lambda_handler(
+        file_keys[:1], {}, s3_client, temp_dir, ledger=LocalProcessingLedger(os.path.join(temp_dir, "l1.json"))
+    )
+    second_keys = lambda_handler(
+        file_keys, {}, s3_client, temp_dir, ledger=LocalProcessingLedger(os.path.join(temp_dir, "l2.json"))
+    )
+
+    assert len(second_keys) == 2
+    assert first_keys == second_keys[:1]
+    assert second_keys[0] != second_keys[1]
+
+
+def test_pass_lambda_handler_given_exhausted_work_budget_uploads_processed_files_and_returns_unprocessed_keys(temp_dir):
+    data_asset = build_data_asset(dataAsset="mars", timestamp="2024-09-30T13:44:01.000Z")
+    job_subdirectory = "job_842d6e1c-0630-4af8-a3e1-8d18a24ce805"
+    file_keys = [f"2024/10/03/{job_subdirectory}/raw-{i}.json" for i in range(1, 4)]
+    mock_s3_client = MagicMock()
+    mock_s3_client.head_object.return_value = {"ETag": '"etag-1"'}
+    mock_s3_client.download_file.side_effect = lambda bucket, key, path: dump_raw_data_file([dict(data_asset)], path)
+    work_budget = MagicMock()
+    work_budget.exhausted_reason.side_effect = [None, "10 ms left"]
+    ledger = LocalProcessingLedger(os.path.join(temp_dir, "ledger.json"))
+
+    result = lambda_handler(file_keys, {}, mock_s3_client, temp_dir, ledger=ledger, work_budget=work_budget)
+
+    # The next file is downloaded while the previous one is processed, so the first rescheduled file is downloaded too
+    assert mock_s3_client.download_file.call_count == 3
+    assert len(result["chunk_keys"]) == 2
+    assert result["unprocessed_keys"] == file_keys[2:]
+    assert ledger.get(file_keys[1], "etag-1") == result["chunk_keys"][1:]
+    assert ledger.get(file_keys[2], "etag-1") is None
+
+
+def test_pass_lambda_handler_given_more_chunk_keys_than_inline_limit_returns_chunk_manifest_key(temp_dir):
+    data_assets = [
+        build_data_asset(dataAsset="mars", timestamp="2024-09-30T13:44:01.000Z"),
+        build_data_asset(dataAsset="mars", timestamp="2024-09-30T13:46:01.000Z"),
+    ]
+    mock_s3_client = MagicMock()
+    mock_s3_client.download_file.side_effect = lambda bucket, key, path: dump_raw_data_file(data_assets, path)
+
+    result = lambda_handler(
+        ["2024/10/03/job_1001/raw-1.json"], {}, mock_s3_client, temp_dir, "5F5E7A8B", inline_chunk_keys_limit=1
+    )
+
+    assert result == {"chunk_manifest_key": "_chunk_manifests/5F5E7A8B.json"}
+    manifest_call = mock_s3_client.put_object.call_args.kwargs
+    assert manifest_call["Key"] == "_chunk_manifests/5F5E7A8B.json"
+    assert len(json.loads(manifest_call["Body"])["chunk_keys"]) == 2
+
+
+def test_pass_lambda_handler_given_file_above_ranged_download_threshold_fetches_it_in_byte_ranges(temp_dir):
+    file_keys = ["2024/10/03/job_1001/raw-1.ndjson", "2024/10/03/job_1001/raw-2.json"]
+    data_assets = [
+        {"timestamp": "2024-09-30T13:44:01.000Z", "dataAsset": "mars", "iotreadings": {"value1": i}} for i in range(20)
+    ]
+    s3_client = FakeS3Client()
+    s3_client.put(RAW_DATA_FILES_BUCKET_NAME, file_keys[0], "".join(json.dumps(a) + "\n" for a in data_assets).encode())
+    s3_client.put(RAW_DATA_FILES_BUCKET_NAME, file_keys[1], json.dumps(data_assets[:2]).encode())
+
+    result = lambda_handler(
+        file_keys,
+        {},
+        s3_client,
+        temp_dir,
+        "5F5E7A8B",
+        ranged_download_threshold_bytes=200,
+        range_part_size_bytes=100,
+    )
+
+    # Only the large file is fetched in ranges, the small one is downloaded whole
+    assert s3_client.requests["get_object"] == -(
+        -len(s3_client.objects[(RAW_DATA_FILES_BUCKET_NAME, file_keys[0])]) // 100
+    )
+    assert s3_client.requests["download_file"] == 1
+    assert result == ["15min_chunks/job_1001/s3bronze-bucket/mars/2024-09-30T13_45m-5F5E7A8B.parquet/part-0.parquet"]
+    chunk = pq.read_table(io.BytesIO(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, result[0])]))
+    assert chunk.column("iotreadings_value1").to_pylist() == list(range(20)) + [0, 1]
+
+
+def test_pass_lambda_handler_given_watermarks_puts_readings_behind_them_into_late_chunk_of_their_day(temp_dir):
+    file_keys = ["2024/10/03/job_1001/raw-1.json", "2024/10/03/job_1001/raw-2.json"]
+    s3_client = FakeS3Client()
+    on_time_assets = [{"timestamp": "2024-09-30T13:44:01.000Z", "dataAsset": "mars", "iotreadings": {"value1": 1}}]
+    late_assets = [
+        {"timestamp": "2024-09-30T11:02:01.000Z", "dataAsset": "mars", "iotreadings": {"value1": 2}},
+        {"timestamp": "2024-09-30T09:31:01.000Z", "dataAsset": "mars", "iotreadings": {"value1": 3}},
+        {"timestamp": "2024-09-30T13:50:01.000Z", "dataAsset": "mars", "iotreadings": {"value1": 4}},
+    ]
+    s3_client.put(RAW_DATA_FILES_BUCKET_NAME, file_keys[0], json.dumps(on_time_assets).encode())
+    s3_client.put(RAW_DATA_FILES_BUCKET_NAME, file_keys[1], json.dumps(late_assets).encode())
+    watermarks = S3Watermarks(s3_client, PARQUET_FILES_BUCKET_NAME, timedelta(minutes=60))
+
+    result = lambda_handler(file_keys, {}, s3_client, temp_dir, "5F5E7A8B", watermarks=watermarks)
+
+    chunk_prefix = "15min_chunks/job_1001/s3bronze-bucket/mars"
+    assert result == [
+        f"{chunk_prefix}/2024-09-30T13_45m-5F5E7A8B.parquet/part-0.parquet",
+        f"{chunk_prefix}/2024-09-30T_late-5F5E7A8B.parquet/part-0.parquet",
+        f"{chunk_prefix}/2024-09-30T13_60m-5F5E7A8B.parquet/part-0.parquet",
+    ]
+    late_chunk = pq.read_table(io.BytesIO(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, result[1])]))
+    assert late_chunk.column("iotreadings_value1").to_pylist() == [2, 3]
+    later_watermarks = S3Watermarks(s3_client, PARQUET_FILES_BUCKET_NAME, timedelta(minutes=60))
+    assert later_watermarks.watermarks("job_1001") == {"mars": datetime(2024, 9, 30, 12, 50, 1, tzinfo=timezone.utc)}
+
+
 # Dump to parquet tests
 
 
@@ -225,6 +417,96 @@ def test_pass_dump_to_parqeut_given_existing_parquet_and_new_data_asset_keys_ext
     assert pd.isna(row3["iotreadings_value9"])
 
 
+def test_pass_dump_to_parquet_given_dedup_key_columns_drops_repeated_readings_across_calls(temp_dir):
+    output_path = os.path.join(temp_dir, str(uuid.uuid4()))
+    data_asset_1 = build_data_asset(dataAsset="mars", timestamp="2024-09-30T13:40:01.000Z", iotreadings={"value1": 1})
+    data_asset_2 = build_data_asset(dataAsset="mars", timestamp="2024-09-30T13:40:01.000Z", iotreadings={"value1": 2})
+    data_asset_3 = build_data_asset(dataAsset="mars", timestamp="2024-09-30T13:41:01.000Z", iotreadings={"value1": 3})
+
+    dump_to_parquet([data_asset_1], output_path, "5F5E7A8B", ["dataAsset", "timestamp"], "last")
+    dump_to_parquet([data_asset_2, data_asset_3], output_path, "5F5E7A8B", ["dataAsset", "timestamp"], "last")
+
+    read_df = pd.read_parquet(os.path.join(output_path, "mars/2024-09-30T13_45m-5F5E7A8B.parquet"))
+    assert sorted(read_df["iotreadings_value1"].tolist()) == [2, 3]
+
+
+def test_pass_dump_to_parquet_given_watermark_by_product_writes_older_readings_to_late_chunk(temp_dir):
+    output_path = os.path.join(temp_dir, str(uuid.uuid4()))
+    data_asset_1 = build_data_asset(dataAsset="mars", timestamp="2024-09-30T13:40:01.000Z")
+    data_asset_2 = build_data_asset(dataAsset="mars", timestamp="2024-09-30T08:40:01.000Z")
+    data_asset_3 = build_data_asset(dataAsset="pluto", timestamp="2024-09-30T08:40:01.000Z")
+    watermark_by_product = {"mars": datetime(2024, 9, 30, 12, 0, tzinfo=timezone.utc)}
+    stats = {}
+
+    paths = dump_to_parquet(
+        [data_asset_1, data_asset_2, data_asset_3],
+        output_path,
+        "5F5E7A8B",
+        watermark_by_product=watermark_by_product,
+        stats=stats,
+    )
+
+    assert [os.path.relpath(path, output_path) for path in paths] == [
+        "mars/2024-09-30T13_45m-5F5E7A8B.parquet",
+        "mars/2024-09-30T_late-5F5E7A8B.parquet",
+        "pluto/2024-09-30T08_45m-5F5E7A8B.parquet",
+    ]
+    assert stats["late_rows"] == 1
+    assert stats["max_timestamp_by_product"] == {
+        "mars": datetime(2024, 9, 30, 13, 40, 1, tzinfo=timezone.utc),
+        "pluto": datetime(2024, 9, 30, 8, 40, 1, tzinfo=timezone.utc),
+    }
+
+
+def test_pass_dump_to_parquet_given_long_output_shape_writes_row_per_reading(temp_dir):
+    output_path = os.path.join(temp_dir, str(uuid.uuid4()))
+    data_asset = build_data_asset(
+        dataAsset="mars", timestamp="2024-09-30T13:40:01.000Z", iotreadings={"value1": 1, "value2": 4.5}
+    )
+
+    dump_to_parquet([data_asset], output_path, "5F5E7A8B", output_shape="long")
+
+    read_df = pd.read_parquet(os.path.join(output_path, "mars/2024-09-30T13_45m-5F5E7A8B.parquet"))
+    assert read_df["reading_name"].tolist() == ["value1", "value2"]
+    assert read_df["value_int"].tolist()[0] == 1
+    assert read_df["value_float"].tolist()[1] == 4.5
+
+
+def test_pass_dump_to_parquet_given_arrow_chunk_format_writes_and_extends_arrow_ipc_chunks(temp_dir):
+    output_path = os.path.join(temp_dir, str(uuid.uuid4()))
+    data_asset_1 = build_data_asset(dataAsset="mars", timestamp="2024-09-30T13:40:01.000Z", iotreadings={"value1": 1})
+    data_asset_2 = build_data_asset(dataAsset="mars", timestamp="2024-09-30T13:41:01.000Z", iotreadings={"value2": 2})
+
+    dump_to_parquet([data_asset_1], output_path, "5F5E7A8B", chunk_format="arrow_lz4")
+    chunk_paths = dump_to_parquet([data_asset_2], output_path, "5F5E7A8B", chunk_format="arrow_lz4")
+
+    assert chunk_paths == [os.path.join(output_path, "mars/2024-09-30T13_45m-5F5E7A8B.arrow")]
+    table = pa.ipc.open_file(os.path.join(chunk_paths[0], "part-0.arrow")).read_all()
+    assert table.column("iotreadings_value1").to_pylist() == [1, None]
+    assert table.column("iotreadings_value2").to_pylist() == [None, 2]
+
+
+def test_pass_dump_to_parquet_given_write_workers_writes_same_chunks_as_sequential_writes(temp_dir):
+    data_assets = [
+        build_data_asset(dataAsset=product, timestamp=f"2024-09-30T{hour:02}:{minute:02}:01.000Z", iotreadings={"v": 1})
+        for product in ("mars", "pluto")
+        for hour in range(4)
+        for minute in (5, 20, 35, 50)
+    ]
+    sequential_path = os.path.join(temp_dir, "sequential")
+    parallel_path = os.path.join(temp_dir, "parallel")
+
+    sequential_paths = dump_to_parquet([dict(asset) for asset in data_assets], sequential_path, "5F5E7A8B")
+    parallel_paths = dump_to_parquet([dict(asset) for asset in data_assets], parallel_path, "5F5E7A8B", write_workers=4)
+
+    assert [os.path.relpath(path, parallel_path) for path in parallel_paths] == [
+        os.path.relpath(path, sequential_path) for path in sequential_paths
+    ]
+    assert len(parallel_paths) == 32
+    for sequential_file_path, parallel_file_path in zip(sequential_paths, parallel_paths):
+        assert pd.read_parquet(parallel_file_path).equals(pd.read_parquet(sequential_file_path))
+
+
 # Normalize data asset tests
 
 
@@ -0,0 +1,185 @@
+import json
+import os
+import tempfile
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from lambda_processing import json_parsers
+from lambda_processing.files_processor import dump_to_parquet, normalize_inplace
+from lambda_processing.json_parsers import (
+    available_json_parsers,
+    is_ndjson,
+    load_raw_data_chunks,
+    load_raw_data_file,
+    ndjson_block_ranges,
+    resolve_json_parser,
+)
+
+DATA_ASSETS = [
+    {"timestamp": "2024-09-30T13:40:01.000Z", "dataAsset": " mars", "iotreadings": {"value1": 1, "value2": 2.5}},
+    {"timestamp": "2024-09-30T13:41:01.000Z", "dataAsset": "mars", "iotreadings": {"value3": 3}},
+    {"timestamp": "2024-09-30T14:02:01.000Z", "dataAsset": "pluto", "iotreadings": {}},
+    {"timestamp": "2024-09-30T14:03:01.000Z", "dataAsset": "pluto"},
+]
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+# Load Raw data file tests
+
+
+@pytest.mark.parametrize("parser", available_json_parsers())
+def test_pass_load_raw_data_file_given_json_array_returns_same_data_assets_as_json_module(temp_dir, parser):
+    file_path = dump_json_array(temp_dir, DATA_ASSETS)
+
+    assert load_raw_data_file(file_path, parser) == DATA_ASSETS
+
+
+@pytest.mark.parametrize("parser", available_json_parsers())
+def test_pass_load_raw_data_file_given_ndjson_returns_same_normalized_data_assets_as_json_module(temp_dir, parser):
+    file_path = dump_ndjson(temp_dir, DATA_ASSETS)
+
+    data_assets = load_raw_data_file(file_path, parser)
+
+    assert normalized(data_assets) == normalized(json.loads(json.dumps(DATA_ASSETS)))
+
+
+@pytest.mark.parametrize("parser", available_json_parsers())
+@pytest.mark.parametrize("dump", ["array", "ndjson"])
+def test_pass_load_raw_data_file_given_mixed_types_dates_and_nulls_returns_same_data_assets_as_json_module(
+    temp_dir, parser, dump
+):
+    data_assets = [
+        {"timestamp": "2024-09-30T13:40:01.000Z", "dataAsset": "mars", "iotreadings": {"value1": 1, "at": None}},
+        {
+            "timestamp": "2024-09-30T13:41:01.000Z",
+            "dataAsset": "mars",
+            "iotreadings": {"value1": 2.5, "at": "2024-09-30"},
+        },
+    ]
+    file_path = dump_json_array(temp_dir, data_assets) if dump == "array" else dump_ndjson(temp_dir, data_assets)
+
+    loaded = load_raw_data_file(file_path, parser)
+
+    assert loaded == data_assets
+    assert type(loaded[0]["iotreadings"]["value1"]) is int
+    assert "at" in loaded[0]["iotreadings"]
+
+
+@pytest.mark.parametrize("parser", available_json_parsers())
+def test_pass_dump_to_parquet_given_data_assets_of_any_parser_writes_same_chunks(temp_dir, parser):
+    expected_paths = dump_to_parquet(
+        load_raw_data_file(dump_json_array(temp_dir, DATA_ASSETS), "stdlib"), os.path.join(temp_dir, "stdlib"), "1"
+    )
+    chunk_paths = dump_to_parquet(
+        load_raw_data_file(dump_ndjson(temp_dir, DATA_ASSETS), parser), os.path.join(temp_dir, parser), "1"
+    )
+
+    assert len(chunk_paths) == len(expected_paths) == 2
+    for expected_path, chunk_path in zip(expected_paths, chunk_paths):
+        expected = pd.read_parquet(expected_path)
+        chunk = pd.read_parquet(chunk_path)
+        # Arrow orders the columns of newline-delimited input as it first saw the keys
+        assert chunk[sorted(chunk.columns)].equals(expected[sorted(expected.columns)])
+
+
+def test_pass_is_ndjson_given_ndjson_extension_doesnt_read_the_content(temp_dir):
+    file_path = os.path.join(temp_dir, "raw-1.jsonl")
+    with open(file_path, "w") as f:
+        f.write("[]")
+
+    assert is_ndjson(file_path)
+    assert not is_ndjson(dump_json_array(temp_dir, DATA_ASSETS))
+    assert is_ndjson(dump_ndjson(temp_dir, DATA_ASSETS))
+
+
+@pytest.mark.parametrize("parser", available_json_parsers())
+def test_pass_load_raw_data_chunks_given_chunks_split_mid_line_returns_same_data_assets(parser):
+    ndjson = "".join(json.dumps(data_asset) + "\n" for data_asset in DATA_ASSETS).encode()
+    array = json.dumps(DATA_ASSETS).encode()
+
+    for data in (ndjson, array):
+        chunks = [data[start : start + 7] for start in range(0, len(data), 7)]
+        assert load_raw_data_chunks(chunks, parser) == DATA_ASSETS
+
+
+# Parallel block parsing tests
+
+
+def test_pass_ndjson_block_ranges_splits_file_on_newlines_into_adjacent_ranges(temp_dir):
+    file_path = dump_ndjson(temp_dir, DATA_ASSETS * 10)
+    with open(file_path, "rb") as f:
+        data = f.read()
+
+    ranges = ndjson_block_ranges(file_path, 3)
+
+    assert len(ranges) == 3
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    for (_start, end), (next_start, _next_end) in zip(ranges, ranges[1:]):
+        assert end == next_start
+        assert data[end - 1 : end] == b"\n"
+
+
+@pytest.mark.parametrize("parser", ["stdlib", "orjson"])
+def test_pass_load_raw_data_file_given_parse_workers_returns_data_assets_in_file_order(temp_dir, parser):
+    data_assets = [dict(data_asset, dataAsset=f"asset-{i}") for i, data_asset in enumerate(DATA_ASSETS * 25)]
+    file_path = dump_ndjson(temp_dir, data_assets)
+
+    with patch.object(json_parsers, "PARALLEL_PARSE_MIN_BYTES", 0):
+        assert load_raw_data_file(file_path, parser, parse_workers=4) == data_assets
+
+
+def test_fail_load_raw_data_file_given_malformed_line_in_forked_block_raises_its_error(temp_dir):
+    file_path = dump_ndjson(temp_dir, DATA_ASSETS * 10)
+    with open(file_path, "a") as f:
+        f.write('{"timestamp": "2024-09-30T14:03:01.000Z", "dataAsset": \n')
+
+    with patch.object(json_parsers, "PARALLEL_PARSE_MIN_BYTES", 0), pytest.raises(ValueError):
+        load_raw_data_file(file_path, "stdlib", parse_workers=2)
+
+
+# Resolve JSON parser tests
+
+
+def test_pass_resolve_json_parser_given_missing_parser_falls_back_to_next_available():
+    with patch.object(json_parsers, "simdjson", None), patch.object(json_parsers, "orjson", object()):
+        assert resolve_json_parser("simdjson", ndjson=False) == "orjson"
+        assert resolve_json_parser("auto", ndjson=False) == "orjson"
+        assert resolve_json_parser("auto", ndjson=True) == "orjson"
+
+
+def test_fail_json_parser_from_env_given_unknown_parser_raises_error():
+    with (
+        patch.dict("os.environ", {"JSON_PARSER": "yaml"}),
+        pytest.raises(ValueError, match="Unknown JSON parser: yaml"),
+    ):
+        json_parsers.json_parser_from_env()
+
+
+# Helper functions
+
+
+def dump_json_array(temp_dir, data_assets):
+    file_path = os.path.join(temp_dir, "raw-array.json")
+    with open(file_path, "w") as f:
+        json.dump(data_assets, f, indent=4)
+    return file_path
+
+
+def dump_ndjson(temp_dir, data_assets):
+    file_path = os.path.join(temp_dir, "raw-ndjson.json")
+    with open(file_path, "w") as f:
+        f.writelines(json.dumps(data_asset) + "\n" for data_asset in data_assets)
+    return file_path
+
+
+def normalized(data_assets):
+    for data_asset in data_assets:
+        normalize_inplace(data_asset)
+    return data_assets
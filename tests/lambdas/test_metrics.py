@@ -0,0 +1,21 @@
+import json
+
+from lambda_processing.metrics import put_metric
+
+# Put metric tests
+
+
+def test_pass_put_metric_given_value_and_dimensions_prints_embedded_metric_format_record(capfd):
+    put_metric("DailyDedupRatio", 0.5, unit="None", Stage="ParquetFilesProcessor")
+
+    (stdout, _) = capfd.readouterr()
+    record = json.loads(stdout)
+    assert record["DailyDedupRatio"] == 0.5
+    assert record["Stage"] == "ParquetFilesProcessor"
+    assert record["_aws"]["CloudWatchMetrics"] == [
+        {
+            "Namespace": "MedallionLakehouse",
+            "Dimensions": [["Stage"]],
+            "Metrics": [{"Name": "DailyDedupRatio", "Unit": "None"}],
+        }
+    ]
@@ -0,0 +1,93 @@
+from unittest.mock import patch
+
+import pyarrow as pa
+import pytest
+
+from lambda_processing.output_shapes import dedup_key_columns_for_schema, long_table_from_assets, output_shape_from_env
+
+# Long table tests
+
+
+def test_pass_long_table_from_assets_given_normalized_assets_returns_row_per_reading_with_typed_values():
+    data_assets = [
+        {"timestamp": "2024-09-30T13:44:01.000Z", "dataAsset": "mars", "iotreadings_value1": 1, "iotreadings_t": 2.5},
+        {"timestamp": "2024-09-30T13:45:01.000Z", "dataAsset": "mars", "iotreadings_on": True, "iotreadings_s": "ok"},
+    ]
+
+    table = long_table_from_assets(data_assets)
+
+    assert table.column_names == [
+        "timestamp",
+        "dataAsset",
+        "reading_name",
+        "value_int",
+        "value_float",
+        "value_bool",
+        "value_string",
+    ]
+    assert pa.types.is_dictionary(table.schema.field("reading_name").type)
+    assert table.to_pylist()[0] == {
+        "timestamp": "2024-09-30T13:44:01.000Z",
+        "dataAsset": "mars",
+        "reading_name": "value1",
+        "value_int": 1,
+        "value_float": None,
+        "value_bool": None,
+        "value_string": None,
+    }
+    assert table["value_float"].to_pylist() == [None, 2.5, None, None]
+    assert table["value_bool"].to_pylist() == [None, None, True, None]
+    assert table["value_string"].to_pylist() == [None, None, None, "ok"]
+
+
+def test_pass_long_table_from_assets_given_ints_beyond_int64_puts_them_into_string_column():
+    data_assets = [
+        {
+            "timestamp": "2024-09-30T13:44:01.000Z",
+            "dataAsset": "mars",
+            "iotreadings_a": 2**63,
+            "iotreadings_b": -(2**63),
+        }
+    ]
+
+    table = long_table_from_assets(data_assets)
+
+    assert table["value_int"].to_pylist() == [None, -(2**63)]
+    assert table["value_string"].to_pylist() == [str(2**63), None]
+
+
+def test_pass_long_table_from_assets_given_asset_without_readings_returns_no_rows():
+    table = long_table_from_assets([{"timestamp": "2024-09-30T13:44:01.000Z", "dataAsset": "mars"}])
+
+    assert table.num_rows == 0
+    assert "reading_name" in table.column_names
+
+
+# Settings tests
+
+
+def test_pass_output_shape_from_env_given_no_variable_returns_wide():
+    with patch.dict("os.environ", {}, clear=True):
+        assert output_shape_from_env() == "wide"
+
+
+def test_fail_output_shape_from_env_given_unknown_shape():
+    with (
+        patch.dict("os.environ", {"OUTPUT_SHAPE": "narrow"}),
+        pytest.raises(ValueError, match="Unknown output shape: narrow"),
+    ):
+        output_shape_from_env()
+
+
+# Dedup key columns tests
+
+
+def test_pass_dedup_key_columns_for_schema_given_long_schema_adds_reading_name():
+    schema = pa.schema([("timestamp", pa.string()), ("dataAsset", pa.string()), ("reading_name", pa.string())])
+
+    assert dedup_key_columns_for_schema(["dataAsset", "timestamp"], schema) == [
+        "dataAsset",
+        "timestamp",
+        "reading_name",
+    ]
+    assert dedup_key_columns_for_schema([], schema) == []
@@ -1,12 +1,19 @@
-import pytest
-import tempfile
+import io
+import json
 import os
-import pandas as pd
+import tempfile
+from unittest.mock import ANY, MagicMock, patch
 
-from tests.factories import build_parquet_dataframe, dump_parquet_file
-from unittest.mock import MagicMock, patch
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from botocore.exceptions import ClientError
 
-from lambda_processing.parquet_files_processor import lambda_handler, chunked_parquet_key_parts
+from lambda_processing.files_processor import dump_to_parquet
+from lambda_processing.parquet_files_processor import chunked_parquet_key_parts, lambda_handler
+from lambda_processing.upload_ledger import S3UploadLedger
+from tests.factories import build_data_asset, build_parquet_dataframe, dump_parquet_file
+from tests.fake_s3 import FakeS3Client, serve_local_files
 
 PARQUET_FILES_BUCKET_NAME = "s3silver-bucket"
 
@@ -32,8 +39,7 @@ def test_pass_lambda_handler_given_no_files_returns_empty_list():
 
 
 def test_pass_lambda_handler_given_cunked_parquet_files_downloads_them_from_s3(temp_dir):
-    mock_s3_client = MagicMock()
-    mock_s3_client.download_file.return_value = None
+    mock_s3_client = build_source_files_s3_client(temp_dir)
     file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/jupiter/2024-01-01T13_30m-90147479.parquet/part-0.parquet"
     file2 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
     file3 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_45m-90147479.parquet/part-0.parquet"
@@ -57,8 +63,7 @@ def test_pass_lambda_handler_given_cunked_parquet_files_downloads_them_from_s3(t
 
 
 def test_pass_lambda_handler_given_chunked_parquet_files_assembles_them_into_daily_parquet(temp_dir):
-    mock_s3_client = MagicMock()
-    mock_s3_client.download_file.return_value = None
+    mock_s3_client = build_source_files_s3_client(temp_dir)
     file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
     file2 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_45m-90147479.parquet/part-0.parquet"
     file_list = [[file1], [file2]]
@@ -86,8 +91,7 @@ def test_pass_lambda_handler_given_chunked_parquet_files_assembles_them_into_dai
 
 
 def test_pass_lambda_handler_given_chunked_parquet_files_assembles_them_by_job_product_day(temp_dir):
-    mock_s3_client = MagicMock()
-    mock_s3_client.download_file.return_value = None
+    mock_s3_client = build_source_files_s3_client(temp_dir)
     file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
     file2 = "15min_chunks/job_d263ab3a-d452-4c10-9c80-80d554307d9f/medallion-lakehouse-s3bronze/jupiter/2024-09-30T12_15m-90147479.parquet/part-0.parquet"
     file_list = [[file1], [file2]]
@@ -111,8 +115,7 @@ def test_pass_lambda_handler_given_chunked_parquet_files_assembles_them_by_job_p
 
 
 def test_pass_lambda_handler_given_chunked_parquet_files_uploads_assembled_daily_parquet_to_s3(temp_dir):
-    mock_s3_client = MagicMock()
-    mock_s3_client.download_file.return_value = None
+    mock_s3_client = build_source_files_s3_client(temp_dir)
     file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
     file2 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_45m-90147479.parquet/part-0.parquet"
     file_list = [[file1], [file2]]
@@ -132,13 +135,14 @@ def test_pass_lambda_handler_given_chunked_parquet_files_uploads_assembled_daily
         "daily_files/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.41780824-ac46-4b25-9547-a53607b4f37a.snappy.parquet/part-0.parquet",
     )
     file_key = "job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.41780824-ac46-4b25-9547-a53607b4f37a.snappy.parquet/part-0.parquet"
-    mock_s3_client.upload_file.assert_called_once_with(daily_file_path, PARQUET_FILES_BUCKET_NAME, file_key)
+    mock_s3_client.upload_file.assert_called_once_with(
+        daily_file_path, PARQUET_FILES_BUCKET_NAME, file_key, ExtraArgs=ANY
+    )
     assert uploaded_files == [file_key]
 
 
 def test_pass_lambda_handler_given_chunked_parquet_files_removes_source_and_daily_files(temp_dir):
-    mock_s3_client = MagicMock()
-    mock_s3_client.download_file.return_value = None
+    mock_s3_client = build_source_files_s3_client(temp_dir)
     file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
     file_list = [[file1]]
     # Put files in place as they would be downloaded
@@ -150,6 +154,453 @@ def test_pass_lambda_handler_given_chunked_parquet_files_removes_source_and_dail
     assert not os.path.exists(os.path.join(temp_dir, "daily_files"))
 
 
+def test_pass_lambda_handler_given_files_processor_result_with_unprocessed_keys_assembles_its_chunk_keys(temp_dir):
+    mock_s3_client = build_source_files_s3_client(temp_dir)
+    file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    file2 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_45m-90147479.parquet/part-0.parquet"
+    dump_source_files(temp_dir, [(file1, build_parquet_dataframe()), (file2, build_parquet_dataframe())])
+
+    lambda_handler([[file1], {"chunk_keys": [file2], "unprocessed_keys": ["raw-2.json"]}], {}, mock_s3_client, temp_dir)
+
+    assert mock_s3_client.download_file.call_count == 2
+
+
+def test_pass_lambda_handler_given_files_processor_result_with_chunk_manifest_assembles_its_chunk_keys(temp_dir):
+    file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    file2 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_45m-90147479.parquet/part-0.parquet"
+    dump_source_files(
+        temp_dir,
+        [(file1, build_parquet_dataframe(iotreadings_count=2)), (file2, build_parquet_dataframe(iotreadings_count=2))],
+    )
+    mock_s3_client = build_manifest_s3_client(temp_dir, {"chunk_keys": [file1, file2]})
+
+    lambda_handler([{"chunk_manifest_key": "_chunk_manifests/90147479.json"}], {}, mock_s3_client, temp_dir)
+
+    mock_s3_client.get_object.assert_any_call(Bucket=PARQUET_FILES_BUCKET_NAME, Key="_chunk_manifests/90147479.json")
+    assert mock_s3_client.download_file.call_count == 2
+
+
+def test_pass_lambda_handler_given_dedup_key_columns_drops_repeated_readings_from_daily_parquet(temp_dir):
+    mock_s3_client = build_source_files_s3_client(temp_dir)
+    file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    file2 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-11111111.parquet/part-0.parquet"
+    reading = {"timestamp": "2023-04-01T13:20:00.000Z", "dataAsset": "mars"}
+    dump_source_files(
+        temp_dir,
+        [
+            (file1, build_parquet_dataframe(**reading, iotreadings_count=2, iotreadings_value1=1)),
+            (file2, build_parquet_dataframe(**reading, iotreadings_count=2, iotreadings_value1=2)),
+        ],
+    )
+
+    lambda_handler(
+        [[file1], [file2]],
+        {},
+        mock_s3_client,
+        temp_dir,
+        cleanup_on_finish=False,
+        dedup_key_columns=["dataAsset", "timestamp"],
+        dedup_keep="last",
+    )
+
+    daily_file_path = os.path.join(
+        temp_dir,
+        "daily_files/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.41780824-ac46-4b25-9547-a53607b4f37a.snappy.parquet",
+    )
+    df = pd.read_parquet(daily_file_path)
+    assert df.shape[0] == 1
+    assert df.iloc[0]["iotreadings_value1"] == 2
+
+
+def test_pass_lambda_handler_given_append_mode_and_no_manifest_writes_daily_parts_and_manifest(temp_dir):
+    mock_s3_client = build_manifest_s3_client(temp_dir)
+    file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    dump_source_files(temp_dir, [(file1, build_parquet_dataframe())])
+
+    uploaded_files = lambda_handler([[file1]], {}, mock_s3_client, temp_dir, merge_mode="append")
+
+    daily_key = "job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.41780824-ac46-4b25-9547-a53607b4f37a"
+    part_key = f"{daily_key}.snappy.parquet/part-0-0.parquet"
+    assert uploaded_files == [part_key]
+    mock_s3_client.put_object.assert_called_once_with(
+        Bucket=PARQUET_FILES_BUCKET_NAME,
+        Key=f"{daily_key}.manifest.json",
+        Body=json.dumps({"chunks": [file1], "parts": [part_key], "generation": 1}).encode("utf-8"),
+    )
+
+
+def test_pass_lambda_handler_given_append_mode_and_manifest_appends_only_new_chunks(temp_dir):
+    file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    file2 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_45m-11111111.parquet/part-0.parquet"
+    daily_key = "job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.41780824-ac46-4b25-9547-a53607b4f37a"
+    mock_s3_client = build_manifest_s3_client(
+        temp_dir, {"chunks": [file1], "parts": [f"{daily_key}.snappy.parquet/part-0-0.parquet"], "generation": 1}
+    )
+    dump_source_files(temp_dir, [(file1, build_parquet_dataframe()), (file2, build_parquet_dataframe())])
+
+    uploaded_files = lambda_handler([[file1, file2]], {}, mock_s3_client, temp_dir, merge_mode="append")
+
+    mock_s3_client.download_file.assert_called_once_with(
+        PARQUET_FILES_BUCKET_NAME, file2, os.path.join(temp_dir, "source_files", file2)
+    )
+    assert uploaded_files == [f"{daily_key}.snappy.parquet/part-1-0.parquet"]
+    manifest = json.loads(mock_s3_client.put_object.call_args.kwargs["Body"])
+    assert manifest["chunks"] == [file1, file2]
+    assert manifest["generation"] == 2
+
+
+def test_pass_lambda_handler_given_append_mode_and_all_chunks_in_manifest_skips_daily_file(temp_dir):
+    file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    mock_s3_client = build_manifest_s3_client(temp_dir, {"chunks": [file1], "parts": [], "generation": 1})
+
+    uploaded_files = lambda_handler([[file1]], {}, mock_s3_client, temp_dir, merge_mode="append")
+
+    assert uploaded_files == []
+    assert mock_s3_client.download_file.call_count == 0
+    assert mock_s3_client.put_object.call_count == 0
+
+
+def test_pass_lambda_handler_given_hive_layout_uploads_daily_parquet_under_product_and_date_partitions(temp_dir):
+    mock_s3_client = build_source_files_s3_client(temp_dir)
+    file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    dump_source_files(temp_dir, [(file1, build_parquet_dataframe())])
+
+    uploaded_files = lambda_handler([[file1]], {}, mock_s3_client, temp_dir, layout="hive")
+
+    assert uploaded_files == [
+        "job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/product=mars/date=2023-04-01/2023-04-01.41780824-ac46-4b25-9547-a53607b4f37a.snappy.parquet/part-0.parquet"
+    ]
+
+
+def test_pass_lambda_handler_given_write_job_manifest_merges_daily_files_stats_into_job_manifest(temp_dir):
+    existing_entry = {
+        "key": "job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/jupiter/2023/03/31/2023-03-31.41780824-ac46-4b25-9547-a53607b4f37a.snappy.parquet/part-0.parquet",
+        "product": "jupiter",
+    }
+    mock_s3_client = build_manifest_s3_client(
+        temp_dir, {"job_id": "41780824-ac46-4b25-9547-a53607b4f37a", "files": [existing_entry]}
+    )
+    file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    file2 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_45m-90147479.parquet/part-0.parquet"
+    dump_source_files(
+        temp_dir,
+        [
+            (file1, build_parquet_dataframe(timestamp="2023-04-01T13:20:00.000Z", dataAsset="mars")),
+            (file2, build_parquet_dataframe(timestamp="2023-04-01T13:40:00.000Z", dataAsset="mars")),
+        ],
+    )
+
+    lambda_handler([[file1, file2]], {}, mock_s3_client, temp_dir, write_job_manifest=True)
+
+    mock_s3_client.get_object.assert_any_call(
+        Bucket=PARQUET_FILES_BUCKET_NAME, Key="job_41780824-ac46-4b25-9547-a53607b4f37a/_manifest.json"
+    )
+    manifest = json.loads(mock_s3_client.put_object.call_args.kwargs["Body"])
+    assert manifest["files"][0] == existing_entry
+    new_entry = manifest["files"][1]
+    assert new_entry["key"] == (
+        "job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.41780824-ac46-4b25-9547-a53607b4f37a.snappy.parquet/part-0.parquet"
+    )
+    assert new_entry["product"] == "mars"
+    assert new_entry["date"] == "2023-04-01"
+    assert new_entry["rows"] == 2
+    assert new_entry["min_timestamp"] == "2023-04-01T13:20:00.000Z"
+    assert new_entry["max_timestamp"] == "2023-04-01T13:40:00.000Z"
+
+
+def test_pass_lambda_handler_given_write_rollups_uploads_15min_and_hourly_rollups_next_to_daily_parquet(temp_dir):
+    mock_s3_client = build_source_files_s3_client(temp_dir)
+    file1 = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    dump_source_files(
+        temp_dir,
+        [
+            (
+                file1,
+                build_parquet_dataframe(
+                    timestamp="2023-04-01T13:20:00.000Z", iotreadings_count=2, iotreadings_value1=5
+                ),
+            )
+        ],
+    )
+
+    uploaded_files = lambda_handler(
+        [[file1]], {}, mock_s3_client, temp_dir, cleanup_on_finish=False, write_rollups=True
+    )
+
+    daily_key = "job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.41780824-ac46-4b25-9547-a53607b4f37a"
+    assert uploaded_files == [
+        f"{daily_key}.snappy.parquet/part-0.parquet",
+        f"{daily_key}.rollup_15min.snappy.parquet/part-0.parquet",
+        f"{daily_key}.rollup_1h.snappy.parquet/part-0.parquet",
+    ]
+    rollup_df = pd.read_parquet(os.path.join(temp_dir, "daily_files", f"{daily_key}.rollup_15min.snappy.parquet"))
+    assert rollup_df.iloc[0]["iotreadings_value1_max"] == 5
+    assert rollup_df.iloc[0]["iotreadings_value1_count"] == 1
+
+
+@pytest.mark.parametrize("chunk_format", ["arrow", "arrow_lz4"])
+def test_pass_lambda_handler_given_arrow_chunks_assembles_them_into_daily_parquet(temp_dir, chunk_format):
+    job_id = "41780824-ac46-4b25-9547-a53607b4f37a"
+    source_files_path = os.path.join(temp_dir, "source_files")
+    data_assets = [
+        build_data_asset(dataAsset="mars", timestamp="2023-04-01T13:20:01.000Z", iotreadings={"value1": 1}),
+        build_data_asset(dataAsset="mars", timestamp="2023-04-01T13:40:01.000Z", iotreadings={"value2": 2.5}),
+    ]
+    chunk_paths = dump_to_parquet(
+        data_assets,
+        os.path.join(source_files_path, f"15min_chunks/job_{job_id}/medallion-lakehouse-s3bronze"),
+        "90147479",
+        chunk_format=chunk_format,
+    )
+    chunk_keys = [os.path.relpath(os.path.join(path, "part-0.arrow"), source_files_path) for path in chunk_paths]
+
+    lambda_handler([chunk_keys], {}, build_source_files_s3_client(temp_dir), temp_dir, cleanup_on_finish=False)
+
+    daily_file_path = os.path.join(
+        temp_dir,
+        f"daily_files/job_{job_id}/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.{job_id}.snappy.parquet",
+    )
+    df = pd.read_parquet(daily_file_path)
+    assert df["timestamp"].tolist() == ["2023-04-01T13:20:01.000Z", "2023-04-01T13:40:01.000Z"]
+    assert df["iotreadings_value1"].tolist()[0] == 1
+    assert df["iotreadings_value2"].tolist()[1] == 2.5
+
+
+def test_pass_lambda_handler_given_late_chunks_merges_them_into_one_late_part_sorted_by_time(temp_dir):
+    mock_s3_client = build_source_files_s3_client(temp_dir)
+    chunk_prefix = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars"
+    late_file1 = f"{chunk_prefix}/2023-04-01T_late-90147479.parquet/part-0.parquet"
+    late_file2 = f"{chunk_prefix}/2023-04-01T_late-11111111.parquet/part-0.parquet"
+    file3 = f"{chunk_prefix}/2023-04-02T13_30m-11111111.parquet/part-0.parquet"
+    dump_source_files(
+        temp_dir,
+        [
+            (
+                late_file1,
+                build_parquet_dataframe(timestamp="2023-04-01T18:00:00Z", iotreadings_count=2, iotreadings_value1=1),
+            ),
+            (
+                late_file2,
+                build_parquet_dataframe(timestamp="2023-04-01T06:00:00Z", iotreadings_count=2, iotreadings_value1=2),
+            ),
+            (
+                file3,
+                build_parquet_dataframe(timestamp="2023-04-02T13:20:00Z", iotreadings_count=2, iotreadings_value1=3),
+            ),
+        ],
+    )
+
+    uploaded_files = lambda_handler([[late_file1], [late_file2, file3]], {}, mock_s3_client, temp_dir, False)
+
+    daily_key = "job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.41780824-ac46-4b25-9547-a53607b4f37a.snappy.parquet"
+    late_parts = [key for key in uploaded_files if key.startswith(daily_key)]
+    assert len(late_parts) == 1
+    assert os.path.basename(late_parts[0]).startswith("late-")
+    assert not os.path.exists(os.path.join(temp_dir, "daily_files", daily_key))
+    late_part = pd.read_parquet(os.path.join(temp_dir, "late_daily_files", late_parts[0]))
+    assert late_part["iotreadings_value1"].tolist() == [2, 1]
+    assert any("/2023/04/02/" in key for key in uploaded_files)
+
+
+@pytest.mark.parametrize("values", [(1, 2.5), (2.5, 1)])
+def test_pass_lambda_handler_given_int_and_double_chunks_of_same_reading_assembles_it_as_double(temp_dir, values):
+    mock_s3_client = build_source_files_s3_client(temp_dir)
+    chunk_prefix = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars"
+    file1 = f"{chunk_prefix}/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    file2 = f"{chunk_prefix}/2023-04-01T13_45m-90147479.parquet/part-0.parquet"
+    dump_source_files(
+        temp_dir,
+        [
+            (file1, pd.DataFrame([{"timestamp": "2023-04-01T13:20:01.000Z", "iotreadings_x": values[0]}])),
+            (file2, pd.DataFrame([{"timestamp": "2023-04-01T13:40:01.000Z", "iotreadings_x": values[1]}])),
+        ],
+    )
+
+    lambda_handler([[file1, file2]], {}, mock_s3_client, temp_dir, cleanup_on_finish=False)
+
+    daily_file_path = os.path.join(
+        temp_dir,
+        "daily_files/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars/2023/04/01/2023-04-01.41780824-ac46-4b25-9547-a53607b4f37a.snappy.parquet",
+    )
+    df = pd.read_parquet(daily_file_path)
+    assert str(df["iotreadings_x"].dtype) == "float64"
+    assert df["iotreadings_x"].tolist() == [float(value) for value in values]
+
+
+@pytest.mark.parametrize("values", [(1, 2.5), (2.5, 1)])
+def test_pass_lambda_handler_given_int_and_double_late_chunks_of_same_reading_merges_it_as_double(temp_dir, values):
+    mock_s3_client = build_source_files_s3_client(temp_dir)
+    chunk_prefix = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars"
+    late_file1 = f"{chunk_prefix}/2023-04-01T_late-90147479.parquet/part-0.parquet"
+    late_file2 = f"{chunk_prefix}/2023-04-01T_late-11111111.parquet/part-0.parquet"
+    dump_source_files(
+        temp_dir,
+        [
+            (late_file1, pd.DataFrame([{"timestamp": "2023-04-01T06:00:00Z", "iotreadings_x": values[0]}])),
+            (late_file2, pd.DataFrame([{"timestamp": "2023-04-01T18:00:00Z", "iotreadings_x": values[1]}])),
+        ],
+    )
+
+    uploaded_files = lambda_handler([[late_file1, late_file2]], {}, mock_s3_client, temp_dir, False)
+
+    late_part = pd.read_parquet(os.path.join(temp_dir, "late_daily_files", uploaded_files[0]))
+    assert str(late_part["iotreadings_x"].dtype) == "float64"
+    assert late_part["iotreadings_x"].tolist() == [float(value) for value in values]
+
+
+def test_pass_lambda_handler_given_append_mode_and_merged_late_chunks_skips_them(temp_dir):
+    chunk_prefix = "15min_chunks/job_41780824-ac46-4b25-9547-a53607b4f37a/medallion-lakehouse-s3bronze/mars"
+    late_file1 = f"{chunk_prefix}/2023-04-01T_late-90147479.parquet/part-0.parquet"
+    mock_s3_client = build_manifest_s3_client(temp_dir, {"chunks": [late_file1], "parts": [], "generation": 1})
+
+    uploaded_files = lambda_handler([[late_file1]], {}, mock_s3_client, temp_dir, merge_mode="append")
+
+    assert uploaded_files == []
+    assert mock_s3_client.download_file.call_count == 0
+    assert mock_s3_client.put_object.call_count == 0
+
+
+def test_pass_lambda_handler_given_delete_consumed_chunks_deletes_them_after_daily_upload(temp_dir, capfd):
+    s3_client = FakeS3Client()
+    chunk_prefix = "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars"
+    keys = [f"{chunk_prefix}/2023-04-01T13_{quarter}m-90147479.parquet/part-0.parquet" for quarter in (30, 45)]
+    for key in keys:
+        s3_client.put(PARQUET_FILES_BUCKET_NAME, key, parquet_bytes(build_parquet_dataframe()))
+
+    uploaded_files = lambda_handler([keys], {}, s3_client, temp_dir, merge_mode="append", delete_consumed_chunks=True)
+
+    assert s3_client.keys(PARQUET_FILES_BUCKET_NAME, "15min_chunks/") == []
+    assert [key for key in s3_client.keys(PARQUET_FILES_BUCKET_NAME, "job_1001/") if key.endswith(".parquet")] == (
+        uploaded_files
+    )
+    assert s3_client.requests["delete_objects"] == 1
+    assert "Deleted 2 consumed chunks with 1 DeleteObjects requests" in capfd.readouterr().out
+
+
+def test_pass_lambda_handler_given_delete_consumed_chunks_and_failed_daily_upload_keeps_chunks(temp_dir):
+    s3_client = FakeS3Client()
+    key = "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    s3_client.put(PARQUET_FILES_BUCKET_NAME, key, parquet_bytes(build_parquet_dataframe()))
+    s3_client.upload_file = MagicMock(side_effect=ClientError({"Error": {"Code": "AccessDenied"}}, "PutObject"))
+
+    with pytest.raises(ClientError):
+        lambda_handler([[key]], {}, s3_client, temp_dir, merge_mode="append", delete_consumed_chunks=True)
+
+    assert s3_client.keys(PARQUET_FILES_BUCKET_NAME, "15min_chunks/") == [key]
+    assert s3_client.requests["delete_objects"] == 0
+
+
+def test_fail_lambda_handler_given_delete_consumed_chunks_in_overwrite_mode_keeps_chunks_for_next_batches(temp_dir):
+    s3_client = FakeS3Client()
+    chunk_prefix = "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars"
+    keys = [f"{chunk_prefix}/2023-04-01T13_{quarter}m-90147479.parquet/part-0.parquet" for quarter in (30, 45)]
+    for key in keys:
+        s3_client.put(PARQUET_FILES_BUCKET_NAME, key, parquet_bytes(build_parquet_dataframe()))
+
+    with pytest.raises(ValueError, match="append"):
+        lambda_handler([keys[:1]], {}, s3_client, temp_dir, merge_mode="overwrite", delete_consumed_chunks=True)
+
+    assert s3_client.keys(PARQUET_FILES_BUCKET_NAME, "15min_chunks/") == keys
+    assert s3_client.requests["delete_objects"] == 0
+
+
+def test_pass_lambda_handler_given_delete_consumed_chunks_and_second_batch_for_same_day_keeps_both_batches(temp_dir):
+    s3_client = FakeS3Client()
+    chunk_prefix = "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars"
+    keys = [f"{chunk_prefix}/2023-04-01T13_{quarter}m-90147479.parquet/part-0.parquet" for quarter in (30, 45)]
+    for index, key in enumerate(keys):
+        dataframe = build_parquet_dataframe(timestamp=f"2023-04-01T13:{20 + index * 15}:00Z", iotreadings_count=2)
+        s3_client.put(PARQUET_FILES_BUCKET_NAME, key, parquet_bytes(dataframe))
+
+    first_files = lambda_handler([keys[:1]], {}, s3_client, temp_dir, merge_mode="append", delete_consumed_chunks=True)
+    second_files = lambda_handler([keys[1:]], {}, s3_client, temp_dir, merge_mode="append", delete_consumed_chunks=True)
+
+    assert s3_client.keys(PARQUET_FILES_BUCKET_NAME, "15min_chunks/") == []
+    daily_rows = sum(
+        pq.read_metadata(io.BytesIO(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, key)])).num_rows
+        for key in first_files + second_files
+    )
+    assert daily_rows == 2
+
+
+def test_pass_lambda_handler_given_day_of_many_windows_keeps_chunks_of_two_windows_on_disk_at_most(temp_dir):
+    s3_client = FakeS3Client()
+    source_files_path = os.path.join(temp_dir, "source_files")
+    chunk_prefix = "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars"
+    keys = [
+        f"{chunk_prefix}/2023-04-01T{hour:02}_{quarter}m-90147479.parquet/part-0.parquet"
+        for hour in range(3)
+        for quarter in (15, 30, 45, 60)
+    ]
+    for index, key in enumerate(keys):
+        dataframe = build_parquet_dataframe(dataAsset=f"asset-{index}", iotreadings_count=2)
+        s3_client.put(PARQUET_FILES_BUCKET_NAME, key, parquet_bytes(dataframe))
+    chunks_on_disk = []
+    download_file = s3_client.download_file
+
+    def count_chunks_on_disk(Bucket, Key, Filename, **kwargs):
+        download_file(Bucket, Key, Filename, **kwargs)
+        chunks_on_disk.append(sum(len(files) for _root, _dirs, files in os.walk(source_files_path)))
+
+    s3_client.download_file = count_chunks_on_disk
+    uploaded_files = lambda_handler([keys], {}, s3_client, temp_dir, dedup_key_columns=["dataAsset"])
+
+    # Without timestamp in the key, every window is downloaded for its key columns first, then for its rows
+    assert len(chunks_on_disk) == 2 * len(keys)
+    assert max(chunks_on_disk) <= 2
+    daily = pq.read_table(io.BytesIO(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, uploaded_files[0])]))
+    assert daily.num_rows == len(keys)
+
+
+@patch("lambda_processing.parquet_files_processor.CHUNK_FOOTER_READ_BYTES", 16)
+def test_pass_lambda_handler_given_chunk_footer_larger_than_footer_read_fetches_rest_of_it(temp_dir):
+    s3_client = FakeS3Client()
+    key = "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars/2023-04-01T13_30m-90147479.parquet/part-0.parquet"
+    s3_client.put(PARQUET_FILES_BUCKET_NAME, key, parquet_bytes(build_parquet_dataframe(iotreadings_count=2)))
+
+    uploaded_files = lambda_handler([[key]], {}, s3_client, temp_dir)
+
+    assert s3_client.requests["get_object"] == 2
+    daily = pq.read_table(io.BytesIO(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, uploaded_files[0])]))
+    assert "iotreadings_value1" in daily.column_names
+
+
+def test_pass_lambda_handler_given_upload_ledger_of_failed_execution_uploads_only_missing_daily_files(temp_dir):
+    s3_client = FakeS3Client()
+    chunk_prefix = "15min_chunks/job_1001/medallion-lakehouse-s3bronze/mars"
+    keys = [f"{chunk_prefix}/2023-04-0{day}T13_30m-90147479.parquet/part-0.parquet" for day in (1, 2)]
+    for key in keys:
+        s3_client.put(PARQUET_FILES_BUCKET_NAME, key, parquet_bytes(build_parquet_dataframe()))
+    upload_file = s3_client.upload_file
+
+    def deny_second_day(Filename, Bucket, Key, **kwargs):
+        if "/2023/04/02/" in Key:
+            raise ClientError({"Error": {"Code": "AccessDenied"}}, "PutObject")
+        return upload_file(Filename, Bucket, Key, **kwargs)
+
+    s3_client.upload_file = deny_second_day
+    with pytest.raises(ClientError):
+        lambda_handler([keys], {}, s3_client, temp_dir, upload_ledger=upload_ledger(s3_client))
+    s3_client.upload_file = upload_file
+    s3_client.requests.clear()
+
+    uploaded_files = lambda_handler([keys], {}, s3_client, temp_dir, upload_ledger=upload_ledger(s3_client))
+
+    assert s3_client.requests["upload_file"] == 1
+    assert s3_client.keys(PARQUET_FILES_BUCKET_NAME, "job_1001/") == uploaded_files
+    assert s3_client.keys(PARQUET_FILES_BUCKET_NAME, "_ledger/") == []
+
+
+def test_fail_lambda_handler_given_unknown_layout():
+    with pytest.raises(ValueError, match="Unknown daily files layout: flat"):
+        lambda_handler([], {}, MagicMock(), layout="flat")
+
+
+def test_fail_lambda_handler_given_unknown_merge_mode():
+    with pytest.raises(ValueError, match="Unknown daily files merge mode: merge"):
+        lambda_handler([], {}, MagicMock(), merge_mode="merge")
+
+
 # Chunked parquet key parts tests
 
 
@@ -166,6 +617,41 @@ def test_pass_chunked_parquet_key_parts_given_parquet_file_key_returns_job_bucke
 # Helper
 
 
+def build_source_files_s3_client(temp_dir):
+    # Chunk footers are read from the files put in place as they would be downloaded
+    mock_s3_client = serve_local_files(MagicMock(), os.path.join(temp_dir, "source_files"))
+    mock_s3_client.download_file.return_value = None
+    return mock_s3_client
+
+
+def build_manifest_s3_client(temp_dir, manifest=None):
+    # Every JSON object is the given manifest, or doesn't exist without it
+    mock_s3_client = build_source_files_s3_client(temp_dir)
+    get_chunk_object = mock_s3_client.get_object.side_effect
+
+    def get_object(Bucket, Key, **kwargs):
+        if not Key.endswith(".json"):
+            return get_chunk_object(Bucket=Bucket, Key=Key, **kwargs)
+        if manifest is None:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(json.dumps(manifest).encode("utf-8"))}
+
+    mock_s3_client.get_object.side_effect = get_object
+    return mock_s3_client
+
+
+def upload_ledger(s3_client):
+    return S3UploadLedger(
+        s3_client, PARQUET_FILES_BUCKET_NAME, "parquet_files_processor/run-1", checkpoint_interval_seconds=0
+    )
+
+
+def parquet_bytes(df):
+    buffer = io.BytesIO()
+    df.to_parquet(buffer)
+    return buffer.getvalue()
+
+
 def dump_source_files(temp_dir, file_dataframe_pairs):
     source_files_path = os.path.join(temp_dir, "source_files")
     for file_path, df in file_dataframe_pairs:
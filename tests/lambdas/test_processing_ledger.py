@@ -0,0 +1,132 @@
+import io
+import json
+import os
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from lambda_processing.processing_ledger import (
+    LocalProcessingLedger,
+    S3ProcessingLedger,
+    deterministic_invocation_id,
+    processing_ledger_from_env,
+    source_chunk_id,
+)
+
+SOURCE_KEY = "2024/10/03/job_842d6e1c-0630-4af8-a3e1-8d18a24ce805/raw-1.json"
+CHUNK_KEY = "15min_chunks/job_842d6e1c-0630-4af8-a3e1-8d18a24ce805/s3bronze-bucket/mars/2024-09-30T13_45m-3fde7b3b.parquet/part-0.parquet"
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+# Local ledger tests
+
+
+def test_pass_local_ledger_given_recorded_file_version_returns_chunk_keys(temp_dir):
+    ledger = LocalProcessingLedger(os.path.join(temp_dir, "ledger.json"))
+
+    ledger.put(SOURCE_KEY, "etag-1", [CHUNK_KEY])
+
+    assert ledger.get(SOURCE_KEY, "etag-1") == [CHUNK_KEY]
+    assert LocalProcessingLedger(os.path.join(temp_dir, "ledger.json")).get(SOURCE_KEY, "etag-1") == [CHUNK_KEY]
+
+
+def test_pass_local_ledger_given_changed_etag_returns_none(temp_dir):
+    ledger = LocalProcessingLedger(os.path.join(temp_dir, "ledger.json"))
+
+    ledger.put(SOURCE_KEY, "etag-1", [CHUNK_KEY])
+
+    assert ledger.get(SOURCE_KEY, "etag-2") is None
+
+
+# S3 ledger tests
+
+
+def test_pass_s3_ledger_given_missing_entry_returns_none():
+    mock_s3_client = MagicMock()
+    mock_s3_client.get_object.side_effect = ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+
+    assert S3ProcessingLedger(mock_s3_client, "s3silver-bucket").get(SOURCE_KEY, "etag-1") is None
+
+
+def test_pass_s3_ledger_given_recorded_entry_returns_chunk_keys():
+    mock_s3_client = MagicMock()
+    entry = {"source_key": SOURCE_KEY, "etag": "etag-1", "chunk_keys": [CHUNK_KEY]}
+    mock_s3_client.get_object.return_value = {"Body": io.BytesIO(json.dumps(entry).encode("utf-8"))}
+    ledger = S3ProcessingLedger(mock_s3_client, "s3silver-bucket")
+
+    assert ledger.get(SOURCE_KEY, "etag-1") == [CHUNK_KEY]
+    mock_s3_client.get_object.assert_called_once_with(
+        Bucket="s3silver-bucket", Key=ledger.entry_key(SOURCE_KEY, "etag-1")
+    )
+
+
+def test_fail_s3_ledger_given_access_denied():
+    mock_s3_client = MagicMock()
+    mock_s3_client.get_object.side_effect = ClientError({"Error": {"Code": "AccessDenied"}}, "GetObject")
+
+    with pytest.raises(ClientError):
+        S3ProcessingLedger(mock_s3_client, "s3silver-bucket").get(SOURCE_KEY, "etag-1")
+
+
+def test_pass_s3_ledger_put_writes_entry_under_ledger_prefix():
+    mock_s3_client = MagicMock()
+    ledger = S3ProcessingLedger(mock_s3_client, "s3silver-bucket")
+
+    ledger.put(SOURCE_KEY, "etag-1", [CHUNK_KEY])
+
+    key = mock_s3_client.put_object.call_args.kwargs["Key"]
+    assert key.startswith("_ledger/files_processor/")
+    assert json.loads(mock_s3_client.put_object.call_args.kwargs["Body"])["chunk_keys"] == [CHUNK_KEY]
+
+
+# Invocation id tests
+
+
+def test_pass_deterministic_invocation_id_given_same_file_versions_in_any_order_returns_same_id():
+    first = deterministic_invocation_id([("raw-1.json", "etag-1"), ("raw-2.json", "etag-2")])
+    second = deterministic_invocation_id([("raw-2.json", "etag-2"), ("raw-1.json", "etag-1")])
+    changed = deterministic_invocation_id([("raw-1.json", "etag-3"), ("raw-2.json", "etag-2")])
+
+    assert first == second
+    assert first != changed
+    assert len(first) == 8
+
+
+def test_pass_source_chunk_id_given_file_version_returns_id_of_that_version_only():
+    first = source_chunk_id("raw-1.json", "etag-1")
+
+    assert first == source_chunk_id("raw-1.json", "etag-1")
+    assert first != source_chunk_id("raw-1.json", "etag-2")
+    assert first != source_chunk_id("raw-2.json", "etag-1")
+    assert len(first) == 8
+
+
+# Settings tests
+
+
+def test_pass_processing_ledger_from_env_given_no_variable_returns_none():
+    with patch.dict("os.environ", {}, clear=True):
+        assert processing_ledger_from_env(MagicMock()) is None
+
+
+def test_pass_processing_ledger_from_env_given_s3_returns_ledger_in_parquet_files_bucket():
+    with patch.dict("os.environ", {"PROCESSING_LEDGER": "s3", "PARQUET_FILES_BUCKET_NAME": "s3silver-bucket"}):
+        ledger = processing_ledger_from_env(MagicMock())
+
+    assert isinstance(ledger, S3ProcessingLedger)
+    assert ledger.bucket == "s3silver-bucket"
+
+
+def test_fail_processing_ledger_from_env_given_unknown_ledger():
+    with (
+        patch.dict("os.environ", {"PROCESSING_LEDGER": "dynamodb"}),
+        pytest.raises(ValueError, match="Unknown processing ledger: dynamodb"),
+    ):
+        processing_ledger_from_env(MagicMock())
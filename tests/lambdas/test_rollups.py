@@ -0,0 +1,103 @@
+import pyarrow as pa
+
+from lambda_processing.output_shapes import long_table_from_assets
+from lambda_processing.rollups import build_rollup, build_rollup_from_batches, parse_timestamps
+
+# Build rollup tests
+
+
+def test_pass_build_rollup_given_readings_returns_stats_per_interval():
+    table = pa.table(
+        {
+            "timestamp": [
+                "2024-09-30T13:01:00.000Z",
+                "2024-09-30T13:14:59.000Z",
+                "2024-09-30T13:15:00.000Z",
+                "2024-09-30T14:20:00.000Z",
+            ],
+            "dataAsset": ["mars"] * 4,
+            "iotreadings_value1": [1, 3, 10, 7],
+            "iotreadings_value2": [None, 2.5, None, None],
+        }
+    )
+
+    rollup = build_rollup(table, 15).to_pylist()
+
+    assert [row["interval_start"].isoformat() for row in rollup] == [
+        "2024-09-30T13:00:00+00:00",
+        "2024-09-30T13:15:00+00:00",
+        "2024-09-30T14:15:00+00:00",
+    ]
+    first = rollup[0]
+    assert (first["iotreadings_value1_min"], first["iotreadings_value1_max"]) == (1, 3)
+    assert (first["iotreadings_value1_mean"], first["iotreadings_value1_count"]) == (2.0, 2)
+    assert first["iotreadings_value1_sum"] == 4
+    assert (first["iotreadings_value2_count"], first["iotreadings_value2_mean"]) == (1, 2.5)
+
+
+def test_pass_build_rollup_given_hour_interval_groups_readings_by_hour():
+    table = pa.table(
+        {
+            "timestamp": ["2024-09-30T13:01:00.000Z", "2024-09-30T13:59:00.000Z", "2024-09-30T14:00:00.000Z"],
+            "iotreadings_value1": [1, 2, 3],
+        }
+    )
+
+    rollup = build_rollup(table, 60)
+
+    assert rollup["iotreadings_value1_count"].to_pylist() == [2, 1]
+
+
+def test_pass_build_rollup_skips_non_numeric_readings():
+    table = pa.table({"timestamp": ["2024-09-30T13:01:00.000Z"], "iotreadings_state": ["on"]})
+
+    assert build_rollup(table, 15).column_names == ["interval_start"]
+
+
+def test_pass_build_rollup_given_long_table_returns_stats_per_interval_and_reading_name():
+    table = long_table_from_assets(
+        [
+            {"timestamp": "2024-09-30T13:01:00.000Z", "iotreadings_b": 1, "iotreadings_a": 2.5},
+            {"timestamp": "2024-09-30T13:02:00.000Z", "iotreadings_b": 3},
+        ]
+    )
+
+    rollup = build_rollup(table, 15)
+
+    assert rollup["reading_name"].to_pylist() == ["a", "b"]
+    assert rollup["value_int_sum"].to_pylist() == [None, 4]
+    assert rollup["value_float_max"].to_pylist() == [2.5, None]
+
+
+def test_pass_build_rollup_from_batches_given_batches_of_same_hour_merges_them_like_one_table():
+    table = pa.table(
+        {
+            "timestamp": [
+                "2024-09-30T13:01:00.000Z",
+                "2024-09-30T13:20:00.000Z",
+                "2024-09-30T13:40:00.000Z",
+                "2024-09-30T14:10:00.000Z",
+            ],
+            "iotreadings_value1": [4, None, 1, 6],
+            "iotreadings_value2": [None, 2.5, 0.5, None],
+        }
+    )
+
+    rollup = build_rollup_from_batches(table.to_batches(max_chunksize=1), 60)
+
+    assert rollup.to_pylist() == build_rollup(table, 60).to_pylist()
+
+
+# Parse timestamps tests
+
+
+def test_pass_parse_timestamps_given_mixed_formats_takes_timestamps_without_offset_as_utc():
+    timestamps = pa.array(["2024-09-30T13:44:01.000Z", "2024-09-30", "2024-09-30T15:00:00+02:00"])
+
+    parsed = parse_timestamps(timestamps)
+
+    assert [value.isoformat() for value in parsed.to_pylist()] == [
+        "2024-09-30T13:44:01+00:00",
+        "2024-09-30T00:00:00+00:00",
+        "2024-09-30T13:00:00+00:00",
+    ]
@@ -0,0 +1,355 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from lambda_processing.json_parsers import iter_raw_data_records, load_raw_data_file
+from lambda_processing.s3_transfer import S3Transfer, latency_bucket, retry_delay_seconds
+from lambda_processing.upload_ledger import S3UploadLedger, file_checksum
+from tests.fake_s3 import FakeS3Client
+
+BUCKET_NAME = "s3silver-bucket"
+
+
+class SlowFakeS3Client(FakeS3Client):
+    """Counts requests running at the same time, each of them takes 20 ms."""
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        self.wait_in_flight()
+        super().upload_file(Filename, Bucket, Key, **kwargs)
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self.wait_in_flight()
+        return super().get_object(Bucket, Key, Range, **kwargs)
+
+    def wait_in_flight(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.02)
+        with self.lock:
+            self.in_flight -= 1
+
+
+class ThrottlingFakeS3Client(FakeS3Client):
+    """Throttles the first requests with SlowDown errors, like S3 does for a hot prefix."""
+
+    def __init__(self, throttled_requests):
+        super().__init__()
+        self.throttled_requests = throttled_requests
+
+    def head_object(self, Bucket, Key, **kwargs):
+        if self.throttled_requests > 0:
+            self.throttled_requests -= 1
+            self.requests["head_object"] += 1
+            raise ClientError({"Error": {"Code": "SlowDown"}}, "HeadObject")
+        return super().head_object(Bucket, Key, **kwargs)
+
+
+class KeyErrorsFakeS3Client(FakeS3Client):
+    """DeleteObjects fails the given keys inside a successful response, each of them the given number of times."""
+
+    def __init__(self, error_code, failures_by_key):
+        super().__init__()
+        self.error_code = error_code
+        self.failures_by_key = failures_by_key
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        failed = [entry for entry in Delete["Objects"] if self.failures_by_key.get(entry["Key"], 0) > 0]
+        for entry in failed:
+            self.failures_by_key[entry["Key"]] -= 1
+        response = super().delete_objects(
+            Bucket, {"Objects": [entry for entry in Delete["Objects"] if entry not in failed]}, **kwargs
+        )
+        response["Errors"] = [{"Key": entry["Key"], "Code": self.error_code} for entry in failed]
+        return response
+
+
+class ServedRangesFakeS3Client(FakeS3Client):
+    """Records byte ranges of GET requests in the order they were served."""
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.served_ranges = []
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        response = super().get_object(Bucket, Key, Range, **kwargs)
+        with self.lock:
+            self.served_ranges.append(Range)
+        return response
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+def write_files(directory, count):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(directory, f"part-{i}.parquet"), "wb") as f:
+            f.write(b"PAR1")
+
+
+# Concurrency tests
+
+
+def test_pass_upload_directories_given_max_concurrency_runs_that_many_requests_at_once(temp_dir):
+    s3_client = SlowFakeS3Client()
+    write_files(os.path.join(temp_dir, "a"), 6)
+    write_files(os.path.join(temp_dir, "b"), 6)
+    s3_transfer = S3Transfer(s3_client, max_concurrency=4)
+
+    keys_by_directory = s3_transfer.upload_directories(
+        BUCKET_NAME, {os.path.join(temp_dir, "a"): "job_1/a", os.path.join(temp_dir, "b"): "job_1/b"}
+    )
+
+    assert s3_client.max_in_flight == 4
+    assert sorted(keys_by_directory[os.path.join(temp_dir, "a")]) == [f"job_1/a/part-{i}.parquet" for i in range(6)]
+    assert len(s3_client.keys(BUCKET_NAME, "job_1/")) == 12
+    assert s3_transfer.requests["upload_file"] == 12
+
+
+def test_pass_download_file_given_request_returns_future_to_overlap_it(temp_dir):
+    s3_client = FakeS3Client()
+    s3_client.put(BUCKET_NAME, "raw-1.json", b"[]")
+    file_path = os.path.join(temp_dir, "raw-1.json")
+
+    future = S3Transfer(s3_client).download_file(BUCKET_NAME, "raw-1.json", file_path)
+
+    future.result()
+    with open(file_path, "rb") as f:
+        assert f.read() == b"[]"
+
+
+# Ranged download tests
+
+
+def test_pass_iter_object_ranges_yields_byte_ranges_of_object_in_order():
+    s3_client = FakeS3Client()
+    data = bytes(range(256)) * 40
+    s3_client.put(BUCKET_NAME, "raw-1.ndjson", data)
+    s3_transfer = S3Transfer(s3_client, max_concurrency=4)
+
+    ranges = list(s3_transfer.iter_object_ranges(BUCKET_NAME, "raw-1.ndjson", len(data), part_size=1000))
+
+    assert [len(part) for part in ranges] == [1000] * 10 + [240]
+    assert b"".join(ranges) == data
+    assert s3_transfer.requests["get_object_body"] == 11
+
+
+def test_pass_iter_object_ranges_given_more_ranges_than_concurrency_keeps_concurrency_ranges_in_flight():
+    s3_client = SlowFakeS3Client()
+    data = b"x" * 16 * 1024
+    s3_client.put(BUCKET_NAME, "raw-1.ndjson", data)
+    s3_transfer = S3Transfer(s3_client, max_concurrency=8)
+
+    ranged_data = b"".join(s3_transfer.iter_object_ranges(BUCKET_NAME, "raw-1.ndjson", len(data), 1024))
+
+    assert ranged_data == data
+    assert s3_client.requests["get_object"] == 16
+    # Whole object download would be one request at a time
+    assert s3_client.max_in_flight == 8
+
+
+def test_pass_iter_object_ranges_given_slow_reader_requests_only_concurrency_ranges_ahead_of_it():
+    s3_client = FakeS3Client()
+    data = b"x" * 16 * 1024
+    s3_client.put(BUCKET_NAME, "raw-1.ndjson", data)
+    s3_transfer = S3Transfer(s3_client, max_concurrency=4)
+
+    ranges = s3_transfer.iter_object_ranges(BUCKET_NAME, "raw-1.ndjson", len(data), 1024)
+    next(ranges)
+    # Gives the event loop time to request more ranges if it would
+    time.sleep(0.1)
+    requested_ranges = s3_client.requests["get_object"]
+    ranges.close()
+
+    assert requested_ranges == 5
+
+
+def test_pass_iter_raw_data_records_given_ndjson_ranges_parses_first_row_before_last_range_is_served(temp_dir):
+    s3_client = ServedRangesFakeS3Client()
+    data_asset = {"timestamp": "2024-09-30T13:40:01.000Z", "dataAsset": "mars", "iotreadings": {"value1": 1}}
+    data = "".join(json.dumps(dict(data_asset, dataAsset=f"asset-{i}")) + "\n" for i in range(30000)).encode()
+    s3_client.put(BUCKET_NAME, "raw-1.ndjson", data)
+    s3_transfer = S3Transfer(s3_client, max_concurrency=4)
+    file_path = os.path.join(temp_dir, "raw-1.ndjson")
+    s3_transfer.download_file(BUCKET_NAME, "raw-1.ndjson", file_path).result()
+    whole_data_assets = load_raw_data_file(file_path, "stdlib")
+    part_size = 64 * 1024
+    last_range = f"bytes={(len(data) - 1) // part_size * part_size}-{len(data) - 1}"
+
+    records = iter_raw_data_records(s3_transfer.iter_object_ranges(BUCKET_NAME, "raw-1.ndjson", len(data), part_size))
+    first_record = next(records)
+    served_ranges_at_first_record = list(s3_client.served_ranges)
+
+    assert [first_record, *records] == whole_data_assets
+    assert last_range not in served_ranges_at_first_record
+    assert s3_client.served_ranges[-1] == last_range
+
+
+# Checksummed uploads tests
+
+
+def test_pass_upload_files_sends_sha256_checksum_and_keeps_it_in_metadata(temp_dir):
+    s3_client = FakeS3Client()
+    write_files(temp_dir, 1)
+    file_path = os.path.join(temp_dir, "part-0.parquet")
+
+    S3Transfer(s3_client).upload_files(BUCKET_NAME, {file_path: "daily/part-0.parquet"})
+
+    response = s3_client.head_object(Bucket=BUCKET_NAME, Key="daily/part-0.parquet")
+    assert response["Metadata"] == {"sha256": "+8YtO1ETaO4nXdx0EX2GibQw4UJyIOJdMIFiAdicp7Y="}
+    assert file_checksum(file_path) == "+8YtO1ETaO4nXdx0EX2GibQw4UJyIOJdMIFiAdicp7Y="
+
+
+def test_pass_upload_files_given_ledger_of_failed_run_skips_objects_in_s3_with_matching_checksums(temp_dir):
+    s3_client = FakeS3Client()
+    write_files(temp_dir, 3)
+    key_by_file_path = {os.path.join(temp_dir, f"part-{i}.parquet"): f"daily/part-{i}.parquet" for i in range(3)}
+    failed_run = S3Transfer(s3_client, upload_ledger=S3UploadLedger(s3_client, BUCKET_NAME, "run-1"))
+    failed_run.upload_files(BUCKET_NAME, dict(list(key_by_file_path.items())[:2]))
+    failed_run.upload_ledger.save()
+    # The object changed after the failed run, so it's uploaded again
+    s3_client.put(BUCKET_NAME, "daily/part-1.parquet", b"other")
+    s3_client.requests.clear()
+
+    retry = S3Transfer(s3_client, upload_ledger=S3UploadLedger(s3_client, BUCKET_NAME, "run-1"))
+    retry.upload_files(BUCKET_NAME, key_by_file_path)
+
+    assert s3_client.requests["upload_file"] == 2
+    assert s3_client.requests["head_object"] == 2
+    assert retry.skipped_uploads == 1
+    assert s3_client.objects[(BUCKET_NAME, "daily/part-1.parquet")] == b"PAR1"
+    assert sorted(retry.upload_ledger.checksum_by_key) == sorted(key_by_file_path.values())
+
+
+# Batched deletes tests
+
+
+def test_pass_delete_objects_given_more_keys_than_batch_size_deletes_them_in_batches_of_1000():
+    s3_client = FakeS3Client()
+    keys = [f"15min_chunks/chunk-{i}.parquet" for i in range(2500)]
+    for key in keys:
+        s3_client.put(BUCKET_NAME, key, b"x")
+    s3_client.put(BUCKET_NAME, "daily.parquet", b"x")
+    s3_transfer = S3Transfer(s3_client, max_concurrency=4)
+
+    failed_keys = s3_transfer.delete_objects(BUCKET_NAME, keys + keys[:10])
+
+    assert failed_keys == []
+    assert s3_client.keys(BUCKET_NAME) == ["daily.parquet"]
+    assert s3_transfer.requests["delete_objects"] == 3
+
+
+def test_pass_delete_objects_given_throttled_keys_in_response_sends_them_again():
+    keys = [f"chunk-{i}.parquet" for i in range(5)]
+    s3_client = KeyErrorsFakeS3Client("SlowDown", {keys[1]: 2, keys[3]: 1})
+    for key in keys:
+        s3_client.put(BUCKET_NAME, key, b"x")
+    s3_transfer = S3Transfer(s3_client, base_retry_delay_seconds=0.001)
+
+    failed_keys = s3_transfer.delete_objects(BUCKET_NAME, keys)
+
+    assert failed_keys == []
+    assert s3_client.keys(BUCKET_NAME) == []
+    assert s3_transfer.requests["delete_objects"] == 3
+
+
+def test_fail_delete_objects_given_denied_keys_returns_them_without_retries():
+    keys = [f"chunk-{i}.parquet" for i in range(3)]
+    s3_client = KeyErrorsFakeS3Client("AccessDenied", {keys[0]: 10})
+    for key in keys:
+        s3_client.put(BUCKET_NAME, key, b"x")
+    s3_transfer = S3Transfer(s3_client, base_retry_delay_seconds=0.001)
+
+    failed_keys = s3_transfer.delete_objects(BUCKET_NAME, keys)
+
+    assert failed_keys == [keys[0]]
+    assert s3_client.keys(BUCKET_NAME) == [keys[0]]
+    assert s3_transfer.requests["delete_objects"] == 1
+
+
+# Retries tests
+
+
+def test_pass_head_objects_given_throttled_requests_retries_them():
+    s3_client = ThrottlingFakeS3Client(throttled_requests=2)
+    s3_client.put(BUCKET_NAME, "raw-1.json", b"[]")
+    s3_transfer = S3Transfer(s3_client, max_attempts=3, base_retry_delay_seconds=0.001)
+
+    responses = s3_transfer.head_objects(BUCKET_NAME, ["raw-1.json"])
+
+    assert responses[0]["ContentLength"] == 2
+    assert s3_transfer.requests["head_object"] == 3
+    assert s3_transfer.retries["head_object"] == 2
+
+
+def test_fail_head_objects_given_throttled_requests_above_max_attempts():
+    s3_client = ThrottlingFakeS3Client(throttled_requests=3)
+    s3_transfer = S3Transfer(s3_client, max_attempts=3, base_retry_delay_seconds=0.001)
+
+    with pytest.raises(ClientError, match="SlowDown"):
+        s3_transfer.head_objects(BUCKET_NAME, ["raw-1.json"])
+
+
+def test_fail_head_objects_given_missing_key_raises_without_retries():
+    s3_transfer = S3Transfer(FakeS3Client(), base_retry_delay_seconds=0.001)
+
+    with pytest.raises(ClientError):
+        s3_transfer.head_objects(BUCKET_NAME, ["missing.json"])
+
+    assert s3_transfer.retries["head_object"] == 0
+
+
+def test_pass_retry_delay_seconds_given_attempts_grows_exponentially_with_jitter():
+    delays = [retry_delay_seconds(3, 0.1) for _ in range(100)]
+
+    assert all(0 <= delay <= 0.4 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+# Listing and statistics tests
+
+
+def test_pass_list_objects_given_more_keys_than_page_size_lists_them_page_by_page():
+    s3_client = FakeS3Client()
+    for i in range(2500):
+        s3_client.put(BUCKET_NAME, f"15min_chunks/chunk-{i:04}.parquet", b"PAR1")
+
+    objects = S3Transfer(s3_client).list_objects(BUCKET_NAME, "15min_chunks/")
+
+    assert [item["Key"] for item in objects] == [f"15min_chunks/chunk-{i:04}.parquet" for i in range(2500)]
+    assert s3_client.requests["list_objects_v2"] == 3
+
+
+def test_pass_latency_bucket_given_latency_returns_histogram_bucket_label():
+    assert latency_bucket(3) == "<=10ms"
+    assert latency_bucket(10.5) == "<=25ms"
+    assert latency_bucket(60000) == ">5000ms"
+
+
+def test_pass_report_given_requests_prints_counts_and_latency_histogram(capfd):
+    s3_client = FakeS3Client()
+    s3_client.put(BUCKET_NAME, "raw-1.json", b"[]")
+    s3_transfer = S3Transfer(s3_client)
+    s3_transfer.head_objects(BUCKET_NAME, ["raw-1.json", "raw-1.json"])
+
+    s3_transfer.report("FilesProcessor")
+
+    out, _err = capfd.readouterr()
+    assert "S3 head_object: 2 requests, 0 retries, latency <=10ms: 2" in out
+    assert '"S3Requests": 2, "Stage": "FilesProcessor", "Operation": "head_object"' in out
@@ -1,26 +1,77 @@
+import bisect
 import json
-import pytest
 import time
-
 from contextlib import contextmanager
 from unittest.mock import MagicMock, patch
 
-from lambda_pooling.s3bronze_file_events_pooling import lambda_handler, pool_file_keys
+import pytest
 
+from lambda_pooling.s3bronze_file_events_pooling import (
+    BatchTuner,
+    lambda_handler,
+    latency_batching_window,
+    pool_file_keys,
+)
+from tests.fake_s3 import FakeS3Client
 
 STEP_FUNCTION_ARN = "step-function-name-arn"
 RAW_DATA_FILES_SQS_QUEUE_URL = "raw-sqs-queue-url"
 MAXIMUM_BATCHING_WINDOW_IN_SECONDS = 0.1
+BATCH_MANIFESTS_BUCKET_NAME = "s3silver-bucket"
+
+
+class SimulatedClockSQS:
+    """Queue of Raw data file messages arriving at given times of a simulated clock, each request takes 100 ms."""
+
+    def __init__(self, arrival_times):
+        self.now = 0
+        self.arrival_times = sorted(arrival_times)
+        self.received_count = 0
+
+    def time(self):
+        return self.now
+
+    def queued_count(self):
+        return bisect.bisect_right(self.arrival_times, self.now) - self.received_count
+
+    def get_queue_attributes(self, **kwargs):
+        queued_count = self.queued_count()
+        self.now += 0.1
+        return {"Attributes": {"ApproximateNumberOfMessages": str(queued_count)}}
+
+    def receive_message(self, MaxNumberOfMessages, **kwargs):
+        indexes = range(self.received_count, self.received_count + min(self.queued_count(), MaxNumberOfMessages))
+        self.received_count += len(indexes)
+        self.now += 0.1
+        return {
+            "Messages": [
+                {
+                    "MessageId": f"message-{index}",
+                    "ReceiptHandle": f"receipt-handle-{index}",
+                    "Body": json.dumps(
+                        {"Records": [{"s3": {"object": {"key": f"2024/10/02/job_1001/sqs-{index}.json"}}}]}
+                    ),
+                }
+                for index in indexes
+            ]
+        }
+
+    def delete_message_batch(self, **kwargs):
+        self.now += 0.1
 
 
 @contextmanager
-def mock_env(processors_count=2, files_per_processor=5):
+def mock_env(processors_count=2, files_per_processor=5, map_mode="INLINE", auto_tuning="false", latency_weight="0"):
     variables = {
         "FILE_PROCESSORS_COUNT": str(processors_count),
         "RAW_DATA_FILES_PER_PROCESSOR": str(files_per_processor),
         "DATA_PROCESSING_STATE_MACHINE_ARN": STEP_FUNCTION_ARN,
         "RAW_DATA_FILES_SQS_QUEUE_URL": RAW_DATA_FILES_SQS_QUEUE_URL,
         "MAXIMUM_BATCHING_WINDOW_IN_SECONDS": str(MAXIMUM_BATCHING_WINDOW_IN_SECONDS),
+        "PROCESSING_MAP_MODE": map_mode,
+        "BATCH_MANIFESTS_BUCKET_NAME": BATCH_MANIFESTS_BUCKET_NAME,
+        "AUTO_TUNING": auto_tuning,
+        "BATCHING_LATENCY_WEIGHT": latency_weight,
     }
     with patch.dict("os.environ", variables):
         yield
@@ -126,9 +177,8 @@ def test_fail_lambda_handler_when_step_function_finishes_with_error():
     error_string = (
         f"Step Function: {STEP_FUNCTION_ARN} execution: step-function-execution-arn failed with error: {error}"
     )
-    with pytest.raises(RuntimeError, match=error_string):
-        with mock_env(processors_count=2, files_per_processor=5):
-            lambda_handler(event_fixture, {}, mock_sqs, mock_stepfunctions)
+    with pytest.raises(RuntimeError, match=error_string), mock_env(processors_count=2, files_per_processor=5):
+        lambda_handler(event_fixture, {}, mock_sqs, mock_stepfunctions)
 
 
 def test_pass_lambda_handler_when_finished_processing_deletes_fetched_messages_from_sqs_in_batches_of_10():
@@ -176,6 +226,208 @@ def test_pass_lambda_handler_when_didnt_pull_messages_from_sqs_doest_delete_any(
     assert mock_sqs.delete_message_batch.call_count == 0
 
 
+def test_pass_lambda_handler_given_unprocessed_keys_in_execution_output_sends_them_back_to_sqs():
+    event_fixture = build_trigger_event_fixture(2)
+    mock_sqs = MagicMock()
+    mock_sqs.receive_message.return_value = {}
+    mock_stepfunctions = MagicMock()
+    output = [["chunk-1"], {"chunk_keys": ["chunk-2"], "unprocessed_keys": ["raw-3.json", "raw-4.json"]}]
+    mock_stepfunctions.start_sync_execution.return_value = {"status": "SUCCEEDED", "output": json.dumps(output)}
+
+    with mock_env(processors_count=2, files_per_processor=4):
+        lambda_handler(event_fixture, {}, mock_sqs, mock_stepfunctions)
+
+    mock_sqs.send_message_batch.assert_called_once_with(
+        QueueUrl=RAW_DATA_FILES_SQS_QUEUE_URL,
+        Entries=[
+            {"Id": "0", "MessageBody": json.dumps({"Records": [{"s3": {"object": {"key": "raw-3.json"}}}]})},
+            {"Id": "1", "MessageBody": json.dumps({"Records": [{"s3": {"object": {"key": "raw-4.json"}}}]})},
+        ],
+    )
+
+
+def test_pass_lambda_handler_given_all_files_processed_doesnt_reschedule_any():
+    event_fixture = build_trigger_event_fixture(2)
+    mock_sqs = MagicMock()
+    mock_sqs.receive_message.return_value = {}
+    mock_stepfunctions = MagicMock()
+    mock_stepfunctions.start_sync_execution.return_value = {"status": "SUCCEEDED", "output": '[["chunk-1"]]'}
+
+    with mock_env(processors_count=2, files_per_processor=4):
+        lambda_handler(event_fixture, {}, mock_sqs, mock_stepfunctions)
+
+    assert mock_sqs.send_message_batch.call_count == 0
+
+
+def test_pass_lambda_handler_given_distributed_map_mode_writes_batch_manifest_and_polls_execution():
+    event_fixture = build_trigger_event_fixture(2)
+    mock_sqs = MagicMock()
+    mock_sqs.receive_message.side_effect = [build_sqs_messages_fixture(2)] + [{} for _ in range(100)]
+    mock_stepfunctions = MagicMock()
+    mock_stepfunctions.start_execution.return_value = {"executionArn": "execution-arn"}
+    mock_stepfunctions.describe_execution.side_effect = [{"status": "RUNNING"}, {"status": "SUCCEEDED"}]
+    s3 = FakeS3Client()
+    sleep = MagicMock()
+
+    with mock_env(processors_count=2, files_per_processor=3, map_mode="DISTRIBUTED"):
+        lambda_handler(event_fixture, {}, mock_sqs, mock_stepfunctions, s3, sleep)
+
+    assert mock_stepfunctions.start_sync_execution.call_count == 0
+    execution_input = json.loads(mock_stepfunctions.start_execution.call_args.kwargs["input"])
+    manifest = execution_input["batch_manifest"]
+    assert manifest["bucket"] == BATCH_MANIFESTS_BUCKET_NAME
+    assert manifest["key"].startswith("_batch_manifests/") and manifest["key"].endswith(".jsonl")
+    lines = s3.objects[(manifest["bucket"], manifest["key"])].decode("utf-8").splitlines()
+    assert [json.loads(line)["file_keys"] for line in lines] == [
+        [
+            "2024/10/02/job_328e430e-2569-46f2-8ca7-2fd8eb7f1549/raw-2.json",
+            "2024/10/02/job_328e430e-2569-46f2-8ca7-2fd8eb7f1549/raw-1.json",
+            "2024/10/02/job_328e430e-2569-46f2-8ca7-2fd8eb7f1549/raw-3.json",
+        ],
+        ["2024/10/02/job_328e430e-2569-46f2-8ca7-2fd8eb7f1549/raw-4.json"],
+    ]
+    assert mock_stepfunctions.describe_execution.call_count == 2
+    sleep.assert_called_once()
+
+
+def test_pass_lambda_handler_given_distributed_map_results_in_s3_reschedules_their_unprocessed_keys():
+    event_fixture = build_trigger_event_fixture(2)
+    mock_sqs = MagicMock()
+    mock_sqs.receive_message.return_value = {}
+    s3 = FakeS3Client()
+    results = [
+        {"Output": json.dumps(["chunk-1"])},
+        {"Output": json.dumps({"chunk_keys": ["chunk-2"], "unprocessed_keys": ["raw-3.json"]})},
+    ]
+    s3.put(BATCH_MANIFESTS_BUCKET_NAME, "_map_results/run/SUCCEEDED_0.json", json.dumps(results).encode())
+    manifest = {
+        "DestinationBucket": BATCH_MANIFESTS_BUCKET_NAME,
+        "ResultFiles": {"SUCCEEDED": [{"Key": "_map_results/run/SUCCEEDED_0.json", "Size": 1}], "FAILED": []},
+    }
+    s3.put(BATCH_MANIFESTS_BUCKET_NAME, "_map_results/run/manifest.json", json.dumps(manifest).encode())
+    output = {"ResultWriterDetails": {"Bucket": BATCH_MANIFESTS_BUCKET_NAME, "Key": "_map_results/run/manifest.json"}}
+    mock_stepfunctions = MagicMock()
+    mock_stepfunctions.start_execution.return_value = {"executionArn": "execution-arn"}
+    mock_stepfunctions.describe_execution.return_value = {"status": "SUCCEEDED", "output": json.dumps(output)}
+
+    with mock_env(processors_count=2, files_per_processor=4, map_mode="DISTRIBUTED"):
+        lambda_handler(event_fixture, {}, mock_sqs, mock_stepfunctions, s3)
+
+    mock_sqs.send_message_batch.assert_called_once_with(
+        QueueUrl=RAW_DATA_FILES_SQS_QUEUE_URL,
+        Entries=[{"Id": "0", "MessageBody": json.dumps({"Records": [{"s3": {"object": {"key": "raw-3.json"}}}]})}],
+    )
+
+
+def test_fail_lambda_handler_when_distributed_execution_fails():
+    event_fixture = build_trigger_event_fixture(2)
+    mock_stepfunctions = MagicMock()
+    mock_stepfunctions.start_execution.return_value = {"executionArn": "execution-arn"}
+    mock_stepfunctions.describe_execution.return_value = {
+        "executionArn": "execution-arn",
+        "stateMachineArn": STEP_FUNCTION_ARN,
+        "status": "FAILED",
+        "error": "States.ItemReaderFailed",
+    }
+
+    with (
+        pytest.raises(RuntimeError, match="'status': 'FAILED', 'error': 'States.ItemReaderFailed', 'cause': None"),
+        mock_env(processors_count=1, files_per_processor=2, map_mode="DISTRIBUTED"),
+    ):
+        lambda_handler(event_fixture, {}, MagicMock(), mock_stepfunctions, FakeS3Client())
+
+
+def test_pass_lambda_handler_given_auto_tuning_and_quiet_queue_starts_one_processor_with_queued_files():
+    event_fixture = build_trigger_event_fixture(2)
+    mock_sqs = MagicMock()
+    mock_sqs.get_queue_attributes.return_value = {"Attributes": {"ApproximateNumberOfMessages": "2"}}
+    mock_sqs.receive_message.side_effect = [build_sqs_messages_fixture(2)] + [{} for _ in range(100)]
+    mock_stepfunctions = MagicMock()
+    mock_stepfunctions.start_sync_execution.return_value = {"status": "SUCCEEDED"}
+    batch_tuner = BatchTuner(max_processors_count=3, default_files_per_processor=20, max_batching_window_in_seconds=1)
+
+    with mock_env(processors_count=3, files_per_processor=20, auto_tuning="true"):
+        lambda_handler(event_fixture, {}, mock_sqs, mock_stepfunctions, batch_tuner=batch_tuner)
+
+    mock_sqs.get_queue_attributes.assert_called_once_with(
+        QueueUrl=RAW_DATA_FILES_SQS_QUEUE_URL, AttributeNames=["ApproximateNumberOfMessages"]
+    )
+    # 4 pending files fit one processor, so only 2 more are pulled from SQS in one request
+    mock_sqs.receive_message.assert_called_once_with(
+        QueueUrl=RAW_DATA_FILES_SQS_QUEUE_URL, MessageSystemAttributeNames=[], MaxNumberOfMessages=2
+    )
+    files_list = json.loads(mock_stepfunctions.start_sync_execution.call_args.kwargs["input"])
+    assert [len(files) for files in files_list] == [4]
+    assert len(batch_tuner.recent_executions) == 1
+
+
+# Latency-optimized batching tests
+
+
+def test_pass_lambda_handler_given_latency_weight_and_empty_queue_dispatches_trigger_files_without_polling():
+    mock_sqs = MagicMock()
+    mock_sqs.get_queue_attributes.return_value = {"Attributes": {"ApproximateNumberOfMessages": "0"}}
+    mock_stepfunctions = MagicMock()
+    mock_stepfunctions.start_sync_execution.return_value = {"status": "SUCCEEDED"}
+
+    with mock_env(latency_weight="0.5"):
+        lambda_handler(build_trigger_event_fixture(2), {}, mock_sqs, mock_stepfunctions)
+
+    assert mock_sqs.receive_message.call_count == 0
+    files_list = json.loads(mock_stepfunctions.start_sync_execution.call_args.kwargs["input"])
+    assert [len(files) for files in files_list] == [2]
+
+
+def test_pass_lambda_handler_given_trigger_event_filling_batch_doesnt_request_sqs():
+    mock_sqs = MagicMock()
+    mock_stepfunctions = MagicMock()
+    mock_stepfunctions.start_sync_execution.return_value = {"status": "SUCCEEDED"}
+
+    with mock_env(processors_count=1, files_per_processor=2, latency_weight="1"):
+        lambda_handler(build_trigger_event_fixture(2), {}, mock_sqs, mock_stepfunctions)
+
+    assert mock_sqs.method_calls == []
+    assert mock_stepfunctions.start_sync_execution.call_count == 1
+
+
+def test_pass_lambda_handler_given_latency_weight_trades_batch_size_for_dispatch_time():
+    # 3 messages are queued before the trigger, then one arrives every second.
+    # A batch of 10 files needs 8 of them, the batching window is 10 s
+    dispatched = {}
+    for latency_weight in ("0", "0.5", "1"):
+        sqs = SimulatedClockSQS([-1] * 3 + list(range(1, 20)))
+        mock_stepfunctions = MagicMock()
+
+        def start_sync_execution(input, latency_weight=latency_weight, sqs=sqs, **kwargs):
+            dispatched[latency_weight] = (sqs.now, sum(len(files) for files in json.loads(input)))
+            return {"status": "SUCCEEDED"}
+
+        mock_stepfunctions.start_sync_execution.side_effect = start_sync_execution
+        with (
+            mock_env(latency_weight=latency_weight),
+            patch.dict("os.environ", {"MAXIMUM_BATCHING_WINDOW_IN_SECONDS": "10"}),
+        ):
+            lambda_handler(build_trigger_event_fixture(2), {}, sqs, mock_stepfunctions, clock=sqs.time)
+
+    # Throughput mode waits for the full batch, latency mode takes what's queued and waits a share of the window
+    assert dispatched["0"][1] == 10 and 5 <= dispatched["0"][0] < 6
+    assert dispatched["0.5"][1] == 6 and 1 <= dispatched["0.5"][0] < 2.5
+    assert dispatched["1"][1] == 5 and dispatched["1"][0] < 0.5
+
+
+def test_pass_latency_batching_window_given_queued_share_of_missing_files_shortens_window():
+    assert latency_batching_window(10, 8, 0, 0.5) == 0
+    assert latency_batching_window(10, 0, 3, 0.5) == 0
+    assert latency_batching_window(10, 8, 4, 0.5) == 2.5
+    assert latency_batching_window(10, 8, 100, 0.2) == 8
+    assert latency_batching_window(10, 8, 100, 1) == 0
+
+
+def test_fail_lambda_handler_given_latency_weight_out_of_range():
+    with mock_env(latency_weight="2"), pytest.raises(ValueError):
+        lambda_handler(build_trigger_event_fixture(2), {}, MagicMock(), MagicMock())
+
+
 # Pooling file keys tests
 
 
@@ -0,0 +1,149 @@
+import io
+import json
+import tempfile
+
+import pyarrow as pa
+import pytest
+from pyarrow import parquet as pq
+
+from lambda_processing.silver_reader import SilverReader, days_in_range, iso_timestamp
+from tests.fake_s3 import FakeS3Client
+
+PARQUET_FILES_BUCKET_NAME = "s3silver-bucket"
+RAW_DATA_FILES_BUCKET_NAME = "medallion-lakehouse-s3bronze"
+JOB_ID = "41780824-ac46-4b25-9547-a53607b4f37a"
+DAILY_KEY = (
+    f"job_{JOB_ID}/{RAW_DATA_FILES_BUCKET_NAME}/mars/2023/04/01/2023-04-01.{JOB_ID}.snappy.parquet/part-0.parquet"
+)
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+@pytest.fixture
+def s3_client():
+    s3_client = FakeS3Client()
+    s3_client.put(PARQUET_FILES_BUCKET_NAME, DAILY_KEY, build_daily_parquet_bytes())
+    return s3_client
+
+
+# Read tests
+
+
+def test_pass_read_given_time_range_and_columns_returns_matching_rows_only(s3_client):
+    reader = SilverReader(s3_client, PARQUET_FILES_BUCKET_NAME, RAW_DATA_FILES_BUCKET_NAME)
+
+    table = reader.read(JOB_ID, "mars", "2023-04-01T13:00:00Z", "2023-04-01T14:00:00Z", columns=["iotreadings_value1"])
+
+    assert table.column_names == ["iotreadings_value1"]
+    assert table.num_rows == 720
+    assert table["iotreadings_value1"].to_pylist() == list(range(13 * 720, 14 * 720))
+
+
+def test_pass_read_given_narrow_query_fetches_part_of_the_object_and_skips_row_groups(s3_client):
+    reader = SilverReader(s3_client, PARQUET_FILES_BUCKET_NAME, RAW_DATA_FILES_BUCKET_NAME)
+
+    reader.read(JOB_ID, "mars", "2023-04-01T13:00:00Z", "2023-04-01T14:00:00Z", columns=["iotreadings_value1"])
+
+    object_size = len(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, DAILY_KEY)])
+    assert reader.stats["bytes_fetched"] < object_size / 4
+    assert reader.stats["row_groups_read"] == 1
+    assert reader.stats["row_groups_skipped"] == 23
+
+
+def test_pass_read_given_cache_directory_serves_repeated_query_from_cache(s3_client, temp_dir):
+    reader = SilverReader(s3_client, PARQUET_FILES_BUCKET_NAME, RAW_DATA_FILES_BUCKET_NAME, cache_directory=temp_dir)
+    reader.read(JOB_ID, "mars", "2023-04-01T13:00:00Z", "2023-04-01T14:00:00Z")
+    range_gets = s3_client.requests["get_object"]
+
+    table = reader.read(JOB_ID, "mars", "2023-04-01T13:00:00Z", "2023-04-01T14:00:00Z")
+
+    assert table.num_rows == 720
+    # Only the job manifest lookup goes to S3 again
+    assert s3_client.requests["get_object"] == range_gets + 1
+    assert reader.stats["cache_hits"] > 0
+
+
+def test_pass_read_given_job_manifest_resolves_keys_without_list_calls(s3_client):
+    manifest = {
+        "job_id": JOB_ID,
+        "files": [
+            {
+                "key": DAILY_KEY,
+                "bucket": RAW_DATA_FILES_BUCKET_NAME,
+                "product": "mars",
+                "date": "2023-04-01",
+                "min_timestamp": "2023-04-01T00:00:00.000Z",
+                "max_timestamp": "2023-04-01T23:59:00.000Z",
+            },
+            {
+                "key": "job_other/jupiter.parquet",
+                "bucket": RAW_DATA_FILES_BUCKET_NAME,
+                "product": "jupiter",
+                "date": "2023-04-01",
+            },
+            {"key": "job_other/mars.parquet", "bucket": "other-s3bronze", "product": "mars", "date": "2023-04-01"},
+        ],
+    }
+    s3_client.put(PARQUET_FILES_BUCKET_NAME, f"job_{JOB_ID}/_manifest.json", json.dumps(manifest).encode("utf-8"))
+    reader = SilverReader(s3_client, PARQUET_FILES_BUCKET_NAME, RAW_DATA_FILES_BUCKET_NAME)
+
+    table = reader.read(JOB_ID, "mars", "2023-04-01T13:00:00Z", "2023-04-01T13:10:00Z")
+
+    assert table.num_rows == 120
+    assert s3_client.requests["list_objects_v2"] == 0
+
+
+def test_pass_read_given_no_daily_files_in_range_returns_empty_table(s3_client):
+    reader = SilverReader(s3_client, PARQUET_FILES_BUCKET_NAME, RAW_DATA_FILES_BUCKET_NAME)
+
+    table = reader.read(JOB_ID, "mars", "2023-05-01T13:00:00Z", "2023-05-01T14:00:00Z")
+
+    assert table.num_rows == 0
+
+
+def test_fail_read_given_daily_file_without_timestamp_column_raises_error_with_key():
+    s3_client = FakeS3Client()
+    buffer = io.BytesIO()
+    pq.write_table(pa.table({"dataAsset": ["mars"]}), buffer)
+    s3_client.put(PARQUET_FILES_BUCKET_NAME, DAILY_KEY, buffer.getvalue())
+    reader = SilverReader(s3_client, PARQUET_FILES_BUCKET_NAME, RAW_DATA_FILES_BUCKET_NAME)
+
+    with pytest.raises(ValueError, match="has no timestamp column"):
+        reader.read(JOB_ID, "mars", "2023-04-01T13:00:00Z", "2023-04-01T14:00:00Z")
+
+
+# Time range helpers tests
+
+
+def test_pass_iso_timestamp_given_iso_string_with_offset_returns_utc_timestamp_in_device_format():
+    assert iso_timestamp("2023-04-01T15:00:00+02:00") == "2023-04-01T13:00:00.000Z"
+
+
+def test_pass_days_in_range_given_range_over_midnight_returns_both_days():
+    assert days_in_range("2023-04-01T23:00:00Z", "2023-04-02T01:00:00Z") == ["2023-04-01", "2023-04-02"]
+
+
+# Helpers
+
+
+def build_daily_parquet_bytes():
+    # One reading per 5 seconds of a day, one row group per hour
+    timestamps = [
+        f"2023-04-01T{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}.000Z"
+        for second in range(0, 24 * 60 * 60, 5)
+    ]
+    table = pa.table(
+        {
+            "timestamp": timestamps,
+            "dataAsset": ["mars"] * len(timestamps),
+            **{f"iotreadings_value{i}": list(range(i, i + len(timestamps))) for i in range(1, 9)},
+        }
+    )
+    table = table.set_column(2, "iotreadings_value1", pa.array(range(len(timestamps))))
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, row_group_size=720)
+    return buffer.getvalue()
@@ -0,0 +1,203 @@
+import os
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from lambda_processing.sparse_tables import (
+    chunk_footer_bytes,
+    chunk_footer_schema,
+    chunk_schema,
+    column_set_tables,
+    non_null_columns,
+    padded_table,
+    row_group_pieces,
+    sequential_positions,
+    sparse_row_groups,
+    unify_sparse_schemas,
+    write_sparse_dataset,
+)
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+# Column set tables tests
+
+
+def test_pass_column_set_tables_given_records_with_different_keys_groups_them_by_key_set():
+    records = [
+        {"timestamp": "t1", "iotreadings_value1": 1},
+        {"timestamp": "t2", "iotreadings_value9": 7},
+        {"iotreadings_value1": 2, "timestamp": "t3"},
+    ]
+
+    tables, positions = column_set_tables(records, min_rows_per_column_set=1)
+
+    assert [table.column_names for table in tables] == [
+        ["timestamp", "iotreadings_value1"],
+        ["timestamp", "iotreadings_value9"],
+    ]
+    assert tables[0]["iotreadings_value1"].to_pylist() == [1, 2]
+    assert [table_positions.tolist() for table_positions in positions] == [[0, 2], [1]]
+
+
+def test_pass_column_set_tables_given_more_column_sets_than_limit_returns_one_table_with_all_keys():
+    records = [{"timestamp": f"t{i}", f"iotreadings_value{i}": i} for i in range(5)]
+
+    tables, positions = column_set_tables(records, max_column_sets=4, min_rows_per_column_set=1)
+
+    assert len(tables) == 1
+    assert tables[0].column_names == ["timestamp", *[f"iotreadings_value{i}" for i in range(5)]]
+    assert tables[0]["iotreadings_value4"].to_pylist() == [None, None, None, None, 4]
+    assert [table_positions.tolist() for table_positions in positions] == [[0, 1, 2, 3, 4]]
+
+
+def test_pass_column_set_tables_given_few_rows_per_column_set_returns_one_table_with_all_keys():
+    records = [{"timestamp": "t1", "iotreadings_value1": 1}, {"timestamp": "t2", "iotreadings_value9": 7}]
+
+    tables, positions = column_set_tables(records, min_rows_per_column_set=2)
+
+    assert [table.column_names for table in tables] == [["timestamp", "iotreadings_value1", "iotreadings_value9"]]
+    assert [table_positions.tolist() for table_positions in positions] == [[0, 1]]
+
+
+def test_pass_sequential_positions_given_tables_numbers_rows_across_them():
+    tables = [pa.table({"a": [1, 2]}), pa.table({"b": [3]})]
+
+    positions = sequential_positions(tables, start=10)
+
+    assert [table_positions.tolist() for table_positions in positions] == [[10, 11], [12]]
+
+
+def test_pass_unify_sparse_schemas_given_int_and_double_columns_promotes_to_double():
+    tables = [pa.table({"iotreadings_value1": [1]}), pa.table({"iotreadings_value1": [1.5]})]
+
+    schema = unify_sparse_schemas(tables)
+
+    assert schema.field("iotreadings_value1").type == pa.float64()
+
+
+# Writing tests
+
+
+def test_pass_row_group_pieces_given_tables_slices_them_into_row_groups_of_max_rows():
+    tables = [pa.table({"a": [1, 2, 3]}), pa.table({"b": ["x", "y"]})]
+
+    row_groups = list(row_group_pieces(tables, max_rows_per_group=2))
+
+    assert [[piece.num_rows for piece in pieces] for pieces in row_groups] == [[2], [1, 1], [1]]
+
+
+def test_pass_padded_table_given_missing_columns_adds_shared_null_slices_and_casts_to_schema_types():
+    schema = pa.schema([("timestamp", pa.string()), ("value1", pa.float64()), ("value2", pa.int64())])
+    pieces = [pa.table({"value1": [1, 2], "timestamp": ["t1", "t2"]}), pa.table({"timestamp": ["t3"], "value2": [5]})]
+    null_arrays = {}
+
+    padded = padded_table(pieces, schema, null_arrays, max_rows=10)
+
+    assert padded.schema == schema
+    assert padded.to_pydict() == {
+        "timestamp": ["t1", "t2", "t3"],
+        "value1": [1.0, 2.0, None],
+        "value2": [None, None, 5],
+    }
+    assert set(null_arrays) == {pa.int64(), pa.float64()}
+
+
+def test_pass_write_sparse_dataset_given_tables_writes_part_files_with_unified_schema(temp_dir):
+    tables = [pa.table({"timestamp": ["t1", "t2", "t3"], "value1": [1, 2, 3]}), pa.table({"timestamp": ["t4"]})]
+    schema = unify_sparse_schemas(tables)
+    directory_path = os.path.join(temp_dir, "chunk.parquet")
+
+    file_paths = write_sparse_dataset(tables, schema, directory_path, max_rows_per_file=2, max_rows_per_group=2)
+
+    assert [os.path.basename(file_path) for file_path in file_paths] == ["part-0.parquet", "part-1.parquet"]
+    assert pq.read_metadata(file_paths[1]).num_row_groups == 1
+    assert pq.read_table(directory_path).to_pydict() == {
+        "timestamp": ["t1", "t2", "t3", "t4"],
+        "value1": [1, 2, 3, None],
+    }
+
+
+def test_pass_write_sparse_dataset_given_arrow_file_format_writes_ipc_file_with_batch_per_row_group(temp_dir):
+    tables = [pa.table({"timestamp": ["t1", "t2", "t3"], "value1": [1, 2, 3]}), pa.table({"timestamp": ["t4"]})]
+    schema = unify_sparse_schemas(tables)
+    directory_path = os.path.join(temp_dir, "chunk.arrow")
+
+    file_paths = write_sparse_dataset(
+        tables, schema, directory_path, "part-{i}.arrow", max_rows_per_group=2, compression="lz4", file_format="arrow"
+    )
+
+    assert [os.path.basename(file_path) for file_path in file_paths] == ["part-0.arrow"]
+    assert chunk_schema(file_paths[0]) == schema
+    reader = pa.ipc.open_file(file_paths[0])
+    assert reader.num_record_batches == 2
+    assert reader.read_all().to_pydict() == {"timestamp": ["t1", "t2", "t3", "t4"], "value1": [1, 2, 3, None]}
+
+
+# Sparse row groups tests
+
+
+def test_pass_sparse_row_groups_given_parquet_file_skips_all_null_columns(temp_dir):
+    file_path = os.path.join(temp_dir, "part-0.parquet")
+    schema = pa.schema([("timestamp", pa.string()), ("value1", pa.int64()), ("value2", pa.int64())])
+    pq.write_table(pa.table([["t1", "t2", "t3"], [1, None, 3], [None, None, None]], schema=schema), file_path)
+
+    row_groups = list(sparse_row_groups([file_path]))
+
+    assert [row_group.column_names for row_group in row_groups] == [["timestamp", "value1"]]
+
+
+def test_pass_sparse_row_groups_given_arrow_file_maps_batches_and_skips_all_null_columns(temp_dir):
+    file_path = os.path.join(temp_dir, "part-0.arrow")
+    schema = pa.schema([("timestamp", pa.string()), ("value1", pa.int64()), ("value2", pa.int64())])
+    with pa.ipc.new_file(file_path, schema) as writer:
+        writer.write_table(pa.table([["t1", "t2"], [1, None], [None, None]], schema=schema))
+        writer.write_table(pa.table([["t3"], [None], [5]], schema=schema))
+
+    row_groups = list(sparse_row_groups([file_path]))
+
+    assert [row_group.to_pydict() for row_group in row_groups] == [
+        {"timestamp": ["t1", "t2"], "value1": [1, None]},
+        {"timestamp": ["t3"], "value2": [5]},
+    ]
+
+
+@pytest.mark.parametrize("extension", ["parquet", "arrow"])
+def test_pass_chunk_footer_schema_given_end_of_chunk_file_returns_its_schema(temp_dir, extension):
+    file_path = os.path.join(temp_dir, f"part-0.{extension}")
+    table = pa.table({"timestamp": ["t1", "t2"], "value1": [1, 2], "value2": [None, 2.5]})
+    if extension == "arrow":
+        with pa.ipc.new_file(file_path, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, file_path)
+    with open(file_path, "rb") as f:
+        data = f.read()
+    footer_bytes = chunk_footer_bytes(file_path, data[-16:])
+
+    schema = chunk_footer_schema(file_path, data[-footer_bytes - 3 :])
+
+    assert footer_bytes < len(data)
+    assert schema.remove_metadata() == chunk_schema(file_path).remove_metadata() == table.schema
+
+
+def test_fail_chunk_footer_bytes_given_end_of_file_without_footer():
+    with pytest.raises(ValueError, match="doesn't end with the PAR1 footer"):
+        chunk_footer_bytes("15min_chunks/part-0.parquet", b"{}")
+
+
+def test_pass_non_null_columns_given_nested_column_keeps_it_when_any_leaf_has_values(temp_dir):
+    file_path = os.path.join(temp_dir, "part-0.parquet")
+    pq.write_table(
+        pa.table({"location": [{"lat": 1.0, "lon": None}], "value1": pa.array([None], pa.int64())}), file_path
+    )
+
+    columns = non_null_columns(pq.read_metadata(file_path).row_group(0))
+
+    assert columns == ["location"]
@@ -0,0 +1,94 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from lambda_processing.upload_ledger import S3UploadLedger, run_id, upload_ledger_from_env
+from tests.fake_s3 import FakeS3Client
+
+PARQUET_FILES_BUCKET_NAME = "s3silver-bucket"
+DAILY_KEY = "job_1001/s3bronze-bucket/mars/2023/04/01/2023-04-01.1001.snappy.parquet/part-0.parquet"
+
+
+# S3 upload ledger tests
+
+
+def test_pass_s3_upload_ledger_given_saved_ledger_returns_recorded_checksums():
+    s3_client = FakeS3Client()
+    ledger = S3UploadLedger(s3_client, PARQUET_FILES_BUCKET_NAME, "parquet_files_processor/0011aabb")
+    ledger.record(DAILY_KEY, "checksum-1")
+
+    ledger.save()
+
+    saved = json.loads(
+        s3_client.objects[(PARQUET_FILES_BUCKET_NAME, "_ledger/uploads/parquet_files_processor/0011aabb.json")]
+    )
+    assert saved == {"checksums": {DAILY_KEY: "checksum-1"}}
+    retry_ledger = S3UploadLedger(s3_client, PARQUET_FILES_BUCKET_NAME, "parquet_files_processor/0011aabb")
+    assert retry_ledger.checksum(DAILY_KEY) == "checksum-1"
+    assert retry_ledger.checksum("job_1001/other.parquet") is None
+
+
+def test_pass_s3_upload_ledger_checkpoint_saves_new_records_once_per_interval():
+    s3_client = FakeS3Client()
+    ledger = S3UploadLedger(s3_client, PARQUET_FILES_BUCKET_NAME, "run-1", checkpoint_interval_seconds=0)
+
+    ledger.checkpoint()
+    ledger.record(DAILY_KEY, "checksum-1")
+    ledger.checkpoint()
+    ledger.checkpoint()
+
+    assert s3_client.requests["put_object"] == 1
+
+
+def test_pass_s3_upload_ledger_delete_given_saved_ledger_removes_it():
+    s3_client = FakeS3Client()
+    ledger = S3UploadLedger(s3_client, PARQUET_FILES_BUCKET_NAME, "run-1")
+    ledger.record(DAILY_KEY, "checksum-1")
+    ledger.save()
+
+    ledger.delete()
+    ledger.delete()
+
+    assert s3_client.keys(PARQUET_FILES_BUCKET_NAME) == []
+    assert s3_client.requests["delete_object"] == 1
+
+
+def test_fail_s3_upload_ledger_given_access_denied_raises_error():
+    s3_client = MagicMock()
+    s3_client.get_object.side_effect = ClientError({"Error": {"Code": "AccessDenied"}}, "GetObject")
+
+    with pytest.raises(ClientError):
+        S3UploadLedger(s3_client, PARQUET_FILES_BUCKET_NAME, "run-1").checksum(DAILY_KEY)
+
+
+# Run id tests
+
+
+def test_pass_run_id_given_same_keys_in_other_order_returns_same_id():
+    assert run_id("parquet_files_processor", ["b", "a"]) == run_id("parquet_files_processor", ["a", "b"])
+    assert run_id("parquet_files_processor", ["a"]) != run_id("parquet_files_processor", ["a", "b"])
+    assert run_id("files_processor", ["3fde7b3b"]).startswith("files_processor/")
+
+
+# Upload ledger from env tests
+
+
+def test_pass_upload_ledger_from_env_given_empty_value_returns_none():
+    with patch.dict("os.environ", {"UPLOAD_LEDGER": ""}):
+        assert upload_ledger_from_env(MagicMock(), "files_processor", ["3fde7b3b"]) is None
+
+
+def test_pass_upload_ledger_from_env_given_s3_returns_ledger_in_parquet_files_bucket():
+    variables = {"UPLOAD_LEDGER": "s3", "PARQUET_FILES_BUCKET_NAME": PARQUET_FILES_BUCKET_NAME}
+    with patch.dict("os.environ", variables):
+        ledger = upload_ledger_from_env(MagicMock(), "files_processor", ["3fde7b3b"])
+
+    assert ledger.bucket == PARQUET_FILES_BUCKET_NAME
+    assert ledger.key() == f"_ledger/uploads/{run_id('files_processor', ['3fde7b3b'])}.json"
+
+
+def test_fail_upload_ledger_from_env_given_unknown_type_raises_error():
+    with patch.dict("os.environ", {"UPLOAD_LEDGER": "dynamodb"}), pytest.raises(ValueError):
+        upload_ledger_from_env(MagicMock(), "files_processor", ["3fde7b3b"])
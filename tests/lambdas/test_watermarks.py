@@ -0,0 +1,94 @@
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from lambda_processing.watermarks import (
+    S3Watermarks,
+    is_late_chunk_key,
+    late_chunk_file_name,
+    watermarks_from_env,
+)
+from tests.fake_s3 import FakeS3Client
+
+PARQUET_FILES_BUCKET_NAME = "s3silver-bucket"
+JOB = "job_842d6e1c-0630-4af8-a3e1-8d18a24ce805"
+
+
+# S3 watermarks tests
+
+
+def test_pass_s3_watermarks_given_no_saved_watermarks_returns_empty_dict():
+    watermarks = S3Watermarks(FakeS3Client(), PARQUET_FILES_BUCKET_NAME, timedelta(minutes=30))
+
+    assert watermarks.watermarks(JOB) == {}
+
+
+def test_pass_s3_watermarks_given_advanced_products_returns_latest_timestamps_minus_lateness():
+    watermarks = S3Watermarks(FakeS3Client(), PARQUET_FILES_BUCKET_NAME, timedelta(minutes=30))
+
+    watermarks.advance(JOB, {"mars": utc(13, 40), "pluto": utc(10, 0)})
+    watermarks.advance(JOB, {"mars": utc(12, 0)})
+
+    assert watermarks.watermarks(JOB) == {"mars": utc(13, 10), "pluto": utc(9, 30)}
+
+
+def test_pass_s3_watermarks_save_keeps_later_timestamps_saved_by_concurrent_invocation():
+    s3_client = FakeS3Client()
+    watermarks = S3Watermarks(s3_client, PARQUET_FILES_BUCKET_NAME, timedelta(minutes=30))
+    concurrent_watermarks = S3Watermarks(s3_client, PARQUET_FILES_BUCKET_NAME, timedelta(minutes=30))
+    watermarks.advance(JOB, {"mars": utc(13, 40), "pluto": utc(10, 0)})
+    concurrent_watermarks.advance(JOB, {"mars": utc(14, 0)})
+
+    concurrent_watermarks.save()
+    watermarks.save()
+
+    saved = json.loads(s3_client.objects[(PARQUET_FILES_BUCKET_NAME, f"_watermarks/{JOB}.json")])
+    assert saved == {"max_timestamps": {"mars": "2024-09-30T14:00:00+00:00", "pluto": "2024-09-30T10:00:00+00:00"}}
+    assert S3Watermarks(s3_client, PARQUET_FILES_BUCKET_NAME, timedelta(0)).watermarks(JOB)["mars"] == utc(14, 0)
+
+
+def test_pass_s3_watermarks_save_given_nothing_advanced_writes_nothing():
+    s3_client = FakeS3Client()
+    watermarks = S3Watermarks(s3_client, PARQUET_FILES_BUCKET_NAME, timedelta(minutes=30))
+
+    watermarks.watermarks(JOB)
+    watermarks.save()
+
+    assert s3_client.requests["put_object"] == 0
+
+
+# Late chunk key tests
+
+
+def test_pass_late_chunk_file_name_given_timestamp_returns_chunk_of_its_day():
+    file_name = late_chunk_file_name(utc(13, 40), "3fde7b3b", "parquet")
+
+    assert file_name == "2024-09-30T_late-3fde7b3b.parquet"
+    assert is_late_chunk_key(f"15min_chunks/{JOB}/s3bronze-bucket/mars/{file_name}/part-0.parquet")
+    assert not is_late_chunk_key(
+        f"15min_chunks/{JOB}/s3bronze-bucket/mars/2024-09-30T13_45m-3fde7b3b.arrow/part-0.arrow"
+    )
+
+
+# Watermarks from env tests
+
+
+def test_pass_watermarks_from_env_given_no_allowed_lateness_returns_none():
+    with patch.dict("os.environ", {"PARQUET_FILES_BUCKET_NAME": PARQUET_FILES_BUCKET_NAME}):
+        assert watermarks_from_env(FakeS3Client()) is None
+
+
+def test_pass_watermarks_from_env_given_allowed_lateness_returns_s3_watermarks():
+    variables = {"PARQUET_FILES_BUCKET_NAME": PARQUET_FILES_BUCKET_NAME, "ALLOWED_LATENESS_MINUTES": "90"}
+    with patch.dict("os.environ", variables):
+        watermarks = watermarks_from_env(FakeS3Client())
+
+    assert watermarks.bucket == PARQUET_FILES_BUCKET_NAME
+    assert watermarks.allowed_lateness == timedelta(minutes=90)
+
+
+# Helper functions
+
+
+def utc(hour, minute):
+    return datetime(2024, 9, 30, hour, minute, tzinfo=timezone.utc)
@@ -0,0 +1,53 @@
+from unittest.mock import MagicMock, patch
+
+from lambda_processing.work_budget import WorkBudget, memory_used_bytes
+
+
+def build_context(remaining_millis=600000, memory_limit_in_mb=256):
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = remaining_millis
+    context.memory_limit_in_mb = memory_limit_in_mb
+    return context
+
+
+# Exhausted reason tests
+
+
+def test_pass_exhausted_reason_given_enough_time_and_memory_returns_none():
+    budget = WorkBudget(build_context(remaining_millis=60000), time_reserve_seconds=30)
+    budget.record_file(10000)
+
+    with patch("lambda_processing.work_budget.memory_used_bytes", return_value=100 * 1024 * 1024):
+        assert budget.exhausted_reason() is None
+
+
+def test_pass_exhausted_reason_given_less_time_than_reserve_and_longest_file_returns_reason():
+    budget = WorkBudget(build_context(remaining_millis=35000), time_reserve_seconds=30)
+    budget.record_file(3000)
+    budget.record_file(8000)
+
+    with patch("lambda_processing.work_budget.memory_used_bytes", return_value=0):
+        assert budget.exhausted_reason() == "35000 ms left, 38000 ms needed for the next file and upload"
+
+
+def test_pass_exhausted_reason_given_memory_above_limit_share_returns_reason():
+    budget = WorkBudget(build_context(memory_limit_in_mb=256), memory_limit_share=0.5)
+
+    with patch("lambda_processing.work_budget.memory_used_bytes", return_value=200 * 1024 * 1024):
+        assert budget.exhausted_reason() == "200 MB of 256 MB memory used"
+
+
+def test_pass_exhausted_reason_given_context_without_limits_returns_none():
+    assert WorkBudget({}).exhausted_reason() is None
+
+
+def test_pass_from_env_given_variables_returns_budget_with_them():
+    variables = {"SPLIT_TIME_RESERVE_SECONDS": "12", "SPLIT_MEMORY_LIMIT_SHARE": "0.6"}
+    with patch.dict("os.environ", variables):
+        budget = WorkBudget.from_env(build_context())
+
+    assert (budget.time_reserve_millis, budget.memory_limit_share) == (12000, 0.6)
+
+
+def test_pass_memory_used_bytes_returns_resident_memory_of_process():
+    assert memory_used_bytes() > 0
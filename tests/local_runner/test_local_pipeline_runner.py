@@ -0,0 +1,132 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+import pyarrow.parquet as pq
+import pytest
+from botocore.exceptions import ClientError
+
+from local_runner.local_pipeline_runner import run_pipeline
+from local_runner.local_s3_client import BucketRoutingS3Client, LocalDirectoryS3Client
+
+DATA_DIRECTORY_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+SILVER_PREFIX = "job_1001/medallion-lakehouse-s3bronze"
+
+
+@pytest.fixture(autouse=True)
+def mock_env_variables():
+    # Runner sets bucket names for the pool processes, they are restored after each test
+    with patch.dict("os.environ", {"WRITE_JOB_MANIFEST": "true", "PROCESSING_LEDGER": "s3"}):
+        yield
+
+
+@pytest.fixture
+def temp_dir():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        yield tmpdirname
+
+
+# Local S3 client tests
+
+
+def test_pass_local_directory_s3_client_given_key_prefix_maps_keys_to_flat_directory(temp_dir):
+    with open(os.path.join(temp_dir, "raw-1.json"), "w") as f:
+        f.write("[]")
+    client = LocalDirectoryS3Client(temp_dir, "2023/04/15/job_1001/")
+
+    client.download_file("bucket", "2023/04/15/job_1001/raw-1.json", os.path.join(temp_dir, "copy"))
+
+    assert client.object_keys(".json") == ["2023/04/15/job_1001/raw-1.json"]
+    with open(os.path.join(temp_dir, "copy")) as f:
+        assert f.read() == "[]"
+
+
+def test_fail_local_directory_s3_client_given_missing_key_raises_no_such_key(temp_dir):
+    client = BucketRoutingS3Client({"bucket": LocalDirectoryS3Client(temp_dir)})
+
+    with pytest.raises(ClientError) as error:
+        client.get_object(Bucket="bucket", Key="_ledger/missing.json")
+
+    assert error.value.response["Error"]["Code"] == "NoSuchKey"
+
+
+@pytest.mark.parametrize(
+    "byte_range, expected",
+    [("bytes=2-5", b"2345"), ("bytes=-3", b"789"), ("bytes=7-", b"789"), ("bytes=8-20", b"89"), (None, b"0123456789")],
+)
+def test_pass_local_directory_s3_client_given_range_reads_only_its_bytes(temp_dir, byte_range, expected):
+    with open(os.path.join(temp_dir, "chunk.parquet"), "wb") as f:
+        f.write(b"0123456789")
+    client = LocalDirectoryS3Client(temp_dir)
+
+    kwargs = {"Range": byte_range} if byte_range else {}
+    response = client.get_object(Bucket="bucket", Key="chunk.parquet", **kwargs)
+
+    assert response["Body"].read() == expected
+    assert response["ContentLength"] == len(expected)
+
+
+def test_fail_local_directory_s3_client_given_multiple_ranges_raises_value_error(temp_dir):
+    with open(os.path.join(temp_dir, "chunk.parquet"), "wb") as f:
+        f.write(b"0123456789")
+    client = LocalDirectoryS3Client(temp_dir)
+
+    with pytest.raises(ValueError, match="Unsupported Range"):
+        client.get_object(Bucket="bucket", Key="chunk.parquet", Range="bytes=0-1,4-5")
+
+
+def test_pass_local_directory_s3_client_given_prefix_lists_and_deletes_objects_page_by_page(temp_dir):
+    client = BucketRoutingS3Client({"bucket": LocalDirectoryS3Client(temp_dir)})
+    for key in ["15min_chunks/a.parquet", "15min_chunks/b.parquet", "15min_chunks/c.parquet", "other/d.json"]:
+        client.put_object(Bucket="bucket", Key=key, Body=b"data")
+
+    first_page = client.list_objects_v2(Bucket="bucket", Prefix="15min_chunks/", MaxKeys=2)
+    second_page = client.list_objects_v2(
+        Bucket="bucket", Prefix="15min_chunks/", MaxKeys=2, ContinuationToken=first_page["NextContinuationToken"]
+    )
+    response = client.delete_objects(
+        Bucket="bucket", Delete={"Objects": [{"Key": "15min_chunks/a.parquet"}, {"Key": "15min_chunks/missing"}]}
+    )
+
+    assert [entry["Key"] for entry in first_page["Contents"]] == ["15min_chunks/a.parquet", "15min_chunks/b.parquet"]
+    assert first_page["IsTruncated"]
+    assert [entry["Key"] for entry in second_page["Contents"]] == ["15min_chunks/c.parquet"]
+    assert not second_page["IsTruncated"]
+    assert second_page["Contents"][0]["Size"] == 4
+    assert response["Deleted"] == [{"Key": "15min_chunks/a.parquet"}, {"Key": "15min_chunks/missing"}]
+    assert client.list_objects_v2(Bucket="bucket", Prefix="15min_chunks/")["KeyCount"] == 2
+
+
+# Pipeline runner tests
+
+
+def test_pass_run_pipeline_given_flat_directory_writes_chunks_daily_files_and_job_manifest(temp_dir):
+    destination = os.path.join(temp_dir, "silver")
+
+    report = run_pipeline(DATA_DIRECTORY_PATH, destination, processes=2, files_per_processor=1, job_uuid="1001")
+
+    assert report["raw_files"] == 2
+    assert report["daily_files"] == 2
+    assert report["chunk_files"] > 0
+    mars_path = os.path.join(destination, SILVER_PREFIX, "mars/2023/04/01/2023-04-01.1001.snappy.parquet")
+    jupiter_path = os.path.join(destination, SILVER_PREFIX, "jupiter/2024/01/01/2024-01-01.1001.snappy.parquet")
+    assert pq.read_table(mars_path).num_rows > 0
+    assert pq.read_table(jupiter_path).num_rows > 0
+    # Entries of both days end up in the manifest, though they were assembled by different processes
+    with open(os.path.join(destination, "job_1001/_manifest.json")) as f:
+        manifest = json.load(f)
+    assert {entry["product"] for entry in manifest["files"]} == {"mars", "jupiter"}
+
+
+def test_pass_run_pipeline_given_directory_with_job_keys_keeps_them(temp_dir):
+    source = os.path.join(temp_dir, "bronze")
+    job_path = os.path.join(source, "2023/04/15/job_1001")
+    shutil.copytree(DATA_DIRECTORY_PATH, job_path)
+    destination = os.path.join(temp_dir, "silver")
+
+    report = run_pipeline(source, destination, processes=2, job_uuid="ignored")
+
+    assert report["raw_files"] == 2
+    assert os.path.isdir(os.path.join(destination, SILVER_PREFIX, "mars"))